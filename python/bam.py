@@ -8,9 +8,30 @@
 #  @author Flavia Roma
 #  @date 01/01/2019
 #
-import numpy, sys
+import sys
 
 from math import ldexp, frexp
+from array import array
+
+## Return a module that is only loaded when one of its attributes is first used,
+#  so a process that never needs it does not pay for its import. A module already loaded is returned as it is.
+#
+#  @param name module name.
+#  @return the module.
+#
+def lazyImport(name):
+    if name in sys.modules:
+       return sys.modules[name]
+    import importlib.util
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+## numpy takes most of the startup time: it is not loaded for a curve taken from the cache.
+numpy = lazyImport("numpy")
 
 ## Whether using the flail driver for writing a file, instead of turtle for drawing on screen.
 usingFlail = None
@@ -29,6 +50,10 @@ NBITS = 8
 ## Scale for fixed point: 256 or 65536, for instance.
 BSCALE = 2**NBITS # 1<<NBITS
 
+## Whether lengths in [-180,180) are coded as BAM, and only the others in fixed point (see toInt).
+#  When False, every length is coded in fixed point, with NBITS bits after the binary point.
+useBAM = True
+
 ## Maps a float number to integer.
 #
 #  @see https://www.youtube.com/watch?v=wbxSTxhTmrs&fbclid=IwAR2f04_45mIFGtIczSOzbB8nxfqb6SX0pkVlxySfnnBf4n6e8KdKRHXkY2I
@@ -56,7 +81,7 @@ int2Float = lambda b: ldexp(float(b),-NBITS) # b*(2**-NBITS)
 def toInt (x):
     t = ""
 
-    if -180 <= x and x < 180:
+    if useBAM and -180 <= x and x < 180:
        i = float2BAM(x)
        t = "underflow = " if i == 0 else "BAM = "
     else:
@@ -65,19 +90,33 @@ def toInt (x):
     f = toFloat(i)
  
     if __toDebug__:
-       bin = toBinary(i)
-       print("length = %s%d = %s= %d" % (t, i, bin, toDenary(bin)))
-       # Return the mantissa and exponent of x as the pair (m, e). 
-       # m is a float and e is an integer such that x == m * 2**e exactly. 
-       m, e = frexp(x)
-       print("x = m * 2**e = %f * %f" % (m,2**e))
-       print("x = %.4f, f = %.4f, err = %f\n" % (x,f, x-f))
+       printLength(x, i, f, t)
 
     return i if usingFlail else f
 
+## Print how a length was coded: its code, in binary, and the error (the debugging output of toInt).
+#
+#  @param x a length.
+#  @param i its code.
+#  @param f the float value of the code.
+#  @param t the kind of code: "BAM = ", "underflow = ", or "" for fixed point.
+#
+def printLength(x, i, f, t=""):
+    bin = toBinary(i)
+    print("length = %s%d = %s= %d" % (t, i, bin, toDenary(bin)))
+    # Return the mantissa and exponent of x as the pair (m, e). 
+    # m is a float and e is an integer such that x == m * 2**e exactly. 
+    m, e = frexp(x)
+    print("x = m * 2**e = %f * %f" % (m,2**e))
+    print("x = %.4f, f = %.4f, err = %f\n" % (x,f, x-f))
+
 ## Get the float representation of an integer number.
-def toFloat(b):
-    if -32768 <= b < 32768:
+#  @param fmt a format (nbits, useBAM), as returned by getFormat. The default is the current format.
+def toFloat(b, fmt=None):
+    if fmt is not None:
+       nbits, bam = fmt
+       return BAM2float(b) if bam and -32768 <= b < 32768 else ldexp(float(b),-nbits)
+    if useBAM and -32768 <= b < 32768:
        return BAM2float(b)
     else:
        return int2Float(b)
@@ -144,11 +183,20 @@ def toUBAM(x):
     i = float2UBAM(x)
     f = BAM2float(i)
     if __toDebug__:
-        bin = toBinary(i)
-        print("angle = UBAM = %d = %s= %d" % (i,bin,toDenary(bin)))
-        print("x = %.4f, f = %.4f, err = %f"  % (x,f, x-f))
+        printAngle(x, i, f)
     return i if usingFlail else f
 
+## Print how an angle was coded in UBAM (the debugging output of toUBAM).
+#
+#  @param x an angle as a float.
+#  @param i its UBAM code.
+#  @param f the float value of the code.
+#
+def printAngle(x, i, f):
+    bin = toBinary(i)
+    print("angle = UBAM = %d = %s= %d" % (i,bin,toDenary(bin)))
+    print("x = %.4f, f = %.4f, err = %f"  % (x,f, x-f))
+
 ## BAM bit table.
 #
 #  sum(bam_bit_table) = 359.9939
@@ -251,6 +299,337 @@ def float2BAM (_num):
 def BAM2float(b):
     return b * LSB
 
+## Convert an array of float numbers to UBAM, all at once.
+#
+#  The default is a vectorized walk over bam_bit_table, which agrees bit-for-bit with float2UBAM.
+#
+#  The closed form, @f$\lfloor num / LSB \rfloor@f$, is used when \e exact is False.
+#  Since the low entries of bam_bit_table are rounded to four decimal places (0.0055, 0.0109, ..., 1.406),
+#  it differs from the table walk by one LSB (@f$\pm 0.0055^{\circ}@f$) for about 5% of the angles.
+#  Both saturate the same way: negative angles (and NaN) map to 0, and angles @f$\ge 360^{\circ}@f$ map to 65535.
+#
+#  @param nums a sequence (or numpy array) of float numbers.
+#  @param exact whether to walk the bit table, instead of using the closed form.
+#  @return a numpy array of uint16, with the shape of nums.
+#
+def float2UBAMArray (nums, exact=True):
+    num = numpy.array(nums, dtype=numpy.float64)
+    if not exact:
+       return numpy.clip(numpy.floor(num / LSB), 0, 65535).astype(numpy.uint16)
+    res = numpy.zeros(num.shape, dtype=numpy.uint16)
+    for i in range(WSIZE, -1, -1):
+        bit = num >= bam_bit_table[i]
+        num = numpy.where(bit, num - bam_bit_table[i], num)
+        res |= bit.astype(numpy.uint16) << i
+    return res
+
+## Convert an array of float numbers to signed BAM.
+#  Angles in [180,360) wrap around to negative int16 values, exactly as float2BAM does.
+#
+#  @param nums a sequence (or numpy array) of float numbers.
+#  @param exact whether to walk the bit table (see float2UBAMArray).
+#  @return a numpy array of int16, with the shape of nums.
+#
+def float2BAMArray (nums, exact=True):
+    num = numpy.asarray(nums, dtype=numpy.float64)
+    res = float2UBAMArray(numpy.abs(num), exact).astype(numpy.int16)
+    return numpy.where(num > 0, res, -res)
+
+## Convert an array of BAM (or UBAM) angles to float.
+BAM2floatArray = lambda b: numpy.asarray(b) * LSB
+
+## Vectorized float2Int: truncate towards zero, as int() does.
+#  @param nbits number of bits after the binary point (default NBITS).
+float2IntArray = lambda f, nbits=None: numpy.trunc(numpy.ldexp(numpy.asarray(f, dtype=numpy.float64), NBITS if nbits is None else nbits)).astype(numpy.int64)
+
+## Vectorized int2Float.
+#  @param nbits number of bits after the binary point (default NBITS).
+int2FloatArray = lambda b, nbits=None: numpy.ldexp(numpy.asarray(b, dtype=numpy.float64), -(NBITS if nbits is None else nbits))
+
+## Get the integer codes toInt would produce for an array of lengths, regardless of usingFlail.
+#
+#  @param x a sequence (or numpy array) of float numbers.
+#  @param exact whether to walk the bit table (see float2UBAMArray).
+#  @param fmt a format (nbits, useBAM), as returned by getFormat. The default is the current format.
+#  @return a numpy array of int64: BAM for values in [-180,180) (if useBAM), and fixed point otherwise.
+#
+def float2FixedArray (x, exact=True, fmt=None):
+    nbits, bam = getFormat() if fmt is None else fmt
+    x = numpy.asarray(x, dtype=numpy.float64)
+    inBAM = (-180 <= x) & (x < 180) & bam
+    return numpy.where(inBAM, float2BAMArray(x, exact), float2IntArray(x, nbits))
+
+## Vectorized toFloat.
+#  @param fmt a format (nbits, useBAM), as returned by getFormat. The default is the current format.
+def toFloatArray(b, fmt=None):
+    nbits, bam = getFormat() if fmt is None else fmt
+    b = numpy.asarray(b)
+    return numpy.where((-32768 <= b) & (b < 32768) & bam, BAM2floatArray(b), int2FloatArray(b, nbits))
+
+## Return the current fixed-point format for lengths, as a tuple (NBITS, useBAM).
+getFormat = lambda: (NBITS, useBAM)
+
+## Set the fixed-point format for lengths.
+#
+#  @param nbits number of bits after the binary point.
+#  @param bam whether lengths in [-180,180) are coded as BAM (see toInt).
+#
+def setFormat(nbits, bam=False):
+    global NBITS, BSCALE, useBAM
+    NBITS = nbits
+    BSCALE = 2**NBITS
+    useBAM = bam
+
+## Return the name of a format, as written in FLAIL files: "BAM+Q8" or "Q10", for instance.
+#  @param fmt a format (nbits, useBAM). The default is the current format.
+def formatName(fmt=None):
+    nbits, bam = getFormat() if fmt is None else fmt
+    return ("BAM+Q%d" if bam else "Q%d") % nbits
+
+## Return the format (nbits, useBAM) with the given name (see formatName).
+def parseFormat(name):
+    bam = name.startswith("BAM+")
+    if bam: name = name[4:]
+    if not name.startswith("Q") or not name[1:].isdigit():
+       raise ValueError("invalid format name: %s" % name)
+    return (int(name[1:]), bam)
+
+## Choose the fixed-point format that codes a set of lengths with the smallest error, using 16-bit words.
+#
+#  The candidates are the current mixed scheme (BAM for lengths below 180, Q8 otherwise),
+#  and every pure Q format with 0 to 16 bits after the binary point.
+#  - A format fits if the codes of all (absolute) lengths are in [0,65535].
+#  - In the mixed scheme, fixed-point codes must also be at least 32768, so they are not taken as BAM (see toFloat).
+#
+#  Formats are ranked by the maximum absolute error, then by the mean absolute error,
+#  and then by the number of bits after the binary point (more is better).
+#
+#  @param lengths a sequence (or numpy array) of lengths.
+#  @return the best format (nbits, useBAM).
+#  @throw ValueError if no format fits.
+#
+def chooseFormat(lengths):
+    x = numpy.abs(numpy.asarray(lengths, dtype=numpy.float64).ravel())
+    best = None
+    for fmt in [(8, True)] + [(n, False) for n in range(WSIZE+2)]:
+        codes = float2FixedArray(x, fmt=fmt)
+        if len(x) and codes.max() > 65535:
+           continue
+        if fmt[1] and numpy.any((x >= 180) & (codes < 32768)):
+           continue
+        err = numpy.abs(x - toFloatArray(codes, fmt)) if len(x) else numpy.zeros(1)
+        rank = (err.max(), err.mean(), -fmt[0])
+        if best is None or rank < best[0]:
+           best = (rank, fmt)
+    if best is None:
+       raise ValueError("lengths up to %f do not fit in 16-bit words" % x.max())
+    return best[1]
+
+## Vectorized toInt (without the debugging output).
+#
+#  @param x a sequence (or numpy array) of lengths.
+#  @param fmt a format (nbits, useBAM), as returned by getFormat. The default is the current format.
+#  @param flail whether to return codes, instead of floats. The default is usingFlail.
+#  @return integer codes if flail, or their float values otherwise.
+#
+def toIntArray (x, fmt=None, flail=None):
+    i = float2FixedArray(x, fmt=fmt)
+    return i if (usingFlail if flail is None else flail) else toFloatArray(i, fmt)
+
+## Vectorized toUBAM (without the debugging output).
+#
+#  @param x a sequence (or numpy array) of angles.
+#  @param flail whether to return codes, instead of floats. The default is usingFlail.
+#  @return UBAM codes if flail, or their float values otherwise.
+#
+def toUBAMArray (x, flail=None):
+    i = float2UBAMArray(x)
+    return i if (usingFlail if flail is None else flail) else BAM2floatArray(i)
+
+## Number of fractional bits of the integer sine/cosine tables (Q15, as on most microcontrollers).
+TRIG_QBITS = 15
+
+## Sine and cosine tables already built, by (bits, qbits).
+_trigTables = {}
+
+## Return precomputed sine and cosine tables, indexed directly by a BAM word.
+#
+#  Entry \e k holds the sine (cosine) of @f$k\ 2^{16-bits}@f$ LSBs, so a 16-bit table has one entry per BAM step,
+#  and a coarser table (e.g. 8, 10 or 12 bits) is indexed by the most significant bits of the word,
+#  which is what a microcontroller with little memory would do.
+#
+#  @param bits number of bits of the table index: from 1 to 16.
+#  @param qbits if given, the tables hold integers in Q(qbits) format (@f$round(sin \times 2^{qbits})@f$), instead of floats.
+#  @return a tuple (sin, cos) of numpy arrays with @f$2^{bits}@f$ entries.
+#
+def trigTables(bits=WSIZE+1, qbits=None):
+    key = (bits, qbits)
+    if key not in _trigTables:
+       if not 0 < bits <= WSIZE+1:
+          raise ValueError("table bits must be in [1,%d]: %r" % (WSIZE+1, bits))
+       t = numpy.arange(1<<bits) * (2*numpy.pi / (1<<bits))
+       s, c = numpy.sin(t), numpy.cos(t)
+       if qbits is not None:
+          s = numpy.rint(numpy.ldexp(s, qbits)).astype(numpy.int32)
+          c = numpy.rint(numpy.ldexp(c, qbits)).astype(numpy.int32)
+       s.flags.writeable = c.flags.writeable = False
+       _trigTables[key] = (s, c)
+    return _trigTables[key]
+
+## Table index of a BAM (or UBAM) word, for a table with the given number of bits.
+#  Negative (signed BAM) words are taken in two's complement, so -b and 65536-b are the same angle.
+bamIndex = lambda b, bits=WSIZE+1: (numpy.asarray(b).astype(numpy.int64) & 0xFFFF) >> (WSIZE+1-bits)
+
+## Sine of a BAM word (or array of words), by table lookup.
+#
+#  @param b BAM or UBAM angle(s).
+#  @param bits table size (see trigTables).
+#  @param qbits integer table format (see trigTables).
+#
+def bamSin(b, bits=WSIZE+1, qbits=None):
+    return trigTables(bits, qbits)[0][bamIndex(b, bits)]
+
+## Cosine of a BAM word (or array of words), by table lookup.
+#  @see bamSin
+def bamCos(b, bits=WSIZE+1, qbits=None):
+    return trigTables(bits, qbits)[1][bamIndex(b, bits)]
+
+## Number of bits after the binary point of the positions tracked along a mission (see toPosition).
+#  With 16 bits, the lengths of every format chooseFormat may return are converted exactly.
+POS_QBITS = 16
+
+## Convert a length code to a position offset: an integer in Q(POS_QBITS) format.
+#  A BAM length @e b is @f$180 \times 2^{-15}\ b@f$, that is, @f$360\ b@f$ in Q16.
+#
+#  @param b length code (see toInt).
+#  @param fmt a format (nbits, useBAM), as returned by getFormat. The default is the current format.
+#  @return the length in position units.
+#
+def toPosition(b, fmt=None):
+    nbits, bam = getFormat() if fmt is None else fmt
+    b = int(b)
+    if bam and -32768 <= b < 32768:
+       return (b * 360) << (POS_QBITS - 16)
+    return b << (POS_QBITS - nbits) if nbits <= POS_QBITS else b >> (nbits - POS_QBITS)
+
+## Get the float value of a position (see toPosition).
+positionToFloat = lambda p: ldexp(float(p), -POS_QBITS)
+
+## Return the displacement of a step along a BAM heading, in integer arithmetic.
+#  The step is multiplied by the Q(TRIG_QBITS) cosine and sine of the heading and rounded to the nearest unit,
+#  as a microcontroller would do it, so the positions do not drift away from the ones the drone computes.
+#
+#  @param d step length, in any integer units (e.g. position units).
+#  @param heading BAM or UBAM angle.
+#  @return a tuple (dx, dy), in the units of d.
+#
+def bamStep(d, heading):
+    s, c = trigTables(WSIZE+1, TRIG_QBITS)
+    i = int(heading) & 0xFFFF
+    r = 1 << (TRIG_QBITS-1)
+    return (d * int(c[i]) + r) >> TRIG_QBITS, (d * int(s[i]) + r) >> TRIG_QBITS
+
+## Rotate a vector by a BAM angle, with the integer arithmetic of bamStep.
+#  Rotations by multiples of a right angle are exact.
+#
+#  @param x abscissa, in any integer units.
+#  @param y ordinate.
+#  @param ang BAM or UBAM angle.
+#  @return a tuple (x, y), in the units of the vector.
+#
+def bamRotate(x, y, ang):
+    s, c = trigTables(WSIZE+1, TRIG_QBITS)
+    i = int(ang) & 0xFFFF
+    c, s = int(c[i]), int(s[i])
+    r = 1 << (TRIG_QBITS-1)
+    return (x * c - y * s + r) >> TRIG_QBITS, (x * s + y * c + r) >> TRIG_QBITS
+
+## Vectorized toPosition.
+#  @return a numpy array of int64.
+def toPositionArray(b, fmt=None):
+    nbits, bam = getFormat() if fmt is None else fmt
+    b = numpy.asarray(b).astype(numpy.int64)
+    q = b << (POS_QBITS - nbits) if nbits <= POS_QBITS else b >> (nbits - POS_QBITS)
+    if bam:
+       q = numpy.where((-32768 <= b) & (b < 32768), (b * 360) << (POS_QBITS - 16), q)
+    return q
+
+## Vectorized bamStep: the same integer displacements, for arrays of steps and headings.
+#  @return a tuple (dx, dy) of numpy arrays of int64.
+def bamStepArray(d, heading):
+    s, c = trigTables(WSIZE+1, TRIG_QBITS)
+    i = bamIndex(heading)
+    d = numpy.asarray(d).astype(numpy.int64)
+    r = 1 << (TRIG_QBITS-1)
+    return (d * c[i] + r) >> TRIG_QBITS, (d * s[i] + r) >> TRIG_QBITS
+
+## Byte order of packed word streams: little endian, as on the drone microcontrollers.
+WORD_ORDER = "little"
+
+## Pack a sequence of (opcode, word) pairs into an array of unsigned 16-bit words.
+#
+#  Each pair takes two words: the opcode and its operand.
+#  Operands are taken modulo @f$2^{16}@f$, so negative (signed BAM) operands are stored in two's complement.
+#
+#  @param cmds a sequence of (opcode, word) pairs, or a numpy array with two columns.
+#  @return an array('H') with the opcodes at even positions and the operands at odd positions.
+#
+def packWords(cmds):
+    a = numpy.asarray(cmds, dtype=numpy.int64)
+    if a.size and (a.ndim != 2 or a.shape[1] != 2):
+       raise ValueError("expected (opcode, word) pairs")
+    return array('H', (a.ravel() & 0xFFFF).astype(numpy.uint16).tobytes())
+
+## Serialize (opcode, word) pairs, or an array('H') returned by packWords, into bytes (in WORD_ORDER).
+#
+#  For missions with many commands, this is about 4 bytes per command,
+#  instead of the 12 to 20 bytes of a FLAIL text line, such as "RollLeft(27306);".
+#
+#  @param cmds a sequence of (opcode, word) pairs, or an array('H').
+#  @return a bytes object.
+#
+def packBytes(cmds):
+    words = cmds if isinstance(cmds, array) else packWords(cmds)
+    if sys.byteorder != WORD_ORDER:
+       words = array('H', words)
+       words.byteswap()
+    return words.tobytes()
+
+## Read back a packed word stream.
+#
+#  On little-endian hosts, no byte is copied: the result is a view of the given buffer.
+#  The opcodes and operands are views as well: words[0::2] and words[1::2].
+#
+#  @param buf a bytes-like object, produced by packBytes.
+#  @return a memoryview of unsigned 16-bit words (format 'H').
+#
+def unpackWords(buf):
+    view = memoryview(buf).cast('B')
+    if len(view) % 4:
+       raise ValueError("packed stream size is not a multiple of 4 bytes: %d" % len(view))
+    if sys.byteorder != WORD_ORDER:
+       words = array('H', view.tobytes())
+       words.byteswap()
+       return memoryview(words)
+    return view.cast('H')
+
+## Return the (opcodes, operands) views of a packed word stream.
+#  @see unpackWords
+def unpackPairs(buf):
+    words = unpackWords(buf)
+    return words[0::2], words[1::2]
+
+## Write (opcode, word) pairs to a binary file.
+def writeWords(fname, cmds):
+    with open(fname, "wb") as f:
+       f.write(packBytes(cmds))
+
+## Read a binary file written by writeWords.
+#  @return a memoryview of unsigned 16-bit words (see unpackWords).
+def readWords(fname):
+    with open(fname, "rb") as f:
+       return unpackWords(f.read())
+
 ## Show UBAM angle wrap around.
 def main():
     turns = 0
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# coding: UTF-8
+#
+## @package curvecache
+#
+#  On-disk cache of generated command streams.
+#
+#  Each entry is a directory, named after the SHA-1 of everything the commands depend on,
+#  holding the files produced for a curve (FLAIL commands, QGC waypoints, ...) and a small
+#  json file with the state to be restored on a hit.
+#  The cache is bounded in size: the least recently used entries are evicted first
+#  (every hit touches the entry, so its modification time is the last use).
+#
+import os, sys, json, shutil, hashlib
+
+## Cache directory. The cache is disabled when None.
+cacheDir = None
+
+## Maximum size of the cache, in bytes.
+cacheLimit = 64 << 20
+
+## Name of the file, in each entry, holding its metadata.
+META = "meta.json"
+
+## Return the SHA-1 of the contents of a file, or None if it cannot be read.
+def fileDigest(fname):
+    h = hashlib.sha1()
+    try:
+       with open(fname, "rb") as f:
+          for block in iter(lambda: f.read(1 << 16), b""):
+              h.update(block)
+    except (IOError, OSError):
+       return None
+    return h.hexdigest()
+
+## Return the SHA-1 of the source files of the given modules,
+#  so entries generated by an older version of the code are never reused.
+#
+#  @param modules module objects.
+#
+def sourceDigest(*modules):
+    h = hashlib.sha1()
+    for m in modules:
+        fname = getattr(m, "__file__", None)
+        if fname is not None:
+           h.update(str(fileDigest(os.path.realpath(fname))).encode())
+    return h.hexdigest()
+
+## Return the key of a cache entry: the SHA-1 of the representation of all given items.
+cacheKey = lambda *items: hashlib.sha1(repr(items).encode()).hexdigest()
+
+## Return the directory of an entry.
+entryPath = lambda key: os.path.join(cacheDir, key)
+
+## Look up an entry, and mark it as the most recently used.
+#
+#  @param key entry key.
+#  @return a tuple (files, meta): the name and contents of each stored file, and the metadata;
+#  or None, on a miss.
+#
+def lookup(key):
+    path = entryPath(key)
+    try:
+       with open(os.path.join(path, META)) as f:
+          meta = json.load(f)
+       files = {}
+       for name in meta["files"]:
+           with open(os.path.join(path, name)) as f:
+              files[name] = f.read()
+       os.utime(path, None)
+    except (IOError, OSError, ValueError, KeyError):
+       return None
+    return files, meta
+
+## Store an entry, then evict the least recently used ones, if the cache got too big.
+#  The entry is written to a temporary directory and renamed, so a partial entry is never seen.
+#
+#  @param key entry key.
+#  @param files dictionary with the name and contents of each file.
+#  @param meta dictionary with any metadata (json serializable).
+#
+def store(key, files, meta=None):
+    path = entryPath(key)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    meta = dict(meta or {}, files=sorted(files))
+    try:
+       if not os.path.isdir(cacheDir):
+          os.makedirs(cacheDir)
+       shutil.rmtree(tmp, True)
+       os.mkdir(tmp)
+       for name, text in files.items():
+           with open(os.path.join(tmp, name), "w") as f:
+              f.write(text)
+       with open(os.path.join(tmp, META), "w") as f:
+          json.dump(meta, f)
+       shutil.rmtree(path, True)
+       os.rename(tmp, path)
+    except (IOError, OSError) as e:
+       print("Could not cache %s: %s" % (key, e))
+       shutil.rmtree(tmp, True)
+       return
+    evict()
+
+## Return the size, in bytes, of all files in a directory.
+def dirSize(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+## Remove the least recently used entries, until the cache is not bigger than limit.
+#
+#  @param limit maximum size in bytes. The default is cacheLimit.
+#  @return the number of entries removed.
+#
+def evict(limit=None):
+    if limit is None:
+       limit = cacheLimit
+    entries = []
+    for key in os.listdir(cacheDir):
+        path = entryPath(key)
+        if os.path.isdir(path) and not key.endswith(".tmp"):
+           entries.append((os.path.getmtime(path), dirSize(path), path))
+    entries.sort()
+    total = sum(e[1] for e in entries)
+    n = 0
+    for mtime, size, path in entries:
+        if total <= limit:
+           break
+        shutil.rmtree(path, True)
+        total -= size
+        n += 1
+    return n
+
+def main():
+    global cacheDir
+    cacheDir = sys.argv[1] if len(sys.argv) > 1 else "cache"
+    key = cacheKey("test", 1, 2.0)
+    store(key, {"a.txt": "hello\n"}, {"state": [0, 0.0]})
+    print(lookup(key))
+    print(evict(0))
+    print(lookup(key))
+
+if __name__=="__main__":
+   sys.exit(main())
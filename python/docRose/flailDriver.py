@@ -1,41 +1,12 @@
 #!/usr/bin/env python
 # coding: UTF-8
 
-import sys
-from math import sin, cos, radians, degrees, atan2, acos, pi
+import sys, io
 sys.path.append('../')
-from bam import toFloat, BAM2float, float2BAM
+from bam import BAM2float, float2BAM, float2UBAM, toPosition, positionToFloat, bamStep, bamRotate, parseFormat
 from mapper import mapper
-
-## Return m1 x m2 (m1 multiplied by m2).
-matMul = lambda m1, m2: [[sum(i*j for i, j in zip(row, col)) for col in zip(*m2)] for row in m1]
-
-## Return m x v (vector multiplied by matrix).
-vecMul = lambda m, v: [sum(i*j for i, j in zip(row, v)) for row in m]
-
-## Return vector v2 + v1.
-vecAdd = lambda v1, v2: [(i+j) for i,j in zip(v2,v1)]
-
-## Return vector v * s.
-vecScale = lambda v,s: [i*s for i in v]
-
-## Return a nxn identity matrix.
-identMat = lambda n: [[int(x==y) for x in range(n)] for y in range(n)]
-
-## Return a null vector of dimension n.
-nullVec = lambda n: [0]*n
-
-## Dot product of vectors v0 and v1.
-dotProd = lambda v0,v1: sum([u*v for u,v in zip(v0,v1)])
-
-## Cross product of vectors u and v.
-def crossProd (u,v): return u[0]*v[1]-v[0]*u[1]
-
-## counter-clockwise rotation about the Z axis
-ROT_Z = lambda z: [[cos(z), -sin(z), 0, 0],
-                   [sin(z),  cos(z), 0, 0],
-                   [  0,       0,    1, 0],
-                   [  0,       0,    0, 1]]
+from flail import BytecodeWriter, assemble
+from validator import validate
 
 ## Maps window coordinates to GIS coordinates.
 map = mapper([-1,-1,1,1],[-1,-1,1,1])
@@ -63,45 +34,229 @@ def setworldcoordinates(x0,y0,x1,y1):
 def speed(v):
     pass
 
+## Orientation and position of a FlailDriver, in the units of the mission.
+#  - heading: UBAM angle, wrapping around as a uint16, so a turn is an integer addition.
+#  - x, y, z: position, as integers in Q(bam.POS_QBITS) format (see bam.toPosition), so there is no drift.
+#
+class DriverState(object):
+    __slots__ = ("heading", "x", "y", "z")
+
+    def __init__(self, heading=0, x=0, y=0, z=0):
+        self.heading = heading
+        self.x = x
+        self.y = y
+        self.z = z
+
+## Compose two transforms, given as (heading change, dx, dy, dz) tuples:
+#  a, then b, whose displacement is in the frame a starts in.
+def composeTransform(a, b):
+    dx, dy = bamRotate(b[1], b[2], a[0])
+    return ((a[0] + b[0]) & 0xFFFF, a[1] + dx, a[2] + dy, a[3] + b[3])
+
+## Return a transform applied n times, by exponentiation by squaring.
+def powerTransform(t, n):
+    r = (0, 0, 0, 0)
+    while n > 0:
+        if n & 1:
+           r = composeTransform(r, t)
+        t = composeTransform(t, t)
+        n >>= 1
+    return r
+
 class FlailDriver:
 
     ## integer format
     formati = "(%d);\n"
     ## unsigned format
     formatu = "(%u);\n"
-    ## Matrix and vector dimension: 3x3 or 4x4.
-    #  Note that matMul will work even ROT_Z being 4x4 and MDIM being 3.
-    MDIM = 4
-
-    def __init__(self, shape, visible):
+    ## format for printing a point.
+    formatp = "%f, %f, %f\n"
+    ## file for turtle-flail commands.
+    flailFile = "../files/output.flail"
+    ## file for the positions visited.
+    pointFile = "../files/gps.flail"
+    ## file for the QGC waypoints.
+    gpsFile = "../files/gps.txt"
+    ## buffer size of the files opened by the driver, so commands and waypoints are not written one by one.
+    bufsize = 1 << 20
+    ## whether a Repeat writes the waypoints of every iteration, as if it was unrolled, or only the ones of the first iteration and its end (see repeat).
+    #  Callers needing every waypoint ask for them (see mission.Repeat).
+    repeatWaypoints = False
+    ## binary file for the bytecode of the commands, or None (see flail.BytecodeWriter.save).
+    byteFile = None
+    ## byte array text file of the Unity simulation for the bytecode of the commands, or None.
+    byteArrayFile = None
+
+    ## Constructor.
+    #  Each output (sink) is either a file name, opened by the driver with a large buffer,
+    #  or a stream given by the caller, such as an io.StringIO or sys.stdout, which the driver never closes.
+    #  The file names default to the class attributes, so each driver of a process may write its own files.
+    #
+    #  @param shape turtle shape (unused).
+    #  @param visible turtle visibility (unused).
+    #  @param flailFile file name or stream for turtle-flail commands.
+    #  @param pointFile file name or stream for the positions visited.
+    #  @param gpsFile file name or stream for the QGC waypoints.
+    #  @param byteFile binary file for the bytecode, saved on close.
+    #  @param byteArrayFile byte array text file for the bytecode, saved on close.
+    #  @param bytecode whether to generate the bytecode, even if it is not saved (see code).
+    #
+    def __init__(self, shape=None, visible=False, flailFile=None, pointFile=None, gpsFile=None,
+                 byteFile=None, byteArrayFile=None, bytecode=False):
+        self.flailFile = flailFile or FlailDriver.flailFile
+        self.pointFile = pointFile or FlailDriver.pointFile
+        self.gpsFile = gpsFile or FlailDriver.gpsFile
+        self.byteFile = byteFile or FlailDriver.byteFile
+        self.byteArrayFile = byteArrayFile or FlailDriver.byteArrayFile
+        ## bytecode of the commands written, or None if it is not generated.
+        self.code = BytecodeWriter() if bytecode or self.byteFile or self.byteArrayFile else None
+        ## whether the instructions are written: not while the iterations of a Repeat are replayed (see repeat).
+        self.writing = True
+        ## whether the moves write waypoints.
+        self.tracing = True
         ## file handle for turtle-flail commands.
-        self.f = open("../files/output.flail","w+")
-        self.f.write("SetMode(distance);\n")
+        self.f = self.openSink(self.flailFile, False)
+        self.command("SetMode", "(%s);\n", "distance")
         ## file handle for gps coordinates.
         self.g = None
         self.t = None
 
-        ## Initial direction. Does not change.
-        self.initialVector = nullVec(FlailDriver.MDIM)
-        self.initialVector[0] = 1
-
+        ## orientation and position.
+        self.state = DriverState()
         self.wptOrder = 0
-        self.altitude = 0
-
-        fmt  = "%f, "*(len(self.initialVector)-1)
-        ## format for printing a point.
-        self.formatp = fmt[0:-2]+"\n"
+        ## fixed-point format of the lengths (see setformat), or None for the bam current format.
+        self.fmt = None
+        ## window to GIS mapping of this driver (see setworldcoordinates), or None for the module mapping.
+        self.map = None
+        ## whether close was called.
+        self.closed = False
 
         self.reset()
 
+    ## Return a driver writing to memory: its outputs are given by contents.
+    @classmethod
+    def inMemory(cls, shape=None, visible=False, **kw):
+        return cls(shape, visible, io.StringIO(), io.StringIO(), io.StringIO(), **kw)
+
+    ## Write an instruction, and emit its bytecode.
+    #
+    #  @param name instruction name.
+    #  @param fmt format of the parameter.
+    #  @param param parameter.
+    #
+    def command(self, name, fmt, param):
+        if not self.writing:
+           return
+        self.f.write(name + fmt % param)
+        if self.code is not None:
+           self.code.emit(name, param)
+
+    ## Open a sink for writing.
+    #  A file name is opened (and truncated). A stream is used as it is, but a seekable one is rewound and truncated,
+    #  if asked to, as the gps files only keep the current curve.
+    #
+    #  @param sink file name or stream.
+    #  @param rewind whether a seekable stream is emptied.
+    #  @return a file handle.
+    #
+    def openSink(self, sink, rewind=True):
+        if not hasattr(sink, "write"):
+           return open(sink, "w+", FlailDriver.bufsize)
+        if rewind and getattr(sink, "seekable", lambda: False)():
+           sink.seek(0)
+           sink.truncate()
+        return sink
+
+    ## Close the handle of a sink, unless it is a stream of the caller, which is only flushed.
+    def closeSink(self, h, sink):
+        if h is sink:
+           h.flush()
+        else:
+           h.close()
+
+    ## Return the contents of all outputs, as a dictionary from file name to its contents (see snapshot).
+    #  The outputs must be seekable.
+    def contents(self):
+        return self.snapshot({"offset": 0})[0]
+
+    ## Validate the commands written so far, with the checks of flail.c (see validator.validate).
+    #  The flail file must be seekable.
+    #  @return a list of (line, class, message) diagnostics.
+    def validate(self):
+        self.f.flush()
+        self.f.seek(0)
+        text = self.f.read()
+        self.f.seek(0, 2)
+        return validate(text)
+
+    ## Altitude, as a float.
+    altitude = property(lambda self: positionToFloat(self.state.z))
+
+    ## Record the fixed-point format of the lengths (see bam.formatName) in the mission header.
+    #  FLAIL has no instruction for it, so it goes in a comment, such as: # QFormat(Q10)
+    def setformat(self, name):
+        self.f.write("# QFormat(%s)\n" % name)
+        self.fmt = parseFormat(name)
+
+    ## Set the world coordinates of the curve, for this driver only.
+    def setworldcoordinates(self,x0,y0,x1,y1):
+        self.map = mapper([x0,y0,x1,y1], [-180,-90,180,90], True)
+
+    ## Return a mark of the commands written so far, to be given to snapshot.
+    #  Everything written from now on depends only on the curve and on this state.
+    def mark(self):
+        self.f.flush()
+        return {"offset": self.f.tell(), "wptOrder": self.wptOrder, "altitude": self.state.z}
+
+    ## Return what was written since a mark: the commands, the positions and the waypoints
+    #  of the current curve, as a dictionary from file name to its contents, and the state reached.
+    #
+    #  @param mark as returned by mark.
+    #  @return a tuple (files, state).
+    #
+    def snapshot(self, mark):
+        self.f.flush()
+        self.f.seek(mark["offset"])
+        files = {"output.flail": self.f.read()}
+        self.f.seek(0, 2)
+        for name, h in (("gps.flail", self.t), ("gps.txt", self.g)):
+            h.flush()
+            h.seek(0)
+            files[name] = h.read()
+        s = self.state
+        return files, {"wptOrder": self.wptOrder, "altitude": s.z, "heading": s.heading, "x": s.x, "y": s.y}
+
+    ## Write again what snapshot returned, instead of generating the curve.
+    #  The commands are appended to the flail file, and the gps files are replaced.
+    #
+    #  @param files contents of each file.
+    #  @param state the state reached.
+    #
+    def restore(self, files, state):
+        self.f.write(files["output.flail"])
+        if self.code is not None:
+           assemble(files["output.flail"], self.code)
+        if self.g is not None:
+           self.closeSink(self.t, self.pointFile)
+           self.closeSink(self.g, self.gpsFile)
+        self.t = self.openSink(self.pointFile)
+        self.g = self.openSink(self.gpsFile)
+        self.t.write(files["gps.flail"])
+        self.g.write(files["gps.txt"])
+        self.wptOrder = state["wptOrder"]
+        self.state.z = state["altitude"]
+        self.state.heading, self.state.x, self.state.y = state["heading"], state["x"], state["y"]
+
     ## Write each position to a GPS file in the format:
     #  - longitude [-180,180] x latitude [-90,90]
     def writePos(self):
         if self.g is None:
-           self.t = open("../files/gps.flail","w+")
-           self.g = open("../files/gps.txt","w+")
+           self.t = self.openSink(self.pointFile)
+           self.g = self.openSink(self.gpsFile)
 
-        p=map.windowToViewport(self.curPoint[0:-1])[0]
+        x = positionToFloat(self.state.x)
+        y = positionToFloat(self.state.y)
+        p=(self.map or map).windowToViewport((x, y))[0]
 
         waypointOrder = self.wptOrder
         msnStart = 1 if waypointOrder == 0 else 0 # mission start - 1, not - 0
@@ -119,10 +274,16 @@ class FlailDriver:
         if waypointOrder == 0:
             self.g.write("QGC WPL 110\n")
 
-        self.t.write(self.formatp % tuple(self.curPoint[0:-1]))
+        self.t.write(self.formatp % (x, y, 0.0))
         self.g.write("%d\t%d\t%d\t%d\t%d\t%d\t%d\t%f\t%f\t%f\t%f\t%d\n" %
                      (waypointOrder, msnStart, coordFrame, actWpt, timeLtr, uncRad, wptRad, yawRot, lat, lon, alt, contAuto))
 
+    ## Write the next waypoint, unless the moves are not traced.
+    def waypoint(self):
+        if self.tracing:
+           self.wptOrder+=1
+           self.writePos()
+
     def setposition(self, x, y):
         pass
 
@@ -146,20 +307,13 @@ class FlailDriver:
 
     def reset(self):
         if self.g is not None:
-           self.t.close()
-           self.g.close()
+           self.closeSink(self.t, self.pointFile)
+           self.closeSink(self.g, self.gpsFile)
            self.t = None
            self.g = None
 
-        ## Current position.
-        self.curPoint = nullVec(FlailDriver.MDIM)
-        self.curPoint[-1] = 1
-
-        ## Holds accumulated rotations.
-        self.rotMatrix = identMat(FlailDriver.MDIM)
-
-        ## Current direction.
-        self.curVector = self.initialVector[:]
+        # back to the origin, heading east (the altitude is kept).
+        self.state.heading = self.state.x = self.state.y = 0
 
         self.writePos()
 
@@ -169,68 +323,138 @@ class FlailDriver:
     def color(self, c):
         pass
 
+    ## Turn to a heading, by the smallest left or right turn.
     def setheading(self, h):
-        m = ROT_Z(radians(h))
-        v = vecMul(m,self.initialVector)
-        ang = float2BAM(degrees(acos(dotProd(self.curVector,v))))
-        if crossProd(self.curVector,v) > 0:
+        ang = (int(float2UBAM(h % 360)) - self.state.heading) & 0xFFFF
+        if ang < 0x8000:
            self.left(ang)
         else:
-           self.right(ang)
+           self.right(0x10000 - ang)
 
+    ## Return the heading in degrees, in [0,360).
     def heading(self):
-        return degrees(atan2(-self.curVector[1],-self.curVector[0])+pi)
+        return BAM2float(self.state.heading)
+
+    ## Move along the current heading.
+    #  @param d distance, in position units.
+    def step(self, d):
+        dx, dy = bamStep(d, self.state.heading)
+        self.state.x += dx
+        self.state.y += dy
 
     def forward(self, dist):
         if dist != 0:
             # update current position
-            self.curPoint = vecAdd(self.curPoint, vecScale(self.curVector, toFloat(dist)))
-            self.f.write("Forward" + FlailDriver.formati % dist)
-            self.wptOrder+=1
-            self.writePos()
+            self.step(toPosition(dist, self.fmt))
+            self.command("Forward", FlailDriver.formati, dist)
+            self.waypoint()
 
     def backward(self, dist):
         if dist != 0:
             # update current position
-            self.curPoint = vecAdd(self.curPoint, vecScale(self.curVector, toFloat(-dist)))
-            self.f.write("Backward" + FlailDriver.formati % dist)
-            self.wptOrder+=1
-            self.writePos()
+            self.step(-toPosition(dist, self.fmt))
+            self.command("Backward", FlailDriver.formati, dist)
+            self.waypoint()
 
     def left(self, ang):
         if ang != 0:
-            self.rotMatrix = matMul(self.rotMatrix, ROT_Z(radians(BAM2float(ang))))
-            self.curVector = vecMul(self.rotMatrix,self.initialVector)
-            self.f.write("RollLeft" + FlailDriver.formatu % ang)
+            self.state.heading = (self.state.heading + int(ang)) & 0xFFFF
+            self.command("RollLeft", FlailDriver.formatu, ang)
 
     def right(self, ang):
         if ang != 0:
-            self.rotMatrix = matMul(self.rotMatrix, ROT_Z(radians(BAM2float(-ang))))
-            self.curVector = vecMul(self.rotMatrix,self.initialVector)
-            self.f.write("RollRight" + FlailDriver.formatu % ang)
+            self.state.heading = (self.state.heading - int(ang)) & 0xFFFF
+            self.command("RollRight", FlailDriver.formatu, ang)
 
     def ascend(self, dist):
         if dist != 0:
-            self.f.write("Ascend" + FlailDriver.formati % dist)
-            self.altitude += toFloat(dist)
+            self.command("Ascend", FlailDriver.formati, dist)
+            self.state.z += toPosition(dist, self.fmt)
 
 
     def descend(self, dist):
         if dist != 0:
-            self.f.write("Descend" + FlailDriver.formati % dist)
-
-    def repeat(self, n, instructions):
-        self.f.write("Repeat " + str(n) + " {\n")
+            self.command("Descend", FlailDriver.formati, dist)
+            self.state.z -= toPosition(dist, self.fmt)
+
+    ## Apply a transform to the state (see composeTransform).
+    #  @param t transform.
+    #  @param ang angle from the frame of the transform to the current heading.
+    def move(self, t, ang):
+        dx, dy = bamRotate(t[1], t[2], ang)
+        self.state.x += dx
+        self.state.y += dy
+        self.state.z += t[3]
+        self.state.heading = (self.state.heading + t[0]) & 0xFFFF
+
+    ## Write a block of instructions repeated n times.
+    #
+    #  The instructions are written and executed once. The other n-1 iterations are executed again,
+    #  without writing anything but their waypoints, so the state and the waypoints are exactly the ones of the unrolled block.
+    #  Without the waypoints of each iteration, a block with no net turn is applied in O(log n) steps instead (see powerTransform),
+    #  which is exact, as its displacement is not rotated; and the end of the block gets a single waypoint.
+    #
+    #  @param n number of iterations.
+    #  @param instructions list of (method, args...) tuples.
+    #  @param waypoints whether each iteration writes its waypoints. The default is repeatWaypoints.
+    #
+    def repeat(self, n, instructions, waypoints=None):
+        if self.writing:
+           self.f.write("Repeat " + str(n) + " {\n")
+        start = self.code.mark() if self.code is not None and self.writing else None
+        s = self.state
+        h, x, y, z = s.heading, s.x, s.y, s.z
 
         for f in instructions:
             # Given a tuple: (func, par), call func(par)
             f[0](*f[1:])
-        self.f.write("}\n")
+        if self.writing:
+           self.f.write("}\n")
+        if start is not None:
+           self.code.repeatFrom(start, n)
+
+        t = ((s.heading - h) & 0xFFFF, s.x - x, s.y - y, s.z - z)
+        if n < 2:
+           return
+        writing, tracing = self.writing, self.tracing
+        each = tracing and (self.repeatWaypoints if waypoints is None else waypoints)
+        self.writing, self.tracing = False, each
+        try:
+           if t[0] == 0 and not each:
+              self.move(powerTransform(t, n-1), 0)
+           else:
+              for i in range(n-1):
+                  for f in instructions:
+                      f[0](*f[1:])
+        finally:
+           self.writing, self.tracing = writing, tracing
+        if tracing and not each and t[1:] != (0, 0, 0):
+           self.waypoint()
+
+    ## Flush all outputs, and close the files opened by the driver.
+    #  Calling it again does nothing.
+    def close(self):
+        if self.closed:
+           return
+        self.closed = True
+        self.closeSink(self.f, self.flailFile)
+        if self.code is not None:
+           self.code.save(self.byteFile, self.byteArrayFile)
+        if self.g is not None:
+           self.closeSink(self.t, self.pointFile)
+           self.closeSink(self.g, self.gpsFile)
+
+    ## The driver is a context manager: the outputs are closed on exit (see close).
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
 
     def __del__(self):
-        self.f.close()
-        self.t.close()
-        self.g.close()
+        if hasattr(self, "closed"):
+           self.close()
 
 def main():
     f = FlailDriver(0,0)
@@ -210,7 +210,7 @@ class FlailDriver:
         if dist != 0:
             self.f.write("Descend" + FlailDriver.formati % dist)
 
-    def repeat(self, n, instructions):
+    def repeat(self, n, instructions, waypoints=None):
         self.f.write("Repeat " + str(n) + " {\n")
 
         for f in instructions:
@@ -218,9 +218,24 @@ class FlailDriver:
             f[0](*f[1:])
         self.f.write("}\n")
 
-    def __del_(self):
-        self.f.close();
-        self.g.close();
+    ## Close all files. Calling it again does nothing.
+    def close(self):
+        self.f.close()
+        if self.g is not None:
+           self.g.close()
+           self.g = None
+
+    ## The driver is a context manager: the files are closed on exit (see close).
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __del__(self):
+        if hasattr(self, "f"):
+           self.close()
 
 def main():
     f = FlailDriver(0,0)
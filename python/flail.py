@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# coding: UTF-8
+#
+## @package flail
+#
+#  FLAIL bytecode, with 16-bit operands.
+#
+#  The instruction set is the one of flail.h: each instruction is an opcode followed by its operand.
+#  flail.c stores both in one byte, so operands above 255 are split (and BAM angles, such as RollLeft(27306), are lost).
+#  Here, every opcode and every operand takes a 16-bit word (see bam.packWords), so lengths and angles are kept whole:
+#  - Operands are not negative, as flail.c cannot code them: in distance mode, a move or a turn with a negative parameter
+#    is emitted as the opposite one, so Forward(-3) is [0x3, 3], and a negative Wait or percentage is rejected.
+#  - As in flail.c, instructions with a null operand are not emitted,
+#    and operands too big for a word are split with repeatNextInstFor:
+#    Forward(150000) is [0xC, 2] [0x2, 65535] [0x2, 18930].
+#  - Repeat blocks are unrolled, as in flail.c (iterateLoopArr), even when they hold a single instruction:
+#    repeatNextInstFor is only used to split operands, so the bytecode is the one flail.c would give with 16-bit bytes.
+#
+#  Edited scripts are recompiled incrementally by IncrementalCompiler.
+#
+#  The bytecode is saved as raw binary, with 16-bit operands (little-endian words),
+#  and as the text read by the Unity simulation (byteArray.txt): the instructions with the 8-bit operands of flail.c (see byteCode),
+#  in hexadecimal, separated by commas, as in flailSimulation/byteArray.txt.
+#
+import sys, re
+from array import array
+from bisect import bisect_right, bisect_left
+from itertools import accumulate
+from bam import packWords, packBytes
+
+## Opcodes of the instructions, by name (see flail.h).
+OPCODES = {"Ascend": 0x1, "Forward": 0x2, "Backward": 0x3, "Left": 0x4, "Right": 0x5, "RollLeft": 0x6,
+           "RollRight": 0x7, "Descend": 0x8, "Wait": 0x9, "WaitMili": 0xA, "SetMode": 0xB}
+
+## Instruction moving or turning the other way, by name.
+OPPOSITE = {"Ascend": "Descend", "Descend": "Ascend", "Forward": "Backward", "Backward": "Forward",
+            "Left": "Right", "Right": "Left", "RollLeft": "RollRight", "RollRight": "RollLeft"}
+
+## Opcode executing the next instruction a given number of times.
+REPEAT_NEXT = 0xC
+
+## Operand of SetMode, by mode name (as in flail.c: intensity -> 1, distance -> 2).
+MODES = {"intensity": 1, "distance": 2}
+
+## Largest operand.
+WORD_MAX = 0xFFFF
+
+## Statements of a FLAIL text: a comment, an instruction with its parameter, the start or the end of a Repeat block.
+STATEMENT = re.compile(r"#[^\n]*|Repeat\s+(-?\d+)\s*\{|(\})|(\w+)\s*\(\s*([^()\s;]*)\s*\)")
+
+## Consumer of turtle commands (see mission.execute) generating FLAIL bytecode,
+#  as a list of (opcode, operand) pairs.
+class BytecodeWriter:
+
+    ## Constructor.
+    #  @param mode interpretation mode of the parameters: distance or intensity (see setmode).
+    #  The mode is not emitted: it must be set by a SetMode instruction, as in the FLAIL text.
+    def __init__(self, mode="intensity"):
+        ## (opcode, operand) pairs.
+        self.code = []
+        ## current mode (the flail.c default is intensity).
+        self.mode = mode
+
+    ## Emit an instruction.
+    #
+    #  In intensity mode, the parameters (but the ones of Wait, WaitMili and SetMode) are percentages in [0,1],
+    #  emitted as integers in [0,100].
+    #  In distance mode, a move or a turn with a negative parameter is emitted as the opposite one (see OPPOSITE).
+    #
+    #  @param name instruction name (see OPCODES).
+    #  @param param parameter: an integer, a percentage or a mode name.
+    #  @throw ValueError if the parameter is invalid: a percentage out of [0,1], or a negative Wait, for instance.
+    #
+    def emit(self, name, param):
+        op = OPCODES[name]
+        if name == "SetMode":
+           if param not in MODES:
+              raise ValueError("unknown mode: %s" % param)
+           self.mode = param
+           self.code.append((op, MODES[param]))
+           return
+        if self.mode == "distance" or name in ("Wait", "WaitMili"):
+           param = int(param)
+           if param < 0 and name in OPPOSITE:
+              name, param = OPPOSITE[name], -param
+              op = OPCODES[name]
+        else:
+           param = int(float(param) * 100)
+           if param > 100 or param < 0:
+              raise ValueError("percentage out of [0.0,1.0]: %s(%s)" % (name, param))
+        if param < 0:
+           raise ValueError("negative parameter: %s(%d)" % (name, param))
+        if param == 0:
+           return
+        rep, rem = divmod(param, WORD_MAX) if param > WORD_MAX else (0, param)
+        if rep:
+           self.repeatNext(rep, (op, WORD_MAX))
+        if rem:
+           self.code.append((op, rem))
+
+    ## Emit a single instruction, executed n times.
+    def repeatNext(self, n, inst):
+        while n > 0:
+            k = min(n, WORD_MAX)
+            if k > 1:
+               self.code.append((REPEAT_NEXT, k))
+            self.code.append(inst)
+            n -= k
+
+    ## Return a mark of the code emitted so far, to be given to repeatFrom.
+    def mark(self):
+        return len(self.code)
+
+    ## Repeat the code emitted since a mark, by unrolling it (as flail.c does).
+    #
+    #  @param start mark returned by mark.
+    #  @param n number of times the code is executed.
+    #  @throw ValueError if n is not positive.
+    #
+    def repeatFrom(self, start, n):
+        if n <= 0:
+           raise ValueError("number of repetitions is below or equal to 0: %d" % n)
+        self.code.extend(self.code[start:] * (n-1))
+
+    def setmode(self, mode):
+        self.emit("SetMode", mode)
+
+    def forward(self, dist):
+        self.emit("Forward", dist)
+
+    def backward(self, dist):
+        self.emit("Backward", dist)
+
+    def left(self, ang):
+        self.emit("RollLeft", ang)
+
+    def right(self, ang):
+        self.emit("RollRight", ang)
+
+    def ascend(self, dist):
+        self.emit("Ascend", dist)
+
+    def descend(self, dist):
+        self.emit("Descend", dist)
+
+    def wait(self, s):
+        self.emit("Wait", s)
+
+    def waitmili(self, ms):
+        self.emit("WaitMili", ms)
+
+    ## Emit a Repeat block, unrolled (see repeatFrom). There are no waypoints to write.
+    def repeat(self, n, instructions, waypoints=None):
+        start = self.mark()
+        for f in instructions:
+            f[0](*f[1:])
+        self.repeatFrom(start, n)
+
+    ## Return the code as an array of 16-bit words (see bam.packWords).
+    def words(self):
+        return packWords(self.code) if self.code else array('H')
+
+    ## Return the code as bytes (see bam.packBytes).
+    def tobytes(self):
+        return packBytes(self.words())
+
+    ## Save the code as raw binary, with 16-bit operands, and as the byte array text of the Unity simulation, with 8-bit operands.
+    #
+    #  @param binFile name of the binary file, or None.
+    #  @param textFile name of the text file (byteArray.txt), or None.
+    #
+    def save(self, binFile=None, textFile=None):
+        data = self.tobytes()
+        if binFile is not None:
+           with open(binFile, "wb") as f:
+              f.write(data)
+        if textFile is not None:
+           with open(textFile, "w") as f:
+              f.write(byteArrayText(byteCode(self.code)))
+
+## Return the instructions with 8-bit operands, as flail.c codes them, and the Unity simulation reads them:
+#  an operand above 255 becomes repeatNextInstFor(n) of the instruction with 255, followed by the remainder.
+#
+#  @param code (opcode, operand) pairs, with 16-bit operands (see BytecodeWriter.code).
+#  @return a bytearray of opcodes and operands.
+#
+def byteCode(code):
+    out = bytearray()
+    it = iter(code)
+    for op, param in it:
+        if op == REPEAT_NEXT:
+           k = param
+           op, param = next(it)
+           param *= k
+        rep, rem = divmod(param, 255) if param > 255 else (0, param)
+        while rep > 0:
+            k = min(rep, 255)
+            out.extend((REPEAT_NEXT, k, op, 255))
+            rep -= k
+        if rem:
+           out.extend((op, rem))
+    return out
+
+## Return the byte array text of the Unity simulation, as in flailSimulation/byteArray.txt: "0x0, 0xeb, 0x4, 0x5a".
+byteArrayText = lambda data: ", ".join("0x%x" % b for b in bytearray(data))
+
+## Compile a FLAIL text to bytecode.
+#  Repeat blocks may be nested. The text is not validated: unknown statements are skipped.
+#
+#  @param text FLAIL text.
+#  @param writer BytecodeWriter the code is appended to. By default, a new one, in intensity mode.
+#  @return the writer.
+#  @throw ValueError if a parameter is invalid, or a Repeat block is not closed.
+#
+def assemble(text, writer=None):
+    if writer is None:
+       writer = BytecodeWriter()
+    blocks = []
+    for m in STATEMENT.finditer(text):
+        n, close, name, param = m.groups()
+        if n is not None:
+           blocks.append((writer.mark(), int(n)))
+        elif close is not None:
+           if not blocks:
+              raise ValueError("'}' without Repeat")
+           writer.repeatFrom(*blocks.pop())
+        elif name in OPCODES:
+           writer.emit(name, param)
+    if blocks:
+       raise ValueError("unclosed Repeat block")
+    return writer
+
+## Return the change of the Repeat block depth made by a line (its comment left out).
+def braces(line):
+    line = line.split("#", 1)[0]
+    return line.count("{") - line.count("}")
+
+## Return the length of the common beginning of two lists, comparing them by chunks.
+def commonLength(a, b, chunk=1024):
+    n = min(len(a), len(b))
+    p = 0
+    while p < n and a[p:p+chunk] == b[p:p+chunk]:
+        p += chunk
+    p = min(p, n)
+    while p < n and a[p] == b[p]:
+        p += 1
+    return p
+
+## Compiler of FLAIL scripts, recompiling only what an edit changes.
+#
+#  The script is split into units: a line out of any Repeat block, or a whole Repeat block.
+#  The bytecode of each unit depends only on its text and on the mode it starts in,
+#  so it is cached by both, and an edit recompiles only the units it touches
+#  (and the units after them, while the mode they start in changes),
+#  whose bytecode is spliced into the bytecode of the script.
+#
+#  compiler = IncrementalCompiler()
+#  compiler.compile(text)
+#  compiler.edit(10, 12, ["Forward(3);", "RollLeft(100);"])
+#  compiler.tobytes()
+#
+class IncrementalCompiler:
+
+    ## Constructor.
+    #  @param mode mode at the beginning of the script (see BytecodeWriter).
+    def __init__(self, mode="intensity"):
+        ## mode at the beginning of the script.
+        self.mode = mode
+        ## lines of the script.
+        self.lines = []
+        ## bytecode of the script, as 16-bit words.
+        self.words = array('H')
+        ## number of lines of each unit.
+        self.sizes = []
+        ## mode each unit starts in.
+        self.modes = []
+        ## mode each unit ends in.
+        self.ends = []
+        ## bytecode of each unit.
+        self.blocks = []
+        ## cache of unit bytecode: (mode, text) -> (words, mode at the end).
+        self.cache = {}
+
+    ## Compile a unit, or get it from the cache.
+    #
+    #  @param text text of the unit.
+    #  @param mode mode the unit starts in.
+    #  @return a tuple (words, mode at the end).
+    #
+    def unit(self, text, mode):
+        key = (mode, text)
+        hit = self.cache.get(key)
+        if hit is None:
+           w = assemble(text, BytecodeWriter(mode))
+           hit = self.cache[key] = (array('H', [x & WORD_MAX for inst in w.code for x in inst]), w.mode)
+        return hit
+
+    ## Compile a script, reusing what is unchanged since the last script compiled:
+    #  the lines it has in common with it, at its beginning and at its end, are not compiled again.
+    #
+    #  @param text FLAIL text.
+    #  @return the bytecode, as an array of 16-bit words.
+    #  @throw ValueError if a parameter is invalid, or a Repeat block is not closed.
+    #
+    def compile(self, text):
+        new, old = text.split("\n"), self.lines
+        p = commonLength(new, old)
+        s = min(commonLength(new[::-1], old[::-1]), len(new) - p, len(old) - p)
+        if self.sizes and p == len(old) == len(new):
+           return self.words
+        return self.edit(p, len(old) - s, new[p:len(new)-s])
+
+    ## Replace some lines of the script, and recompile the units they belong to.
+    #
+    #  @param first index of the first line replaced.
+    #  @param last index of the line after the last one replaced.
+    #  @param lines new lines.
+    #  @return the bytecode, as an array of 16-bit words.
+    #  @throw ValueError if a parameter is invalid, or a Repeat block is not closed. The script is then left unchanged.
+    #
+    def edit(self, first, last, lines):
+        starts = [0]
+        starts.extend(accumulate(self.sizes))
+        n = len(self.sizes)
+        i = min(bisect_right(starts, first) - 1, n)
+        j = max(bisect_left(starts, last), i)
+        delta = len(lines) - (last - first)
+        old = self.lines[first:last]
+        self.lines[first:last] = lines
+
+        # split the lines from the first unit touched, until an old unit boundary out of any block
+        units = []
+        pos = begin = starts[i]
+        hi = starts[j] + delta
+        k = j
+        depth = 0
+        while pos < len(self.lines):
+            if depth == 0 and pos >= hi:
+               while k < n and starts[k+1] + delta <= pos:
+                   k += 1
+               if k == n or starts[k] + delta == pos:
+                  break
+            depth += braces(self.lines[pos])
+            pos += 1
+            if depth <= 0:
+               units.append((begin, pos))
+               begin = pos
+               depth = 0
+        if begin < pos:
+           units.append((begin, pos))
+        while k < n and starts[k+1] + delta <= pos:
+            k += 1
+
+        mode = self.ends[i-1] if i > 0 else self.mode
+        sizes, modes, ends, blocks = [], [], [], []
+        try:
+           for b, e in units:
+               words, end = self.unit("\n".join(self.lines[b:e]), mode)
+               sizes.append(e - b)
+               modes.append(mode)
+               ends.append(end)
+               blocks.append(words)
+               mode = end
+           # the units after the edit are compiled again while the mode they start in changes
+           while k < n and self.modes[k] != mode:
+               b = starts[k] + delta
+               words, end = self.unit("\n".join(self.lines[b:b+self.sizes[k]]), mode)
+               sizes.append(self.sizes[k])
+               modes.append(mode)
+               ends.append(end)
+               blocks.append(words)
+               mode = end
+               k += 1
+        except ValueError as e:
+           self.lines[first:first+len(lines)] = old
+           raise ValueError("line %d: %s" % (b + 1, e))
+
+        a = sum(map(len, self.blocks[:i]))
+        z = a + sum(map(len, self.blocks[i:k]))
+        words = array('H')
+        for w in blocks:
+            words.extend(w)
+        self.words[a:z] = words
+        self.sizes[i:k] = sizes
+        self.modes[i:k] = modes
+        self.ends[i:k] = ends
+        self.blocks[i:k] = blocks
+        if len(self.cache) > 2 * len(self.blocks) + 1024:
+           self.cache = dict(((m, "\n".join(self.lines[b:b+s])), (w, e)) for m, e, w, b, s in
+                             zip(self.modes, self.ends, self.blocks, accumulate([0] + self.sizes), self.sizes))
+        return self.words
+
+    ## Return the bytecode as bytes (see bam.packBytes).
+    def tobytes(self):
+        return packBytes(self.words)
+
+def main():
+    w = assemble(open(sys.argv[1]).read() if len(sys.argv) > 1 else
+                 "SetMode(distance);\nRollLeft(27306);\nRepeat 3 {\nForward(150000);\n}\nRepeat 2 {\nAscend(3);\nForward(10);\n}\n")
+    print(w.code)
+    print(byteArrayText(byteCode(w.code)))
+
+if __name__=="__main__":
+   sys.exit(main())
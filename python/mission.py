@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# coding: UTF-8
+#
+## @package mission
+#
+#  Typed turtle commands, and the consumers they are streamed to.
+#
+#  A mission is an iterable (usually a generator) of the command tuples below.
+#  Each command is executed by calling the consumer method with the same name, in lower case,
+#  so a turtle, a FlailDriver or a FlailWriter can all consume the same stream.
+#  A consumer without the method simply ignores the command (a FlailWriter has no pen, for instance).
+#
+import sys
+from collections import namedtuple
+
+## Move forward, by a distance.
+Forward = namedtuple("Forward", "dist")
+## Move backward, by a distance.
+Backward = namedtuple("Backward", "dist")
+## Turn left, by an angle.
+Left = namedtuple("Left", "ang")
+## Turn right, by an angle.
+Right = namedtuple("Right", "ang")
+## Move up, by a distance.
+Ascend = namedtuple("Ascend", "dist")
+## Move down, by a distance.
+Descend = namedtuple("Descend", "dist")
+## Execute a list of commands n times.
+#  waypoints tells a consumer writing waypoints whether to write the ones of every iteration (see FlailDriver.repeat),
+#  or None (the default) for its own default.
+Repeat = namedtuple("Repeat", "n cmds waypoints")
+Repeat.__new__.__defaults__ = (None,)
+## Lift the pen.
+PenUp = namedtuple("PenUp", "")
+## Put the pen down.
+PenDown = namedtuple("PenDown", "")
+## Go back to the origin.
+Home = namedtuple("Home", "")
+## Go to a position, without changing the heading.
+SetPosition = namedtuple("SetPosition", "x y")
+## Go back to the initial state.
+Reset = namedtuple("Reset", "")
+## Set the pen width.
+PenSize = namedtuple("PenSize", "width")
+## Set the pen color.
+Color = namedtuple("Color", "color")
+## Set the heading, in degrees.
+SetHeading = namedtuple("SetHeading", "ang")
+## Record the fixed-point format of the lengths (see bam.formatName).
+SetFormat = namedtuple("SetFormat", "name")
+
+## Return the method of consumer t executing a command, or None.
+method = lambda t, cmd: getattr(t, type(cmd).__name__.lower(), None)
+
+## Execute a command on a consumer.
+#  A Repeat is passed to the consumer repeat method, as a list of (method, args...) tuples (and its waypoints, if it is set),
+#  or unrolled, if the consumer has no repeat method.
+#
+#  @param t consumer.
+#  @param cmd command.
+#
+def execute(t, cmd):
+    if isinstance(cmd, Repeat):
+       rep = getattr(t, "repeat", None)
+       if rep is not None:
+          body = [(method(t, c),) + tuple(c) for c in cmd.cmds if method(t, c) is not None]
+          if cmd.waypoints is None:
+             rep(cmd.n, body)
+          else:
+             rep(cmd.n, body, cmd.waypoints)
+       else:
+          for i in range(cmd.n):
+              for c in cmd.cmds:
+                  execute(t, c)
+    else:
+       f = method(t, cmd)
+       if f is not None:
+          f(*cmd)
+
+## Stream commands to one or more consumers.
+#  The commands are pulled one at a time, so a generator is never materialized,
+#  and the stream may be cut short with itertools.islice, for instance.
+#
+#  @param cmds an iterable of commands.
+#  @param turtles consumers.
+#  @return the number of commands executed.
+#
+def drive(cmds, *turtles):
+    n = 0
+    for cmd in cmds:
+        for t in turtles:
+            execute(t, cmd)
+        n += 1
+    return n
+
+## A consumer writing the FLAIL text of the commands to a file object,
+#  in the same format as FlailDriver, but without tracking positions.
+class FlailWriter:
+
+    ## integer format
+    formati = "(%d);\n"
+    ## unsigned format
+    formatu = "(%u);\n"
+
+    ## Constructor.
+    #
+    #  @param f file object.
+    #  @param mode FLAIL mode: distance or intensity.
+    #
+    def __init__(self, f, mode="distance"):
+        self.f = f
+        self.f.write("SetMode(%s);\n" % mode)
+
+    def setformat(self, name):
+        self.f.write("# QFormat(%s)\n" % name)
+
+    def forward(self, dist):
+        if dist != 0:
+           self.f.write("Forward" + FlailWriter.formati % dist)
+
+    def backward(self, dist):
+        if dist != 0:
+           self.f.write("Backward" + FlailWriter.formati % dist)
+
+    def left(self, ang):
+        if ang != 0:
+           self.f.write("RollLeft" + FlailWriter.formatu % ang)
+
+    def right(self, ang):
+        if ang != 0:
+           self.f.write("RollRight" + FlailWriter.formatu % ang)
+
+    def ascend(self, dist):
+        if dist != 0:
+           self.f.write("Ascend" + FlailWriter.formati % dist)
+
+    def descend(self, dist):
+        if dist != 0:
+           self.f.write("Descend" + FlailWriter.formati % dist)
+
+    ## Write a Repeat block. There are no waypoints to write.
+    def repeat(self, n, instructions, waypoints=None):
+        self.f.write("Repeat " + str(n) + " {\n")
+        for f in instructions:
+            f[0](*f[1:])
+        self.f.write("}\n")
+
+def main():
+    drive([Forward(256), Left(16384), Repeat(5, [Ascend(3), Forward(10)]), PenUp()], FlailWriter(sys.stdout))
+
+if __name__=="__main__":
+   sys.exit(main())
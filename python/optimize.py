@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# coding: UTF-8
+#
+## @package optimize
+#
+#  Optimization of missions: a post-pass over a stream of commands (see mission), making it shorter.
+#
+#  - peephole merges consecutive commands:
+#    - turns, modulo a full turn, so a RollLeft/RollRight pair that cancels disappears;
+#    - forwards (or backwards, ascends, descends) with no turn in between, if the merged length codes the same distance;
+#    - turns below a tolerance are folded: they are not emitted, but added to the next turn,
+#      so the heading error never exceeds the tolerance (and the forwards around them become collinear).
+#  - compress rewrites repeated sequences of commands as Repeat blocks.
+#
+#  Both are generators, so they can be chained to a mission before it is driven:
+#
+#  drive(optimize(curveCommands(geo), tolerance=8, fmt=ctx.fmt), joe)
+#
+import sys
+from mission import Forward, Backward, Left, Right, Ascend, Descend, Repeat, PenUp, PenDown, PenSize, Color, FlailWriter, drive
+from bam import toPosition
+
+## Commands moving along a line: the command of opposite direction, by type.
+MOVES = {Forward: Backward, Backward: Forward, Ascend: Descend, Descend: Ascend}
+
+## Commands setting a state of the pen: the state they set, by type.
+PEN = {PenUp: "down", PenDown: "down", PenSize: "size", Color: "color"}
+
+## Largest length code merged: a single 16-bit word (see flail.WORD_MAX).
+LENGTH_MAX = 0xFFFF
+
+## Key of a command, for comparing commands of different types with the same fields.
+key = lambda c: (type(c), tuple(c))
+
+## Return the length code of two consecutive moves in the same direction, or None if they cannot be merged:
+#  with a length format, the merged code must be a word, and code the sum of both distances exactly.
+#
+#  @param a length code.
+#  @param b length code.
+#  @param fmt a format (nbits, useBAM), or None for lengths that are not codes (as the ones sent to a turtle).
+#
+def mergeLengths(a, b, fmt=None):
+    if fmt is None:
+       return a + b
+    s = a + b
+    if 0 < s <= LENGTH_MAX and toPosition(s, fmt) == toPosition(a, fmt) + toPosition(b, fmt):
+       return s
+    return None
+
+## Merge consecutive commands of a mission.
+#
+#  Pen commands that do not change the pen (see PEN) are dropped. Any other command, but moves and turns,
+#  is passed as it is, after the pending turn.
+#
+#  @param cmds an iterable of commands.
+#  @param tolerance largest turn folded into the next one, in the units of the angles. 0 only merges what is exact.
+#  @param fullTurn angle of a full turn: 0x10000 for UBAM codes, 360 for degrees.
+#  @param fmt length format of the codes, or None (see mergeLengths).
+#  @return a generator of commands.
+#
+def peephole(cmds, tolerance=0, fullTurn=0x10000, fmt=None):
+    half = fullTurn / 2
+    turn = 0
+    last = None
+    pen = {}
+    for c in cmds:
+        t = type(c)
+        if t is Left or t is Right:
+           turn = (turn + (c.ang if t is Left else -c.ang)) % fullTurn
+           if turn > half:
+              turn -= fullTurn
+           continue
+        if t in MOVES:
+           if c[0] == 0:
+              continue
+           if t in (Forward, Backward) and abs(turn) > tolerance:
+              if last is not None:
+                 yield last
+              last = Left(turn) if turn > 0 else Right(-turn)
+              turn = 0
+           if type(last) is t:
+              d = mergeLengths(last[0], c[0], fmt)
+              if d is not None:
+                 last = t(d)
+                 continue
+           if last is not None:
+              yield last
+           last = c
+           continue
+        if t in PEN:
+           if pen.get(PEN[t]) == key(c):
+              continue
+           pen[PEN[t]] = key(c)
+        if last is not None:
+           yield last
+        last = None
+        if turn != 0:
+           yield Left(turn) if turn > 0 else Right(-turn)
+           turn = 0
+        yield c
+    if last is not None:
+       yield last
+    if turn != 0:
+       yield Left(turn) if turn > 0 else Right(-turn)
+
+## Rewrite a sequence of moves and turns with Repeat blocks: greedily, at each command,
+#  the sequence of up to maxPeriod commands repeated the most lines saved is taken.
+#
+#  @param seq list of commands, with no Repeat.
+#  @param maxPeriod largest number of commands in a block.
+#  @param waypoints waypoints of the blocks (see mission.Repeat).
+#  @return a list of commands.
+#
+def compressSequence(seq, maxPeriod=16, waypoints=None):
+    keys = [key(c) for c in seq]
+    n = len(keys)
+    out = []
+    i = 0
+    while i < n:
+        best, bp, bk = 0, 1, 1
+        for p in range(1, min(maxPeriod, (n - i) // 2) + 1):
+            body = keys[i:i+p]
+            k = 1
+            while keys[i+k*p:i+(k+1)*p] == body:
+                k += 1
+            # a block costs two lines: "Repeat n {" and "}"
+            saved = p * (k - 1) - 2
+            if saved > best:
+               best, bp, bk = saved, p, k
+        if best > 0:
+           out.append(Repeat(bk, seq[i:i+bp], waypoints))
+           i += bp * bk
+        else:
+           out.append(seq[i])
+           i += 1
+    return out
+
+## Rewrite repeated sequences of moves and turns as Repeat blocks (see compressSequence).
+#  FLAIL has no nested loops, so the commands are gathered up to any other command (a Repeat included),
+#  or up to window commands, and then compressed.
+#
+#  @param cmds an iterable of commands.
+#  @param maxPeriod largest number of commands in a block.
+#  @param window largest number of commands compressed at once.
+#  @param waypoints waypoints of the blocks (see mission.Repeat).
+#  @return a generator of commands.
+#
+def compress(cmds, maxPeriod=16, window=4096, waypoints=None):
+    seq = []
+    for c in cmds:
+        if type(c) in MOVES or type(c) is Left or type(c) is Right:
+           seq.append(c)
+           if len(seq) < window:
+              continue
+           c = None
+        for r in compressSequence(seq, maxPeriod, waypoints):
+            yield r
+        seq = []
+        if c is not None:
+           yield c
+    for r in compressSequence(seq, maxPeriod, waypoints):
+        yield r
+
+## Optimize a mission: merge its commands, then compress them.
+#  @see peephole, compress
+optimize = lambda cmds, tolerance=0, fullTurn=0x10000, fmt=None, maxPeriod=16, waypoints=None: \
+           compress(peephole(cmds, tolerance, fullTurn, fmt), maxPeriod, waypoints=waypoints)
+
+def main():
+    cmds = [Forward(256), Left(16384), Right(16384), Forward(100), Left(3), Forward(28)] + \
+           [Left(1000), Forward(40), Left(7)] * 12 + [PenDown(), PenDown(), Ascend(3), Ascend(4)]
+    drive(optimize(cmds, tolerance=8, fmt=(8, False)), FlailWriter(sys.stdout))
+
+if __name__=="__main__":
+   sys.exit(main())
@@ -39,23 +39,26 @@
 #  @see http://jwilson.coe.uga.edu/emat6680fa08/kimh/assignment11hjk/assignment11.html
 #  @see https://elepa.files.wordpress.com/2013/11/fifty-famous-curves.pdf
 #
-import sys, os
-import numpy
-import turtle
+# the cache, validator, optimizer, json and getopt are imported by the functions using them, and numpy when it is first used, to start quickly.
+import sys, os, time, warnings
 import bam
-import getopt
 from bam import *
+numpy = bam.lazyImport("numpy")
+from mission import drive, Forward, Left, Right, Ascend, Descend, Repeat, PenUp, PenDown, Home, SetPosition, PenSize, Color, SetHeading
+from math import sin, cos, sqrt, degrees, pi, acos, atan2, ldexp
 try:
-    from turtle import FlailDriver as Turtle
-## Whether using the flail driver for writing a file, instead of turtle for drawing on screen.
-    usingFlail = True
-except ImportError as e:
-    from turtle import Turtle
-    usingFlail = False
-from math import sin, cos, sqrt, degrees, pi, acos, atan2
-from distutils.spawn import find_executable
-print( "usingFlail = %r" % usingFlail )
-bam.usingFlail = usingFlail
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+## Backend the commands are sent to: auto, turtle, flail, gps or null (see loadBackend).
+backend = "auto"
+## Module with the screen functions of the backend (turtle or flailDriver), or None. Set by loadBackend.
+graphics = None
+## Turtle class of the backend. Set by loadBackend.
+Turtle = None
+## Whether using the flail driver for writing a file, instead of turtle for drawing on screen. Set by loadBackend.
+usingFlail = None
 
 ## Canvas width.
 WIDTH = 800
@@ -74,9 +77,6 @@ Yc = 0
 ## Toggle debugging mode.
 __toDebug__ = False
 
-# File handle for saving the current curve.
-tfile = None
-
 ## Scale factor applied on curves.
 radius = None
 
@@ -85,36 +85,159 @@ num_sides = None
 
 ## Should diagonal lines be treated as a slope?
 staircase = False
+
+## Fixed-point format for lengths: "bam" (BAM below 180, Q8 otherwise, as flail.c and the drones read them),
+#  "auto" (chosen for each curve, see selectFormat), or the number of bits after the binary point.
+#  Only the header comment of a mission records its format, which flail.c ignores, so "auto" is only for consumers reading it.
+qformat = "bam"
+
+## Maximum distance from the curve to each segment, for sampling the curve adaptively (see adaptiveAngles).
+#  When None, the curve is sampled at num_sides equally spaced angles.
+tolerance = None
+
+## Whether the commands of curves with a rotational symmetry are emitted once per period, inside a Repeat block (see segmentPeriod).
+symmetry = True
+
+## What to do with a curve whose angle range covers its closing period more than once (see curvePeriod):
+#  "clip" the range to a single period, only "report" it, or "off" not to look for the period.
+period = "clip"
+
+## Number of angles at which the period finder compares a curve with itself.
+PERIOD_SAMPLES = 1024
+
+## Largest number of periods the period finder looks for in the angle range of a curve.
+PERIOD_MAX = 32
+
+## Largest distance between the points of a curve one period apart, relative to the size of the curve.
+PERIOD_TOLERANCE = 1e-6
+
+## Whether the turns and lengths are quantized in closed loop, correcting the error so far at each segment (see closedLoopSegments).
+closedLoop = False
+
+## Name of the file where the tuned numbers of segments are stored (see tuneCurve).
+TUNED = "tuned.json"
+
+## Tuned numbers of segments, as read from TUNED (see loadTuned). When None, the curves are sampled with num_sides segments per turn.
+tuned = None
+
+## Number of angles, inside each segment, at which the tuner compares the quantized path with the curve.
+TUNE_PROBES = 8
+
+## Smallest and largest numbers of segments tried by the tuner.
+TUNE_MIN, TUNE_MAX = 8, 1 << 14
+
+## Largest turn, in BAM, folded into the next one by the mission optimizer (see optimize.optimize).
+#  When None, the commands are not optimized.
+optimizeTurns = None
+
+## Whether the flail driver also writes the FLAIL bytecode: output.bin and byteArray.txt (see flail.BytecodeWriter).
+bytecode = False
+
+## The adaptive sampler starts from the equally spaced angles, taking one out of ADAPTIVE_COARSEN.
+ADAPTIVE_COARSEN = 8
+
+## Fractions of the angle range of a segment where the adaptive sampler compares the curve to the chord.
+ADAPTIVE_PROBES = (0.25, 0.5, 0.75)
+
+## Maximum number of times a segment of the initial grid is halved by the adaptive sampler.
+ADAPTIVE_DEPTH = 12
+
 ## Trajectory points - will only be initialized in main if usingPointList is set to true.
 pointList = []
 
+## Name of the file where the points of a curve are saved.
+TNAME = "turtle.txt"
+
+## The state of a curve generation.
+#
+#  The module variables above are only the defaults of a new context:
+#  all the functions generating a curve get their state from a context (or from a new one, if none is given),
+#  so many curves can be generated at once, in threads or in a long-lived service,
+#  as long as each context has its own turtle (e.g. a FlailDriver writing to its own files).
+#
+class CurveContext:
+    ## Constructor. Any state not given is taken from the module variables.
+    #
+    #  @param joe turtle (or FlailDriver) the commands are sent to.
+    #  @param radius scale factor applied on curves.
+    #  @param num_sides number of segments per turn.
+    #  @param usingFlail whether joe is a FlailDriver.
+    #  @param staircase whether diagonal lines are treated as a slope.
+    #  @param qformat fixed-point format for lengths (see selectFormat).
+    #  @param tolerance tolerance for sampling the curve adaptively (see adaptiveAngles).
+    #  @param debug debugging mode.
+    #  @param tname name of the file where the points of a curve are saved.
+    #  @param optimizeTurns largest turn folded by the mission optimizer, or None not to optimize.
+    #  @param symmetry whether periodic commands are emitted inside a Repeat block.
+    #  @param period what to do with a range covering the period of the curve more than once: "clip", "report" or "off".
+    #  @param closedLoop whether the segments are quantized in closed loop.
+    #  @param tuned tuned numbers of segments (see loadTuned), or None.
+    #
+    def __init__(self, joe=None, radius=None, num_sides=None, usingFlail=None, staircase=None,
+                 qformat=None, tolerance=None, debug=None, tname=None, optimizeTurns=None, symmetry=None, period=None,
+                 closedLoop=None, tuned=None):
+        g = globals()
+        arg = lambda v, name: g.get(name) if v is None else v
+        self.joe = arg(joe, "joe")
+        self.radius = arg(radius, "radius")
+        self.num_sides = arg(num_sides, "num_sides")
+        self.usingFlail = arg(usingFlail, "usingFlail")
+        self.staircase = arg(staircase, "staircase")
+        self.qformat = arg(qformat, "qformat")
+        self.tolerance = arg(tolerance, "tolerance")
+        self.debug = arg(debug, "__toDebug__")
+        self.tname = arg(tname, "TNAME")
+        self.optimizeTurns = arg(optimizeTurns, "optimizeTurns")
+        self.symmetry = arg(symmetry, "symmetry")
+        self.period = arg(period, "period")
+        self.closedLoop = arg(closedLoop, "closedLoop")
+        self.tuned = arg(tuned, "tuned")
+        ## World window.
+        self.LW, self.LH, self.Xc, self.Yc = LW, LH, Xc, Yc
+        ## Trajectory points read from a file.
+        self.pointList = list(pointList)
+        ## Curves, with the number of segments of the point list.
+        self.curveList = list(curveList)
+        ## Next point of pointList, for polar2Cartesian.
+        self.listIndex = 0
+        ## File handle for saving the current curve.
+        self.tfile = None
+        ## Fixed-point format for lengths (nbits, useBAM).
+        self.fmt = getFormat()
+
+## Return the given context, or a new one, with the module defaults.
+curveContext = lambda ctx: CurveContext() if ctx is None else ctx
+
 ## Draw and put labels onto an axis, which is aligned with the coordinate system.
 #  The origin is at the middle of the axis and there will be the same number of ticks on each side of the axis.
 #
 #  @param length axis length.
 #  @param c axis center.
 #  @param ticks number of divisions.
+#  @param ctx curve context.
 #
-def drawAxis(length, c=0, ticks=10):
+def drawAxis(length, c=0, ticks=10, ctx=None):
+    ctx = curveContext(ctx)
     x = -length/2.0
     dx = -x/ticks
     x += c
-    digits = 1 if radius > 3 else 3
+    digits = 1 if ctx.radius > 3 else 3
     for i in range(-ticks, ticks+1):
         d = str(round(x,digits)).rstrip('0').rstrip('.')
-        joe.write(d)
-        joe.dot()
+        ctx.joe.write(d)
+        ctx.joe.dot()
 
         x += dx
-        joe.forward(dx)
+        ctx.joe.forward(dx)
 
 ## Plot a pair of perpendicular axes.
-def axes(w,h,xc=0,yc=0):
-    move(xc-w/2.0, yc, False) 
-    drawAxis(w,xc)
-    move(xc, yc-h/2.0, False) 
-    joe.left(90)
-    drawAxis(h,yc)
+def axes(w,h,xc=0,yc=0,ctx=None):
+    ctx = curveContext(ctx)
+    move(xc-w/2.0, yc, False, ctx) 
+    drawAxis(w,xc,ctx=ctx)
+    move(xc, yc-h/2.0, False, ctx) 
+    ctx.joe.left(90)
+    drawAxis(h,yc,ctx=ctx)
 
 ## Number of curves.
 ncurves = lambda: len(curveList)
@@ -141,20 +264,24 @@ def crossprod3 (p0,p1,p): u=subvec(p0,p1); v=subvec(p1,p); return (u[1]*v[2]-u[2
 clamp = lambda a: min(max(-1,a),1)
 
 ## Get cartesian coordinates from polar coordinates.
-#   
+#  If r and a are numpy arrays, all points are converted (and written to tfile) at once.
+#
 #  @param r radius.
 #  @param a angle.
+#  @param ctx curve context.
 #  @return p = (x,y)
-def polar2Cartesian (r,a): 
-    if len(pointList)>0:
-       p = f25(polar2Cartesian.listIndex)
-       polar2Cartesian.listIndex += 1
+def polar2Cartesian (r,a,ctx=None): 
+    ctx = curveContext(ctx)
+    if len(ctx.pointList)>0:
+       p = ctx.pointList[ctx.listIndex]
+       ctx.listIndex += 1
     else:
-       p = (r*cos(a),r*sin(a))
-       if tfile:
-          tfile.write ("%f, %f, %f\n" % (p[0],p[1],a))
+       p = (r*numpy.cos(a),r*numpy.sin(a))
+       if ctx.tfile and numpy.ndim(a) > 0:
+          numpy.savetxt(ctx.tfile, numpy.column_stack((p[0],p[1],a)), fmt="%f, %f, %f")
+       elif ctx.tfile:
+          ctx.tfile.write ("%f, %f, %f\n" % (p[0],p[1],a))
     return p
-polar2Cartesian.listIndex = 0
 
 ## Get the polar coordinates from cartesian coordinates.
 cartesian2Polar = lambda x,y: (sqrt(x*x+y*y), atan2(-y,-x)+pi)
@@ -180,8 +307,12 @@ def updateBBOX(p,BBOX=None):
         i += 2
     return BBOX
 
-## Set the color of the curve. 
-setColor = lambda v: joe.color("red" if v < 0 else "blue")
+## Return the command setting the color of the curve. 
+curveColor = lambda v: Color("red" if v < 0 else "blue")
+
+## Every curve below accepts either a single angle or a numpy array of angles,
+#  and returns @f$(r, \theta)@f$ of the same shape.
+#  Curves with two arms are drawn in red for negative angles (see colorSign).
 
 ## Archimedean spiral.
 #  The spiral becomes tighter for smaller values of "b" and wider for larger values.
@@ -202,7 +333,6 @@ setColor = lambda v: joe.color("red" if v < 0 else "blue")
 #  @see https://en.wikipedia.org/wiki/Archimedean_spiral
 #
 def f0 (c, t, a = 0, b=1/(2*pi)): 
-    setColor(t)
     return (c * (a + b * t), t)
 
 ## A rose of \e n or \e 2n petals.
@@ -217,7 +347,7 @@ def f0 (c, t, a = 0, b=1/(2*pi)):
 #  @return a tuple @f$(r, \theta)@f$ representing a point in polar coordinates.
 #  @see https://en.wikipedia.org/wiki/Rose_(mathematics)
 #
-f1 = lambda a, t, n=4: (a * 2*sin(n*t), t)
+f1 = lambda a, t, n=4: (a * 2*numpy.sin(n*t), t)
 
 ## A rose of five petals.
 f2 = lambda a, t: f1(a,t,5)
@@ -233,7 +363,7 @@ f4 = lambda a, t: f1(a,t,2)
 #
 #  @see http://jwilson.coe.uga.edu/emt668/emat6680.2003.fall/shiver/assignment11/polargraphs.htm
 #
-f5 = lambda a, t: (a * cos(t/2.0), t)
+f5 = lambda a, t: (a * numpy.cos(t/2.0), t)
 
 ## Lemniscate of Bernoulli.
 #  - @f$r^2(\theta) = 2 a^2\ cos\ (2 \theta).@f$
@@ -250,13 +380,11 @@ f5 = lambda a, t: (a * cos(t/2.0), t)
 #  @see https://en.wikipedia.org/wiki/Lemniscate_of_Bernoulli
 #
 def f6(a,t):
-    if (t > -pi/4 and t < pi/4) or (t > 3*pi/4 and t < 5*pi/4):
-        setColor(t)
-        return (a * sqrt(cos(2*t)), t)
-    elif (t > pi/4 and t < 3*pi/4) or (t > 5*pi/4 and t < 7*pi/4):
-        return (0,t)
-    else:
-        return (0,t)
+    valid = lemniscateArms(t)
+    return (numpy.where(valid, a * numpy.sqrt(numpy.abs(numpy.cos(2*t))), 0), t)
+
+## Return whether the Lemniscate is defined at each angle (see f6).
+lemniscateArms = lambda t: ((t > -pi/4) & (t < pi/4)) | ((t > 3*pi/4) & (t < 5*pi/4))
 
 ## Circle.
 #  Centered at (0,a) and diameter 2a.
@@ -266,35 +394,35 @@ def f6(a,t):
 #  @param t parametric value.
 #  @return a tuple @f$(r, \theta)@f$ representing a point in polar coordinates.
 #
-f7 = lambda a, t: (a * 2 * sin(t), t)
+f7 = lambda a, t: (a * 2 * numpy.sin(t), t)
 
 ## Bowtie.
 #  - @f$r(\theta) = 2\ sin(2 \theta) + 1.@f$
 #
 #  @see http://jwilson.coe.uga.edu/emat6680fa08/kimh/assignment11hjk/assignment11.html
 #
-f8 = lambda a, t: (a * (2*sin(2*t)+1), t)
+f8 = lambda a, t: (a * (2*numpy.sin(2*t)+1), t)
 
 ## Oscar's butterfly.
 #  - @f$r(\theta) = cos^{2}(5 \theta) + sin(3 \theta) + 0.3.@f$
 #
 #  @see http://jwilson.coe.uga.edu/emt668/emat6680.2003.fall/shiver/assignment11/polargraphs.htm
 #
-f9 = lambda a, t: (a * (cos(5*t)**2 + sin(3*t) + 0.3), t)
+f9 = lambda a, t: (a * (numpy.cos(5*t)**2 + numpy.sin(3*t) + 0.3), t)
 
 ## Crassula Dubia.
 #  - @f$r(\theta) = sin(\theta) + sin^{3}(5 \frac{\theta}{2}).@f$
 #
 #  @see http://jwilson.coe.uga.edu/emt668/emat6680.2003.fall/shiver/assignment11/polargraphs.htm
 #
-f10 = lambda a, t: (a * (sin(t) + sin(5*t/2)**3), t)
+f10 = lambda a, t: (a * (numpy.sin(t) + numpy.sin(5*t/2)**3), t)
 
 ## Majestic butterfly.
 #  - @f$r(\theta) = 9 - 3\ sin (\theta) + 2 \sin \left(3\theta\right) - 3 \sin(7\theta) + 5\ cos(2\theta).@f$
 #
 #  @see https://www.desmos.com/calculator/pgyxrshobg
 #
-f11 = lambda a, t: (a/6 * (9 - 3*sin(t) + 2*sin(3*t) - 3*sin(7*t) + 5*cos(2*t)), t)
+f11 = lambda a, t: (a/6 * (9 - 3*numpy.sin(t) + 2*numpy.sin(3*t) - 3*numpy.sin(7*t) + 5*numpy.cos(2*t)), t)
 
 ## Limaçon of Pascal.
 #  - @f$r(\theta) = a + b\ sin(\theta).@f$
@@ -312,7 +440,7 @@ f11 = lambda a, t: (a/6 * (9 - 3*sin(t) + 2*sin(3*t) - 3*sin(7*t) + 5*cos(2*t)),
 #  @see https://en.wikipedia.org/wiki/Limaçon
 #
 def f12 (c, t, a=2, b=3):
-    return (c/2 * (a + b*sin(t)), t)
+    return (c/2 * (a + b*numpy.sin(t)), t)
 
 ## Hyperbolic Spiral.
 #  - @f$r(\theta) = \frac{a}{\theta}.@f$ 
@@ -330,7 +458,7 @@ def f12 (c, t, a=2, b=3):
 #  @return a tuple @f$(r, \theta)@f$ representing a point in polar coordinates.
 #  @see https://en.wikipedia.org/wiki/Hyperbolic_spiral
 #
-f13 = lambda a, t: ((100*a if t <= 0.01 else a/t), t)
+f13 = lambda a, t: (numpy.where(t <= 0.01, 100*a, a/numpy.where(t <= 0.01, 1, t)), t)
 
 ## Cochleoid.
 #  - @f$r(\theta) = a\ \frac{sin(\theta)}{\theta}.@f$
@@ -344,8 +472,7 @@ f13 = lambda a, t: ((100*a if t <= 0.01 else a/t), t)
 #  @see https://en.wikipedia.org/wiki/Cochleoid
 #
 def f14(a, t): 
-    setColor(t)
-    return ((3*a if t == 0 else 3 * a * sin(t)/t), t)
+    return (numpy.where(t == 0, 3*a, 3 * a * numpy.sin(t)/numpy.where(t == 0, 1, t)), t)
 
 ## Fermat's Spiral.
 #  - @f$ r^2(\theta) = a^2\ \theta.@f$
@@ -359,30 +486,29 @@ def f14(a, t):
 #  @see https://en.wikipedia.org/wiki/Fermat%27s_spiral
 #
 def f15(a, t):
-    sign = -1 if t <= 0 else 1
-    setColor(sign)
-    return (sign*sqrt(a*a/4 * abs(t)), abs(t))
+    sign = numpy.where(t <= 0, -1, 1)
+    return (sign*numpy.sqrt(a*a/4 * numpy.abs(t)), numpy.abs(t))
 
 ## A Face.
 #  - @f$r(\theta) = sin(2^{\theta}) - 1.7.@f$
 #
 #  @see https://www.intmath.com/plane-analytic-geometry/8-curves-polar-coordinates.php
 #
-f16 = lambda a, t: (a * (sin (2**t) - 1.7), t)
+f16 = lambda a, t: (a * (numpy.sin(2**t) - 1.7), t)
 
 ## Heart.
 #  - @f$r(\theta) = 2 - 2\ sin(\theta) + sin(\theta) \frac{\sqrt{ \left| cos(\theta) \right| }} {sin(\theta) + 1.4}.@f$
 #
 #  @see http://mathworld.wolfram.com/HeartCurve.html
 #
-f17 = lambda a, t: (a*0.8 * (2 - 2 * sin(t) + sin(t) * (sqrt(abs(cos(t)) / (sin(t) + 1.4)))), t)
+f17 = lambda a, t: (a*0.8 * (2 - 2 * numpy.sin(t) + numpy.sin(t) * (numpy.sqrt(abs(numpy.cos(t)) / (numpy.sin(t) + 1.4)))), t)
 
 ## Ameba.
 #  - @f$r(\theta) = 1 - cos(\theta)\ sin(3 \theta).@f$
 #
 #  @see https://brilliant.org/wiki/polar-curves/
 #
-f18 = lambda a, t: (a * (1 - cos(t) * sin(3*t)), t)
+f18 = lambda a, t: (a * (1 - numpy.cos(t) * numpy.sin(3*t)), t)
 
 ## Parabola.
 #  - @f$r(\theta) = \frac{l} {1 +\ e\ cos(\theta)}.@f$
@@ -406,8 +532,7 @@ f18 = lambda a, t: (a * (1 - cos(t) * sin(3*t)), t)
 #  @see https://brilliant.org/wiki/polar-curves/
 #
 def f19 (a, t, e=1, l=1):
-    setColor(t)
-    return (a * (l / (1 + e*cos(t))), t)
+    return (a * (l / (1 + e*numpy.cos(t))), t)
 
 ## Hyperbola.
 #  - @f$r(\theta) = \frac{1} {1 + 1.5\ cos(\theta)}.@f$
@@ -417,15 +542,14 @@ def f19 (a, t, e=1, l=1):
 #    - @f$lim_{\theta \rightarrow -2.3^+} r(\theta) = - \infty@f$ 
 #    - @f$lim_{\theta \rightarrow 2.3^-} r(\theta) = \infty@f$ 
 #    - @f$lim_{\theta \rightarrow 2.3^+} r(\theta) = - \infty@f$ 
-#  - Throw an exception (raise ValueError) when @f$(2.05 \leq \theta  \leq 2.481) \text{ or } (-2.481 \leq \theta \leq -2.05).@f$
+#  - Return r = NaN (the point is skipped) when @f$(2.05 \leq \theta  \leq 2.481) \text{ or } (-2.481 \leq \theta \leq -2.05).@f$
 #
 #  @see https://brilliant.org/wiki/polar-curves/
 #
 def f20 (a, t):
-    if (t >= 2.05 and t <= 2.481) or (t >= -2.481 and t <= -2.05): 
-        raise ValueError
-    else: 
-        return f19(a, t, 1.5, 1)
+    r, t = f19(a, t, 1.5, 1)
+    infinity = ((t >= 2.05) & (t <= 2.481)) | ((t >= -2.481) & (t <= -2.05))
+    return (numpy.where(infinity, numpy.nan, r), t)
 
 ## Ellipse.
 #  - @f$r(\theta) = \frac{1} {1 + 0.5\ cos(\theta)}.@f$
@@ -440,7 +564,7 @@ def f21 (a, t):
 #
 #  @see https://elepa.files.wordpress.com/2013/11/fifty-famous-curves.pdf 
 #
-f22 = lambda a, t: (a * (1 + 2 * sin(t/2)), t)
+f22 = lambda a, t: (a * (1 + 2 * numpy.sin(t/2)), t)
 
 ## Star.
 #  - @f$r(\theta) = sin^{2}(1.2\theta) + cos^{3}(6\theta)@f$
@@ -448,8 +572,7 @@ f22 = lambda a, t: (a * (1 + 2 * sin(t/2)), t)
 #  @see https://www.originlab.com/index.aspx?go=products/origin/graphing
 #
 def f23 (a,t):
-    setColor(t)
-    return (a * (sin(1.2*t)**2 + cos(6*t)**3), t)
+    return (a * (numpy.sin(1.2*t)**2 + numpy.cos(6*t)**3), t)
 
 ## Cannabis.
 #  - @f$r(\theta) = (1+0.9\ cos(8\theta))\ (1+0.1\ cos(24\theta))\ (0.9+0.1\ cos(200\theta))\ (1+sin(\theta))@f$
@@ -457,8 +580,7 @@ def f23 (a,t):
 #  @see https://www.wolframalpha.com/input/?i=(1%2B0.9+cos(8+&theta;))+(1%2B0.1+cos(24+&theta;))+(0.9%2B0.1+cos(200+&theta;))+(1%2Bsin(&theta;))+polar+-pi+to+pi
 #
 def f24 (a,t):
-    setColor(t)
-    return (a * ((1+0.9*cos(8*t))*(1+0.1*cos(24*t))*(0.9+0.1*cos(200*t))*(1+sin(t))), t)
+    return (a * ((1+0.9*numpy.cos(8*t))*(1+0.1*numpy.cos(24*t))*(0.9+0.1*numpy.cos(200*t))*(1+numpy.sin(t))), t)
 
 ## Draw a curve defined by a set of points.
 #
@@ -470,13 +592,33 @@ def f25 (i,j=None):
     if j is None: return pointList[i]
     return 0,0
 
+## Curves with two arms, drawn in red for negative angles.
+twoArmed = (f0, f6, f14, f15, f19, f20, f21, f23, f24)
+
+## Return the color sign of each point of a curve: negative for red, and positive for blue (see curveColor).
+#  The Lemniscate has no color where it is not defined: those points keep the color of the previous one (blue at first).
+#
+#  @param func equation.
+#  @param t numpy array of parametric values.
+#  @return a numpy array of signs, or None if the curve is drawn in a single color.
+#
+def colorSign(func, t):
+    if func not in twoArmed:
+       return None
+    sign = numpy.where(t <= 0, -1, 1) if func is f15 else numpy.where(t < 0, -1, 1)
+    if func is f6:
+       last = numpy.maximum.accumulate(numpy.where(lemniscateArms(t), numpy.arange(len(t)), -1))
+       sign = numpy.where(last < 0, 1, sign[last])
+    return sign
+
 ## Initialize the PointList.
 #
 #  @param fname file name with points.
+#  @param ctx curve context, whose pointList and curveList are updated.
 #  @return pointList bounding box.
 #
-def initPointList(fname):
-    global curveList
+def initPointList(fname, ctx=None):
+    ctx = curveContext(ctx)
     fbox = None
     try:
         f = open(fname,'r')
@@ -491,13 +633,13 @@ def initPointList(fname):
            except:
               print("Invalid line %s in file: %s" % (row,fname))
               continue
-           pointList.append(p)
+           ctx.pointList.append(p)
            fbox = updateBBOX(p, fbox)
         else:
            print("Invalid line %s in file: %s" % (row,fname))
     f.close()
     # Update curveList to include the calculated number of segments
-    curveList[25] = (f25,2*pi,0,"Point List Based",len(pointList)-1)
+    ctx.curveList[25] = (f25,2*pi,0,"Point List Based",len(ctx.pointList)-1)
     return fbox
 
 ## Print curve identifications.
@@ -548,23 +690,28 @@ curveList = [(f0,12*pi,-6*pi,"Archimedean spiral"),
 #  @param y coordinate.
 #  @param mode whether to use setposition, or use
 #  only forward, left and right.
+#  @param ctx curve context.
 #
-def move(x,y,mode=True):
-    joe.penup()
-    joe.home()
+def move(x,y,mode=True,ctx=None):
+    drive(moveCommands(x,y,mode), curveContext(ctx).joe)
+
+## Generate the commands moving the turtle to a given point (see move).
+def moveCommands(x,y,mode=True):
+    yield PenUp()
+    yield Home()
     if mode:
-       joe.setposition(x,y)
+       yield SetPosition(x,y)
     else:
-       joe.forward(x)
+       yield Forward(x)
        if y > 0:
           # ----->] F
           #      ^ R 
           #      | L
           # ----->]
           #   F 
-          joe.left(90)
-          joe.forward(y)
-          joe.right(90)
+          yield Left(90)
+          yield Forward(y)
+          yield Right(90)
        elif y < 0:
           # F (actually backward, keep looking forward)
           # <]-----
@@ -572,15 +719,17 @@ def move(x,y,mode=True):
           # | L
           # ----->] F
           #
-          joe.right(90)
-          joe.forward(abs(y))
-          joe.left(90)
-    joe.pendown()
+          yield Right(90)
+          yield Forward(abs(y))
+          yield Left(90)
+    yield PenDown()
 
 ## Draw a box.
-def drawBox(b):
+def drawBox(b,ctx=None):
+    ctx = curveContext(ctx)
+    joe = ctx.joe
     joe.color("violet")
-    move(b[0], b[2], False)
+    move(b[0], b[2], False, ctx)
     joe.forward(b[1]-b[0])
     joe.left(90)
     joe.forward(b[3]-b[2])
@@ -618,6 +767,9 @@ def drawBox(b):
 #
 #  Then, the turtle moves forward by a distance equal to the length of the current segment: @f$\sqrt {{(x_2-x_1)}^2+{(y_2-y_1)}^2}@f$
 #
+#  All angles and lengths are computed on whole arrays, by curveGeometry and quantizeSegments,
+#  and the commands are generated by curveCommands, then streamed to the turtle by mission.drive.
+#
 #  For the first point, we need the angle @f$\alpha \in [0,2\pi]@f$ between the \e x-axis and the vector @f$(x_1-x_0,y_1-y_0):@f$
 #  - @f$\alpha = atan2(y0-y1,x0-x1)+\pi@f$
 #    - @f$atan2(y,x) \rightarrow \alpha \in [-\pi,\pi]@f$
@@ -628,230 +780,1266 @@ def drawBox(b):
 #  @param initialAng initial polar angle.
 #  @param title curve name.
 #  @param nseg number of segments.
+#  @param ctx curve context.
 #
 #  @see https://en.wikipedia.org/wiki/Inverse_trigonometric_functions
 #  @see https://docs.python.org/3/library/math.html
 #  @see https://www.mathsisfun.com/algebra/vectors-dot-product.html
 #
-def polarRose(func, turns, initialAng = 0.0, title=None, nseg=None):
-    global usingFlail, __toDebug__
-
+def polarRose(func, turns, initialAng = 0.0, title=None, nseg=None, ctx=None):
+    ctx = curveContext(ctx)
     if nseg is None:
-        nseg = num_sides
-    joe.reset()
-    if not usingFlail: 
-       axes(LW,LH,Xc,Yc)
-    joe.pensize(3)
-    joe.color("blue")
-    joe.setheading(0)
-
-    ang = initialAng
-    p0 = polar2Cartesian(*func(radius,ang))
-    box = updateBBOX(p0,None)
-    move(p0[0],p0[1],False)
-
-    angle = turns / nseg
-    ang += angle
-    p1 = polar2Cartesian(*func(radius,ang))
-    updateBBOX(p1,box)
-    len0 = veclen(p1,p0)
-    # to return an angle in [0,2pi] -> atan2(-y,-x) + pi
-    p10 = subvec(p1,p0)
-    dir = toUBAM(degrees(atan2(p10[1],p10[0])+pi))
-    if __toDebug__: print("left turn\n")
-    joe.left(dir)
-    ascension(p0,p1)
-    lmin = len0
-    lmax = len0
-    for i in range(1,nseg):
-        ang += angle
-        try:
-           p = polar2Cartesian(*func(radius,ang))
-        except ValueError:
-           print("Going to infinity.")
-           joe.penup()
-           continue
-        updateBBOX(p,box)
-        len1 = veclen(p,p1)
-        len0 = veclen(p1,p0)
-
-        if len0 > 0 and len1 > 0:
-            # get the angle between the previous and the current direction.
-            cang = clamp(dotprod (p0,p1,p) / len0 / len1)
-            # y = acos(x): −1 ≤ x ≤ 1  ->  0 ≤ y ≤ π   or   0° ≤ y ≤ 180°
-            cang = toUBAM(degrees(acos(cang)))
-            # check whether it is a right or left turn.
-            if crossprod(p0,p1,p) < 0:
-               if __toDebug__: print("right turn\n")
-               joe.right(cang)
-            else: 
-               if __toDebug__: print("left turn\n")
-               joe.left(cang)
-            ascension(p1,p)
-            lmin = min(len1,lmin)
-            lmax = max(len1,lmax)
-            joe.pendown()
-
-            p0 = p1
-       	    p1 = p
-        else:
-            print("Null vector")
-    if not usingFlail:
-       drawBox(box)
+        nseg = ctx.num_sides
+    ctx.joe.reset()
+    if not ctx.usingFlail: 
+       axes(ctx.LW,ctx.LH,ctx.Xc,ctx.Yc,ctx)
+
+    pts, sign = evalCurve(func, turns, initialAng, nseg, ctx)
+    geo = (closedLoopSegments if ctx.closedLoop else quantizeSegments)(curveGeometry(pts), ctx)
+    err = numpy.sqrt(((segmentPositions(geo, ctx.usingFlail, ctx) - geo["points"])**2).sum(axis=1))
+    print("Closure error: %f, maximum deviation: %f" % (err[-1], err.max()))
+    # the Repeat blocks ask for the waypoints of every iteration: the path of the drone does not change (see FlailDriver.repeat).
+    period = segmentPeriod(geo, sign, ctx) if ctx.symmetry else None
+    if period is not None:
+       print("Symmetry: %d periods of %d segments" % (period[1], period[0]))
+    cmds = curveCommands(geo, sign, ctx.usingFlail, ctx, period)
+    if ctx.optimizeTurns is not None:
+       import optimize
+       if ctx.usingFlail:
+          cmds = optimize.optimize(cmds, ctx.optimizeTurns, 0x10000, ctx.fmt, waypoints=True)
+       else:
+          cmds = optimize.optimize(cmds, BAM2float(ctx.optimizeTurns), 360, waypoints=True)
+    drive(cmds, ctx.joe)
+    box = geo["box"]
+    if not ctx.usingFlail:
+       drawBox(box, ctx)
     print("%s Bounding Box: %s" % (title,box))
     r1, t1 = cartesian2Polar(box[0], box[2])
     r2, t2 = cartesian2Polar(box[1], box[3])
     t1 = degrees(t1)
     t2 = degrees(t2)
-    uf = usingFlail
-    db = __toDebug__
-    usingFlail = True
-    __toDebug__ = False
-    print("LLC length: %f = %d, %f = %u" % (r1,toInt(r1),t1,float2UBAM(t1)))
-    print("UPC length: %f = %d, %f = %u" % (r2,toInt(r2),t2,float2UBAM(t2)))
-    print("Minimum length: %f = %d" % (lmin,toInt(lmin)))
-    print("Maximum length: %f = %d" % (lmax,toInt(lmax)))
-    usingFlail = uf
-    __toDebug__ = db
-
-
-## Control the turtle's ascension.
+    # the corners are not flown, so their codes may not fit in a word.
+    code = lambda x: int(float2FixedArray(x, fmt=ctx.fmt))
+    word = lambda x: "%d" % code(x) if code(x) <= 65535 else "%d (over 16 bits)" % code(x)
+    print("LLC length: %f = %s, %f = %u" % (r1,word(r1),t1,float2UBAM(t1)))
+    print("UPC length: %f = %s, %f = %u" % (r2,word(r2),t2,float2UBAM(t2)))
+    print("Minimum length: %f = %s" % (geo["lmin"],word(geo["lmin"])))
+    print("Maximum length: %f = %s" % (geo["lmax"],word(geo["lmax"])))
+
+## Return the cartesian points of a curve at the given angles, without writing them anywhere.
+def curvePoints(func, t, ctx=None):
+    r, a = func(curveContext(ctx).radius, t)
+    return numpy.column_stack((r*numpy.cos(a), r*numpy.sin(a)))
+
+## Return the number of times a curve retraces itself in its angle range: the largest k, up to PERIOD_MAX,
+#  such that the curve closes every turns/k radians. Then the points one period apart are the same,
+#  at PERIOD_SAMPLES equally spaced angles of the range, up to PERIOD_TOLERANCE.
+#
+#  Only a curve retracing itself in the same direction counts (a point at an angle moves to the same point at the angle plus the period).
+#
+#  @param func equation.
+#  @param turns polar angle range (extension).
+#  @param initialAng initial polar angle.
+#  @param ctx curve context.
+#  @return the number of periods in the range, 1 if the curve does not retrace itself.
+#
+def curvePeriod(func, turns, initialAng, ctx=None):
+    t = numpy.linspace(initialAng, initialAng + turns, PERIOD_SAMPLES, endpoint=False)
+    with numpy.errstate(all="ignore"):
+         p = curvePoints(func, t, ctx)
+         finite = numpy.isfinite(p).all(axis=1)
+         if not finite.any():
+            return 1
+         tol = PERIOD_TOLERANCE * numpy.abs(p[finite]).max()
+         for k in range(PERIOD_MAX, 1, -1):
+             # only the angles whose successor one period ahead is still in the range
+             s = t < initialAng + turns - turns / k
+             q = curvePoints(func, t[s] + turns / k, ctx)
+             f = finite[s]
+             if (f == numpy.isfinite(q).all(axis=1)).all() and (numpy.abs(q[f] - p[s][f]) <= tol).all():
+                return k
+    return 1
+
+## Distance from each point p to the segment from p0 to p1 (one per row).
+def segmentDistance(p, p0, p1):
+    d = p1 - p0
+    dd = (d*d).sum(axis=1)
+    u = numpy.clip(((p-p0)*d).sum(axis=1) / numpy.where(dd > 0, dd, 1), 0, 1)
+    e = p - p0 - u[:,None]*d
+    return numpy.sqrt((e*e).sum(axis=1))
+
+## Choose the angles for sampling a curve, so that no segment deviates from the curve more than the tolerance.
+#
+#  The sampler starts from nseg/ADAPTIVE_COARSEN equally spaced segments, and halves,
+#  up to ADAPTIVE_DEPTH times, every segment whose chord is farther than the tolerance
+#  from the curve points at the ADAPTIVE_PROBES angles. Each pass evaluates all the segments being refined at once.
+#  Thus, flat stretches keep the coarse spacing, and tight turns get as many points as they need.
+#  A segment whose middle point goes to infinity is halved once, so the gap is not drawn over.
+#
+#  @param func equation.
+#  @param turns polar angle range (extension).
+#  @param initialAng initial polar angle.
+#  @param nseg number of segments of the uniform sampling.
+#  @param tol tolerance. The default is the context tolerance.
+#  @param ctx curve context.
+#  @return a numpy array of increasing (or decreasing) angles.
+#
+def adaptiveAngles(func, turns, initialAng=0.0, nseg=None, tol=None, ctx=None):
+    ctx = curveContext(ctx)
+    if nseg is None:
+       nseg = ctx.num_sides
+    if tol is None:
+       tol = ctx.tolerance
+    n = max(nseg // ADAPTIVE_COARSEN, 2)
+    t = initialAng + turns * numpy.arange(n+1) / n
+    p = curvePoints(func, t, ctx)
+    active = numpy.ones(n, dtype=bool)
+    for depth in range(ADAPTIVE_DEPTH):
+        i = numpy.flatnonzero(active)
+        if len(i) == 0:
+           break
+        # probe each segment at 1/4, 1/2 and 3/4 of its angle range.
+        tq = t[i] + numpy.outer(ADAPTIVE_PROBES, t[i+1] - t[i])
+        pq = curvePoints(func, tq.ravel(), ctx).reshape(len(ADAPTIVE_PROBES), len(i), 2)
+        with numpy.errstate(invalid="ignore"):
+           dev = numpy.array([segmentDistance(q, p[i], p[i+1]) for q in pq])
+        tm = tq[1]
+        pm = pq[1]
+        ends = numpy.isfinite(p[i]).all(axis=1) & numpy.isfinite(p[i+1]).all(axis=1)
+        split = ends & ((dev > tol).any(axis=0) | ~numpy.isfinite(pm).all(axis=1))
+        j = i[split] + 1
+        t = numpy.insert(t, j, tm[split])
+        p = numpy.insert(p, j, pm[split], axis=0)
+        active = numpy.zeros(len(active), dtype=bool)
+        active[j-1] = True
+        active = numpy.insert(active, j, True)
+    return t
+
+## Return the period of the commands drawing a curve (see curveCommands), for curves with a rotational symmetry,
+#  such as the roses: the smallest number of segments after which the turns and the displacements
+#  (and the colors) repeat, as they were quantized, so a period can be emitted once inside a Repeat block.
+#  The first segment is not part of it, as it follows the initial heading, instead of a turn.
+#
+#  @param geo quantized segments, as returned by quantizeSegments.
+#  @param sign the color sign of each point, or None.
+#  @param ctx curve context.
+#  @return a tuple (period, number of periods), or None if the commands have no period repeated at least twice.
+#
+def segmentPeriod(geo, sign=None, ctx=None):
+    ctx = curveContext(ctx)
+    seg = geo["segment"]
+    n = len(seg) - 2
+    # points going to infinity, or null vectors, break the sequence; FLAIL has no nested Repeat for the staircase.
+    if n < 2 or (seg[1:] != numpy.arange(1, len(seg))).any():
+       return None
+    if ctx.staircase and ctx.usingFlail and any(geo["height"]):
+       return None
+    cols = [geo["turnCode"][:n], geo["left"][:n]] + [geo[k][1:] for k in ("forward", "height", "depth")]
+    # a flail driver has no pen, so the colors only count for a turtle.
+    if sign is not None and not ctx.usingFlail:
+       cols.append(sign[2:])
+    units = numpy.column_stack([numpy.asarray(c, dtype=float) for c in cols])
+    for p in range(1, n // 2 + 1):
+        if (units[p:] == units[:-p]).all():
+           return p, n // p
+    return None
+
+## Generate the commands drawing the segment ending at the i-th point of a curve.
+#
+#  @param geo quantized segments, as returned by quantizeSegments.
+#  @param i point index, at least 2.
+#  @param sign the color sign of each point, or None.
+#  @param heights whether the consumer moves in 3D (see ascensionCommands).
+#  @param ctx curve context.
+#
+def segmentCommands(geo, i, sign=None, heights=True, ctx=None):
+    ctx = curveContext(ctx)
+    debug = ctx.debug
+    k = geo["segment"][i]
+    if k < 0:
+       print("Going to infinity.")
+       yield PenUp()
+       return
+    if sign is not None: yield curveColor(sign[i])
+    if k > 0:
+        if debug: printAngleCode(geo["turn"][k-2])
+        # turn from the previous to the current direction.
+        if not geo["left"][k-2]:
+           if debug: print("right turn\n")
+           yield Right(geo["turnCode"][k-2])
+        else: 
+           if debug: print("left turn\n")
+           yield Left(geo["turnCode"][k-2])
+        for c in ascensionCommands(geo, k-1, heights, ctx): yield c
+        yield PenDown()
+    else:
+        print("Null vector")
+
+## Generate the commands drawing a curve, from its quantized segments.
+#  If the commands are periodic (see segmentPeriod), a period is emitted once, inside a Repeat block.
+#
+#  @param geo quantized segments, as returned by quantizeSegments.
+#  @param sign the color sign of each point (see colorSign), or None.
+#  @param heights whether the consumer moves in 3D (see ascensionCommands).
+#  @param ctx curve context.
+#  @param period a tuple (period, number of periods), as returned by segmentPeriod, or None.
+#
+def curveCommands(geo, sign=None, heights=True, ctx=None, period=None):
+    ctx = curveContext(ctx)
+    debug = ctx.debug
+    seg = geo["segment"]
+    p0 = geo["points"][0]
+
+    yield PenSize(3)
+    yield Color("blue")
+    yield SetHeading(0)
+    if sign is not None: yield curveColor(sign[0])
+    for c in moveCommands(p0[0],p0[1],False): yield c
+    if sign is not None: yield curveColor(sign[1])
+    if debug: printAngleCode(geo["heading"])
+    if debug: print("left turn\n")
+    yield Left(geo["headingCode"])
+    for c in ascensionCommands(geo, 0, heights, ctx): yield c
+    start = 2
+    if period is not None:
+       p, n = period
+       yield Repeat(n, [c for i in range(2, 2+p) for c in segmentCommands(geo, i, sign, heights, ctx)], True)
+       start += p * n
+    for i in range(start,len(seg)):
+        for c in segmentCommands(geo, i, sign, heights, ctx): yield c
+
+## Compute, all at once, the segments polarRose draws for a sequence of points.
+#
+#  The first segment goes from the first to the second point.
+#  After that, points going to infinity (NaN) lift the pen, and
+#  points repeating the previous one (null vectors) are skipped.
+#  If the first segment is null, there is nothing else to draw.
+#
+#  @param pts numpy array of points, one per row (2D or 3D).
+#  @return a dictionary with numpy arrays:
+#  - points: the points actually visited.
+#  - segment: for each given point, the number (starting at 1) of the segment ending on it,
+#    0 for the first point and for null vectors, or -1 for a point going to infinity.
+#  - heading: direction of the first segment, in degrees [0,360].
+#  - turn: angle between consecutive segments, in degrees [0,180].
+#  - left: whether each turn is to the left.
+#  - length: length of each segment.
+#  - flen: length of each segment onto plane XY.
+#  - dz: height displacement of each segment.
+#  - box: bounding box of the finite points, [xmin, xmax, ymin, ymax(, zmin, zmax)] (see updateBBOX).
+#  - lmin, lmax: minimum and maximum segment lengths.
+#
+def curveGeometry(pts):
+    pts = numpy.asarray(pts, dtype=float)
+    valid = numpy.isfinite(pts).all(axis=1)
+    valid[:2] = True
+    seg = numpy.where(valid, 0, -1)
+
+    # the first segment, plus a candidate segment to each finite point.
+    idx = numpy.concatenate(([0], numpy.flatnonzero(valid)[1:]))
+    d = numpy.diff(pts[idx], axis=0)
+    seglen = numpy.sqrt((d*d).sum(axis=1))
+    keep = seglen > 0
+    if not keep[0]:
+       keep[1:] = False
+    keep[0] = True
+    seg[idx[1:][keep]] = numpy.arange(1, numpy.count_nonzero(keep)+1)
+    fin = pts[valid]
+    pts = pts[numpy.concatenate(([0], idx[1:][keep]))]
+    d = d[keep]
+    seglen = seglen[keep]
+
+    cang = numpy.clip((d[:-1]*d[1:]).sum(axis=1) / seglen[:-1] / seglen[1:], -1, 1)
+    return {"points": pts, "segment": seg,
+            "heading": numpy.degrees(numpy.arctan2(-d[0,1], -d[0,0]) + pi),
+            "turn": numpy.degrees(numpy.arccos(cang)),
+            "left": d[:-1,0]*d[1:,1] - d[1:,0]*d[:-1,1] >= 0,
+            "length": seglen,
+            "flen": numpy.hypot(d[:,0], d[:,1]),
+            "dz": d[:,2] if pts.shape[1] > 2 else numpy.zeros(len(d)),
+            "box": numpy.column_stack((fin.min(axis=0), fin.max(axis=0))).ravel().tolist(),
+            "lmin": seglen.min(), "lmax": seglen.max()}
+
+## Quantize, all at once, the turns and displacements of the segments returned by curveGeometry,
+#  in the length format of the context.
+#  The codes (or their float values, if not usingFlail) are added to the dictionary, as lists:
+#  - headingCode, turnCode: UBAM codes of the heading and of the turns.
+#  - forward, height, depth: codes of flen, dz and |dz|.
+#  - forwardStep, heightStep: codes of flen/5 and |dz|/5, for the staircase method.
+#
+#  @param geo segments, as returned by curveGeometry.
+#  @param ctx curve context.
+#  @return geo.
+#
+def quantizeSegments(geo, ctx=None):
+    ctx = curveContext(ctx)
+    flen = geo["flen"]
+    dz = geo["dz"]
+    codes = lambda x: toIntArray(x, ctx.fmt, ctx.usingFlail).tolist()
+    geo["headingCode"] = toUBAMArray(geo["heading"], ctx.usingFlail).tolist()
+    geo["turnCode"] = toUBAMArray(geo["turn"], ctx.usingFlail).tolist()
+    geo["forward"] = codes(flen)
+    geo["height"] = codes(dz)
+    geo["depth"] = codes(numpy.abs(dz))
+    geo["forwardStep"] = codes(flen/5)
+    geo["heightStep"] = codes(numpy.abs(dz)/5)
+    return geo
+
+## Quantize the segments returned by curveGeometry in closed loop: instead of quantizing each turn and length
+#  on its own, as quantizeSegments does, the position and heading the drone will actually have are tracked,
+#  with the integer arithmetic of the flail driver (see bam.bamStep), and each segment aims from there at its exact end point.
+#  So the quantization errors do not build up along the path: each command corrects the residual error so far,
+#  and the drone never strays from the curve more than the error of a single segment.
+#
+#  - The heading aims at the end point, and the turn is the difference to the current heading, wrapped to [-180,180).
+#  - The forward length is the projection of the residual vector onto the quantized heading.
+#  - The height is the residual height, if the consumer moves in 3D.
+#
+#  The same keys as quantizeSegments are added to the dictionary, with left, and the heading, turn, flen and dz values, replaced by the closed-loop ones.
+#
+#  @param geo segments, as returned by curveGeometry.
+#  @param ctx curve context.
+#  @return geo.
+#
+def closedLoopSegments(geo, ctx=None):
+    ctx = curveContext(ctx)
+    fmt = ctx.fmt
+    pts = geo["points"]
+    q = numpy.rint(numpy.ldexp(pts, POS_QBITS)).astype(numpy.int64).tolist()
+    x, y = q[0][0], q[0][1]
+    z = q[0][2] if len(q[0]) > 2 else 0
+    heading = 0
+    turns, left, lengths, values = [], [], [], []
+    for k in range(1, len(q)):
+        dx, dy = q[k][0] - x, q[k][1] - y
+        dz = (q[k][2] - z) if len(q[k]) > 2 and ctx.usingFlail else 0
+        # the first segment sets the heading, with a left turn from 0 (see curveCommands)
+        turn = wrapPi(degrees(atan2(dy, dx)) - BAM2float(heading)) if k > 1 else degrees(atan2(dy, dx)) % 360
+        code = int(float2UBAM(abs(turn)))
+        turns.append(code)
+        left.append(turn >= 0)
+        heading = (heading + (code if turn >= 0 else -code)) & 0xFFFF
+        h = BAM2float(heading) * pi / 180
+        flen = max(0.0, ldexp(float(dx * cos(h) + dy * sin(h)), -POS_QBITS))
+        dz = ldexp(dz, -POS_QBITS)
+        values.append((abs(turn), flen, dz))
+        forward, height, depth, fstep, hstep = float2FixedArray([flen, dz, abs(dz), flen/5, abs(dz)/5], fmt=fmt).tolist()
+        lengths.append((forward, height, depth, fstep, hstep))
+        # move as the driver will (see ascensionCommands)
+        if height == 0 or not ctx.usingFlail:
+           d, up = toPosition(forward, fmt), 0
+        elif not ctx.staircase:
+           d, up = toPosition(forward, fmt), (toPosition(height, fmt) if height > 0 else -toPosition(depth, fmt))
+        elif hstep > 0:
+           d, up = 5 * toPosition(fstep, fmt), 5 * (toPosition(hstep, fmt) if height > 0 else -toPosition(hstep, fmt))
+        else:
+           d, up = toPosition(forward, fmt), 0
+        sx, sy = bamStep(d, heading)
+        x, y, z = x + sx, y + sy, z + up
+    lengths = numpy.array(lengths, dtype=numpy.int64).reshape(-1, 5)
+    codes = lambda i: (lengths[:,i] if ctx.usingFlail else toFloatArray(lengths[:,i], fmt)).tolist()
+    angles = lambda a: (a if ctx.usingFlail else BAM2floatArray(a).tolist())
+    geo["headingCode"] = angles(turns[:1])[0]
+    geo["turnCode"] = angles(turns[1:])
+    geo["left"] = numpy.array(left[1:], dtype=bool)
+    geo["forward"] = codes(0)
+    geo["height"] = codes(1)
+    geo["depth"] = codes(2)
+    geo["forwardStep"] = codes(3)
+    geo["heightStep"] = codes(4)
+    # the turns and lengths coded, for the debugging output (see ascensionCommands)
+    values = numpy.array(values, dtype=float).reshape(-1, 3)
+    geo["heading"], geo["turn"], geo["flen"], geo["dz"] = values[0,0], values[1:,0], values[:,1], values[:,2]
+    return geo
+
+## Return the points a drone reaches, flying the quantized segments returned by quantizeSegments (or closedLoopSegments),
+#  computed all at once in floating point: the headings are the cumulative sums of the turns, and the positions
+#  the cumulative sums of the moves (see ascensionCommands).
+#
+#  @param geo quantized segments.
+#  @param heights whether the consumer moves in 3D.
+#  @param ctx curve context.
+#  @return a numpy array with the start point and the end point of each segment, one per row, with the shape of geo["points"].
+#
+def segmentPositions(geo, heights=True, ctx=None):
+    ctx = curveContext(ctx)
+    value = lambda k: numpy.asarray(toFloatArray(geo[k], ctx.fmt) if ctx.usingFlail else geo[k], dtype=float)
+    angle = lambda a: numpy.asarray(BAM2floatArray(a) if ctx.usingFlail else a, dtype=float)
+    turn = numpy.where(geo["left"], 1, -1) * angle(geo["turnCode"])
+    heading = numpy.radians(numpy.cumsum(numpy.concatenate(([angle(geo["headingCode"])], turn))))
+    flen, height, depth = value("forward"), value("height"), value("depth")
+    dz = numpy.where(height > 0, height, -depth)
+    if ctx.staircase:
+       step = (height != 0) & (value("heightStep") > 0)
+       flen = numpy.where(step, 5 * value("forwardStep"), flen)
+       dz = numpy.where(step, numpy.sign(height) * 5 * value("heightStep"), 0)
+    if not heights:
+       dz = numpy.zeros(len(flen))
+    pts = geo["points"]
+    d = numpy.column_stack((flen * numpy.cos(heading), flen * numpy.sin(heading), dz)[:pts.shape[1]])
+    return pts[0] + numpy.concatenate((numpy.zeros((1, pts.shape[1])), numpy.cumsum(d, axis=0)))
+
+## Print how a length is coded in the format of the context, as toInt does in debugging mode (see bam.printLength).
+#
+#  @param x a length.
+#  @param ctx curve context.
+#
+def printLengthCode(x, ctx):
+    nbits, useBAM = ctx.fmt
+    i = int(float2FixedArray([x], fmt=ctx.fmt)[0])
+    t = ("underflow = " if i == 0 else "BAM = ") if useBAM and -180 <= x < 180 else ""
+    printLength(x, i, toFloat(i, ctx.fmt), t)
+
+## Print how an angle is coded in UBAM, as toUBAM does in debugging mode (see bam.printAngle).
+printAngleCode = lambda x: printAngle(x, int(float2UBAM(x)), BAM2float(int(float2UBAM(x))))
+
+## Generate the commands controlling the turtle's ascension along a segment.
 #  If pointList is set, then a file is being used to describe the trajectory.
 #  In this case, decide whether to use the forward-up method or the staircase method.
 #  Forward-up method: move forward until the turtle reaches the second point, then ascend to meet it.
 #  Staircase method: move forward-upwards incrementally until the second point is reached.
 #
-#  @param p0 initial point.
-#  @param p1 end point.
-#
-def ascension(p0, p1):
-    # length onto plane XY
-    flen = veclen(p0[:2],p1[:2])
-    forw_disp = toInt(flen)
-    z_disp = 0 
-    if len(pointList) > 0 and len(p0)>2:
-       z0,z1 = p0[2],p1[2]
-       z_disp = z1 - z0
-       z_disp = toInt(z_disp)
-    if __toDebug__:
+#  @param geo quantized segments, as returned by quantizeSegments.
+#  @param k segment index.
+#  @param heights whether the consumer moves in 3D. Otherwise, the turtle only moves forward.
+#  @param ctx curve context.
+#
+def ascensionCommands(geo, k, heights=True, ctx=None):
+    ctx = curveContext(ctx)
+    forw_disp = geo["forward"][k]
+    z_disp = geo["height"][k]
+    if ctx.debug:
+        printLengthCode(geo["flen"][k], ctx)
+        if geo["points"].shape[1] > 2:
+           printLengthCode(geo["dz"][k], ctx)
         print("Forw disp: %f Z Disp: %f" % (forw_disp, z_disp))
 
-    if (z_disp == 0 or not usingFlail):
-        joe.forward(forw_disp)
-    elif (not staircase):
+    if (z_disp == 0 or not heights):
+        yield Forward(forw_disp)
+    elif (not ctx.staircase):
         if (z_disp > 0):
-            joe.forward(forw_disp)
-            joe.ascend(z_disp)
+            yield Forward(forw_disp)
+            yield Ascend(z_disp)
         elif (z_disp < 0):
-            joe.descend(toInt(abs(z1 - z0)))
-            joe.forward(forw_disp)
+            if ctx.debug: printLengthCode(abs(geo["dz"][k]), ctx)
+            yield Descend(geo["depth"][k])
+            yield Forward(forw_disp)
     else:
         if (abs(z_disp) > 0):
             inst = []
             n = 5
-            z_dispIter = toInt(abs(z1 - z0)/n)
-            forw_dispIter = toInt(abs(flen)/n)
-            if __toDebug__:
-               print("Forw: %f For_conv: %f" % (flen, forw_disp))
-               print("Z disp: %f Z_disp_conv: %f" % (z1 - z0, z_disp))
+            z_dispIter = geo["heightStep"][k]
+            forw_dispIter = geo["forwardStep"][k]
+            if ctx.debug:
+               printLengthCode(abs(geo["dz"][k])/n, ctx)
+               printLengthCode(geo["flen"][k]/n, ctx)
+               print("Forw: %f For_conv: %f" % (geo["flen"][k], forw_disp))
+               print("Z disp: %f Z_disp_conv: %f" % (geo["dz"][k], z_disp))
                print("Z iterations: %f" %z_dispIter)
 
             # if z_dispIter is 0, don't bother doing a repeat and splitting up forward inst
             if (z_dispIter > 0):
                 if (z_disp > 0):
-                    inst.append((joe.ascend, z_dispIter))
+                    inst.append(Ascend(z_dispIter))
                 elif (z_disp < 0):
-                    inst.append((joe.descend, z_dispIter))
-                inst.append((joe.forward, forw_dispIter))
-                joe.repeat(n, inst)
+                    inst.append(Descend(z_dispIter))
+                inst.append(Forward(forw_dispIter))
+                yield Repeat(n, inst, True)
             else:
-                joe.forward(forw_disp)
+                yield Forward(forw_disp)
 
-## Draw the c-th curve.
-def drawCurve(c,toRead,NS):
-    global tfile, LW , LH, Xc, Yc, pointList, num_sides
+## Sample the points of a curve, as polarRose does, without drawing anything.
+#
+#  @param func equation.
+#  @param turns polar angle range (extension).
+#  @param initialAng initial polar angle.
+#  @param nseg number of segments.
+#  @param ctx curve context.
+#  @return a numpy array with one point per row (the pointList, if set). Points going to infinity are dropped.
+#
+def sampleCurve(func, turns, initialAng=0.0, nseg=None, ctx=None):
+    ctx = curveContext(ctx)
+    tfile = ctx.tfile
+    ctx.tfile = None
+    pts = evalCurve(func, turns, initialAng, nseg, ctx)[0]
+    ctx.tfile = tfile
+    return pts[numpy.isfinite(pts).all(axis=1)]
+
+## Evaluate a curve at nseg+1 equally spaced angles, all at once,
+#  or at the angles chosen by adaptiveAngles, if a tolerance is set.
+#  The points are also written to the context tfile, if it is open (see polar2Cartesian).
+#
+#  @param func equation.
+#  @param turns polar angle range (extension).
+#  @param initialAng initial polar angle.
+#  @param nseg number of segments.
+#  @param ctx curve context.
+#  @return a tuple (pts, sign):
+#  - pts: a numpy array with one point per row (the pointList, if set), and NaN for points going to infinity.
+#  - sign: the color sign of each point (see colorSign), or None.
+#
+def evalCurve(func, turns, initialAng=0.0, nseg=None, ctx=None):
+    ctx = curveContext(ctx)
+    if nseg is None:
+       nseg = ctx.num_sides
+    if len(ctx.pointList) > 0:
+       return numpy.array(ctx.pointList[:nseg+1], dtype=float), None
+    if ctx.tolerance is None:
+       # the same angles as adding turns/nseg to initialAng, nseg times.
+       t = numpy.cumsum(numpy.concatenate(([initialAng], numpy.full(nseg, turns / nseg))))
+    else:
+       t = adaptiveAngles(func, turns, initialAng, nseg, ctx=ctx)
+    r, a = func(ctx.radius, t)
+    pts = numpy.full((len(t), 2), numpy.nan)
+    ok = numpy.isfinite(r)
+    pts[ok] = numpy.column_stack(polar2Cartesian(r[ok], a[ok], ctx))
+    return pts, colorSign(func, t)
+
+## Return the initial heading, turns and lengths polarRose produces for a sequence of points (see curveGeometry).
+#
+#  @param pts numpy array of points, one per row (2D or 3D).
+#  @return a tuple (pts, heading, turn, left, flen, dz).
+#
+def curveSegments(pts):
+    geo = curveGeometry(pts)
+    return tuple(geo[k] for k in ("points", "heading", "turn", "left", "flen", "dz"))
+
+## Summarize an array of quantization errors.
+#
+#  @param x exact values.
+#  @param codes their integer codes.
+#  @param q the values the codes represent.
+#  @return a dictionary with the max, mean and percentile (50, 90, 99) absolute errors, and the number of underflows to zero.
+#
+def errorStats(x, codes, q):
+    err = numpy.abs(x - q)
+    if len(err) == 0:
+       err = numpy.zeros(1)
+    p50, p90, p99 = numpy.percentile(err, [50, 90, 99])
+    return {"max": err.max(), "mean": err.mean(), "p50": p50, "p90": p90, "p99": p99,
+            "underflows": int(numpy.count_nonzero((codes == 0) & (x != 0)))}
+
+## Profile the BAM and fixed-point quantization of a whole curve, in one batched pass.
+#
+#  Every turn (UBAM) and every length and height (toInt) is quantized,
+#  and the quantized commands are replayed to measure how far the turtle ends up from the exact points.
+#
+#  @param pts numpy array of points, one per row.
+#  @param title curve name.
+#  @param fmt length format (nbits, useBAM). The default is the current format.
+#  @return a report (dictionary) with the errors of "turns", "lengths" and "heights" (see errorStats),
+#  the number of "segments", the "drift" at the endpoint and the "maxDeviation" along the path,
+#  or None if there are less than two distinct points.
+#
+def quantizationProfile(pts, title=None, fmt=None):
+    pts = numpy.asarray(pts, dtype=float)
+    if len(pts) < 2 or not numpy.any(pts != pts[0]):
+       return None
+    pts, heading, turn, left, flen, dz = curveSegments(pts)
+    angles = numpy.concatenate(([heading], turn))
+    acodes = float2UBAMArray(angles)
+    lcodes = float2FixedArray(flen, fmt=fmt)
+    zcodes = float2FixedArray(dz, fmt=fmt)
+
+    # replay the commands: accumulated (wrapping) heading and position.
+    sign = numpy.concatenate(([1], numpy.where(left, 1, -1)))
+    h = numpy.cumsum(sign * acodes.astype(numpy.int64)) & 0xFFFF
+    lq = toFloatArray(lcodes, fmt)
+    path = numpy.cumsum(numpy.column_stack((lq * bamCos(h), lq * bamSin(h))), axis=0) + pts[0,:2]
+    dev = numpy.hypot(*(path - pts[1:,:2]).T)
+
+    return {"title": title, "format": formatName(fmt), "segments": len(flen),
+            "turns": errorStats(angles, acodes, BAM2floatArray(acodes)),
+            "lengths": errorStats(flen, lcodes, lq),
+            "heights": errorStats(dz, zcodes, toFloatArray(zcodes, fmt)),
+            "drift": dev[-1], "maxDeviation": dev.max()}
+
+## Print a report returned by quantizationProfile.
+def printProfile(report):
+    if report is None:
+       print("Nothing to profile.")
+       return
+    print("%s: %d segments, %s lengths" % (report["title"], report["segments"], report["format"]))
+    for k in ("turns", "lengths", "heights"):
+        s = report[k]
+        print("  %-7s max = %f, mean = %f, p50 = %f, p90 = %f, p99 = %f, underflows = %d" %
+              (k, s["max"], s["mean"], s["p50"], s["p90"], s["p99"], s["underflows"]))
+    print("  endpoint drift = %f, max deviation = %f" % (report["drift"], report["maxDeviation"]))
+
+## Profile the quantization of the c-th curve.
+#
+#  @param c curve number.
+#  @param toRead point list file name.
+#  @param NS number of segments per turn.
+#  @param ctx curve context.
+#  @return a report (see quantizationProfile), or None if the curve could not be loaded.
+#
+def profileCurve(c, toRead, NS, ctx=None):
+    ctx = curveContext(ctx)
+    curve = prepareCurve(c, toRead, NS, ctx)
+    if curve is None:
+       return None
+    pts = sampleCurve(*curveSampling(curve, ctx), ctx=ctx)
+    fmt = selectFormat(pts, ctx)
+    return quantizationProfile(pts, curve[3], fmt)
+
+## Fold the turns of quantized segments as the mission optimizer does (see optimize.peephole):
+#  a turn, modulo a full turn, up to the tolerance is not made, but added to the next one.
+#
+#  @param geo quantized segments (see quantizeSegments).
+#  @param tolerance largest turn folded, in the units of the angles.
+#  @param fullTurn angle of a full turn: 0x10000 for UBAM codes, 360 for degrees.
+#  @return a copy of geo, with the turns folded.
+#
+def foldTurns(geo, tolerance, fullTurn=0x10000):
+    turn = 0
+    folded = []
+    for a in [geo["headingCode"]] + [a if l else -a for a, l in zip(geo["turnCode"], geo["left"])]:
+        turn = (turn + a) % fullTurn
+        if turn > fullTurn / 2:
+           turn -= fullTurn
+        folded.append(turn if abs(turn) > tolerance else 0)
+        if abs(turn) > tolerance:
+           turn = 0
+    geo = dict(geo)
+    geo["headingCode"] = folded[0] % fullTurn
+    geo["turnCode"] = [abs(a) for a in folded[1:]]
+    geo["left"] = numpy.array([a >= 0 for a in folded[1:]], dtype=bool)
+    return geo
+
+## Return the maximum deviation from a curve of the path a drone flies, when the curve is sampled with nseg segments.
+#
+#  The curve is sampled as evalCurve does, quantized as polarRose does (see quantizeSegments and closedLoopSegments),
+#  its turns are folded as the mission optimizer does, if it is on (see foldTurns), and the quantized path is computed by segmentPositions. Then, all at once, the curve is evaluated at TUNE_PROBES angles inside each segment,
+#  and each of these points is compared with the quantized segment flown between the same angles (see segmentDistance).
+#  Segments going to infinity are not flown, so they are left out.
+#
+#  @param func equation.
+#  @param turns polar angle range (extension).
+#  @param initialAng initial polar angle.
+#  @param nseg number of segments.
+#  @param ctx curve context. Its format is left as it was.
+#  @return the maximum distance, or infinity if nothing is flown.
+#
+def pathDeviation(func, turns, initialAng, nseg, ctx=None):
+    ctx = curveContext(ctx)
+    if ctx.tolerance is None:
+       t = numpy.cumsum(numpy.concatenate(([initialAng], numpy.full(nseg, turns / nseg))))
+    else:
+       t = adaptiveAngles(func, turns, initialAng, nseg, ctx=ctx)
+    with numpy.errstate(all="ignore"):
+         pts = curvePoints(func, t, ctx)
+         probes = curvePoints(func, (t[:-1,None] + numpy.diff(t)[:,None] * numpy.arange(TUNE_PROBES) / TUNE_PROBES).ravel(), ctx)
+    finite = numpy.isfinite(pts).all(axis=1)
+    pts[~finite] = numpy.nan
+    if finite.sum() < 2:
+       return numpy.inf
+    try:
+       fmt = lengthFormat(pts[finite], ctx.qformat, ctx.staircase)
+    except ValueError:
+       fmt = (8, True)
+    fmt, ctx.fmt = ctx.fmt, fmt
+    try:
+       geo = (closedLoopSegments if ctx.closedLoop else quantizeSegments)(curveGeometry(pts), ctx)
+       if ctx.optimizeTurns is not None:
+          geo = foldTurns(geo, ctx.optimizeTurns) if ctx.usingFlail else foldTurns(geo, BAM2float(ctx.optimizeTurns), 360)
+       path = segmentPositions(geo, ctx.usingFlail, ctx)
+    finally:
+       ctx.fmt = fmt
+    # position of the drone at each angle: at the end of the last segment flown.
+    seg = geo["segment"]
+    at = numpy.maximum.accumulate(numpy.where(seg > 0, seg, 0))
+    flown = numpy.repeat((seg[:-1] >= 0) & (seg[1:] >= 0), TUNE_PROBES) & numpy.isfinite(probes).all(axis=1)
+    if not flown.any():
+       return numpy.inf
+    a = numpy.repeat(path[at[:-1], :2], TUNE_PROBES, axis=0)[flown]
+    b = numpy.repeat(path[at[1:], :2], TUNE_PROBES, axis=0)[flown]
+    return segmentDistance(probes[flown], a, b).max()
+
+## Find the smallest number of segments for which the path flown stays within a maximum deviation from a curve (see pathDeviation).
+#  The number of segments is doubled from TUNE_MIN until the path is close enough, and then bisected,
+#  assuming that more segments never fly a worse path.
+#
+#  @param c curve number.
+#  @param maxDeviation maximum deviation, in the units of the curve points.
+#  @param ctx curve context, which is left as it was: the curve is prepared in a copy.
+#  @return a tuple (number of segments, deviation), or None if TUNE_MAX segments are not enough (or c is the point list).
+#
+def tuneCurve(c, maxDeviation, ctx=None):
+    from copy import copy
+    ctx = copy(curveContext(ctx))
+    if ctx.curveList[c][3] == "Point List Based":
+       return None
+    curve = prepareCurve(c, None, ctx.num_sides, ctx)
+    deviation = lambda n: pathDeviation(curve[0], curve[1], curve[2], n, ctx)
+    lo, hi = TUNE_MIN // 2, TUNE_MIN
+    dev = deviation(hi)
+    while dev > maxDeviation:
+        if hi >= TUNE_MAX:
+           return None
+        lo, hi = hi, min(2 * hi, TUNE_MAX)
+        dev = deviation(hi)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        d = deviation(mid)
+        if d <= maxDeviation:
+           hi, dev = mid, d
+        else:
+           lo = mid
+    return hi, dev
+
+## Return the settings a tuned number of segments depends on, besides the curve.
+tuneSettings = lambda ctx: {"scale": ctx.radius, "qformat": ctx.qformat, "staircase": ctx.staircase,
+                            "closedLoop": ctx.closedLoop, "period": ctx.period, "tolerance": ctx.tolerance,
+                            "optimizeTurns": ctx.optimizeTurns, "usingFlail": bool(ctx.usingFlail)}
+
+## Read tuned numbers of segments: a dictionary with a list of entries per curve title,
+#  each one with the tuneSettings, the maximum deviation and the number of segments, "nseg".
+#
+#  @param fname json file.
+#  @return the dictionary, or None if the file cannot be read.
+#
+def loadTuned(fname=TUNED):
+    import json
+    try:
+       with open(fname) as f:
+          return json.load(f)
+    except (IOError, OSError, ValueError):
+       return None
+
+## Add a tuned number of segments to a dictionary read by loadTuned, replacing the entry with the same settings, and write it.
+#
+#  @param table dictionary, or None for an empty one.
+#  @param title curve title.
+#  @param nseg number of segments.
+#  @param maxDeviation maximum deviation the number of segments was tuned for.
+#  @param ctx curve context, with the settings.
+#  @param fname json file.
+#  @return the dictionary.
+#
+def storeTuned(table, title, nseg, maxDeviation, ctx=None, fname=TUNED):
+    ctx = curveContext(ctx)
+    table = table or {}
+    settings = tuneSettings(ctx)
+    entries = [e for e in table.get(title, []) if any(e.get(k) != v for k, v in settings.items())]
+    entries.append(dict(settings, maxDeviation=maxDeviation, nseg=nseg))
+    table[title] = entries
+    import json
+    with open(fname, "w") as f:
+       json.dump(table, f, indent=1, sort_keys=True)
+    return table
+
+## Return the tuned number of segments of a curve, for the settings of the context, or None if it was not tuned.
+#
+#  @param title curve title.
+#  @param ctx curve context.
+#
+def tunedSegments(title, ctx=None):
+    ctx = curveContext(ctx)
+    settings = tuneSettings(ctx)
+    for e in (ctx.tuned or {}).get(title, []):
+        if all(e.get(k) == v for k, v in settings.items()):
+           return e["nseg"]
+    return None
+
+## Tune the number of segments of the given curves (see tuneCurve), and store them (see storeTuned).
+#
+#  @param curves curve numbers.
+#  @param maxDeviation maximum deviation.
+#  @param fname json file, where the tuned numbers of segments are added.
+#  @param ctx curve context.
+#  @return the number of curves that could not be tuned.
+#
+def tuneCurves(curves, maxDeviation, fname=TUNED, ctx=None):
+    ctx = curveContext(ctx)
+    table = loadTuned(fname)
+    failed = 0
+    for c in curves:
+        title = ctx.curveList[c][3]
+        if title == "Point List Based":
+           continue
+        res = tuneCurve(c, maxDeviation, ctx)
+        if res is None:
+           print("%d: %s: %d segments are not enough%s" % (c, title, TUNE_MAX, "" if ctx.closedLoop else " (see --closedloop)"))
+           failed += 1
+        else:
+           print("%d: %s: %d segments, deviation = %f" % (c, title, res[0], res[1]))
+           table = storeTuned(table, title, res[0], maxDeviation, ctx, fname)
+    return failed
+
+## Return the lengths a mission emits for a sequence of points:
+#  the length of each segment onto plane XY, the absolute height displacements and,
+#  for the staircase method, their fractions.
+#
+#  @param pts numpy array of points, one per row.
+#  @param staircase whether the staircase method is used.
+#  @return a numpy array of lengths.
+#
+def missionLengths(pts, staircase=False):
+    if len(pts) < 2 or not numpy.any(pts != pts[0]):
+       return numpy.zeros(0)
+    flen, dz = curveSegments(pts)[4:]
+    lengths = [flen, numpy.abs(dz)]
+    if staircase:
+       lengths += [flen/5, numpy.abs(dz)/5]
+    return numpy.concatenate(lengths)
+
+## Return the fixed-point format of the lengths of a mission (see selectFormat).
+#
+#  @param pts numpy array of points, one per row.
+#  @param qformat "auto", "bam" or the number of bits after the binary point.
+#  @param staircase whether the staircase method is used.
+#  @return the format (nbits, useBAM).
+#  @throw ValueError if qformat is "auto" and no format codes all the lengths.
+#
+def lengthFormat(pts, qformat, staircase=False):
+    if qformat == "bam":
+       return (8, True)
+    if qformat == "auto":
+       return chooseFormat(missionLengths(pts, staircase))
+    return (int(qformat), False)
+
+## Set the fixed-point format of the lengths of a mission, according to the context qformat.
+#  In "auto" mode, the format that codes all mission lengths with the smallest error in 16-bit words is chosen.
+#  With a given format, lengths whose codes do not fit in 16-bit words are only warned about:
+#  the FLAIL text has decimal operands, and flail.c (as flail.BytecodeWriter) splits the big ones with repeatNextInstFor.
+#
+#  @param pts numpy array of points, one per row.
+#  @param ctx curve context, whose format is set.
+#  @return the format (nbits, useBAM).
+#  @throw ValueError if the flail driver is used in "auto" mode, and no format codes all the lengths in 16-bit words.
+#
+def selectFormat(pts, ctx=None):
+    ctx = curveContext(ctx)
+    lengths = missionLengths(pts, ctx.staircase)
+    try:
+       fmt = lengthFormat(pts, ctx.qformat, ctx.staircase)
+    except ValueError as e:
+       if ctx.usingFlail:
+          raise
+       print("%s: using BAM+Q8." % e)
+       fmt = (8, True)
+    if ctx.usingFlail and len(lengths) and float2FixedArray(lengths, fmt=fmt).max() > 65535:
+       print("Warning: lengths up to %f do not fit in 16-bit words with %s, and are split: choose a smaller scale, or another format (-q)" %
+             (lengths.max(), formatName(fmt)))
+    ctx.fmt = fmt
+    print("Length format = %s" % formatName(fmt))
+    return fmt
+
+## Return the arguments of sampleCurve for a curveList entry: (func, turns, initialAng, nseg).
+def curveSampling(curve, ctx=None):
+    return curve[0], curve[1], curve[2], (curve[4] if len(curve) > 4 else curveContext(ctx).num_sides)
+
+## Prepare the c-th curve: read its point list, if any, and set the world window and the number of segments.
+#  A range covering the period of the curve more than once is clipped to a single period, or reported (see curvePeriod).
+#  A curve tuned for the settings of the context gets its tuned number of segments (see tunedSegments).
+#
+#  @param c curve number.
+#  @param toRead point list file name.
+#  @param NS number of segments per turn.
+#  @param ctx curve context, which is set for the curve.
+#  @return the curveList entry of the curve, with its range clipped, or None if its point list could not be read.
+#
+def prepareCurve(c, toRead, NS, ctx=None):
+    ctx = curveContext(ctx)
 
-    if usingFlail:
-       joe.reset()
     # start over with an empty point list
-    pointList = []
-    polar2Cartesian.listIndex = 0        
-    cname = curveList[c][3]
+    ctx.pointList = []
+    ctx.listIndex = 0
+    cname = ctx.curveList[c][3]
     if cname == "Point List Based":
         try:
-           fbox = initPointList(toRead)
+           fbox = initPointList(toRead, ctx)
         except:
-           return
+           return None
         if fbox is None:
            print("Empty file %s" % toRead)
-           return
+           return None
         LW = fbox[1]-fbox[0]
         LH = fbox[3]-fbox[2]
         if LW == 0: LW=1
         if LH == 0: LH=1
-        LW = LH = max(LW,LH)
-        Xc = (fbox[1]+fbox[0])/2.0
-        Yc = (fbox[3]+fbox[2])/2.0
+        ctx.LW = ctx.LH = max(LW,LH)
+        ctx.Xc = (fbox[1]+fbox[0])/2.0
+        ctx.Yc = (fbox[3]+fbox[2])/2.0
     else:
-        LW = LH = radius * 8.5
-        Xc = Yc = 0
-    turtle.setworldcoordinates(Xc-LW/2.0,Yc-LH/2.0,Xc+LW/2.0,Yc+LH/2.0) 
-    turtle.title("%d: %s" % (c, help(c)))
-    nturns = int(curveList[c][1]/(2*pi))
-    num_sides = NS
+        ctx.LW = ctx.LH = ctx.radius * 8.5
+        ctx.Xc = ctx.Yc = 0
+    curve = ctx.curveList[c]
+    if cname != "Point List Based" and ctx.period != "off":
+       k = curvePeriod(curve[0], curve[1], curve[2], ctx)
+       if k > 1:
+          print("Period: the curve retraces itself %d times in its range of %g pi" % (k, curve[1]/pi))
+          if ctx.period == "clip":
+             curve = curve[:1] + (curve[1]/k,) + curve[2:]
+             print("Period: range clipped to %g pi" % (curve[1]/pi))
+    nturns = int(curve[1]/(2*pi))
+    ctx.num_sides = NS
     if nturns > 0:
-       num_sides *= nturns
-    print ("Number of segments = %d " % (num_sides if len(curveList[c]) < 5 else curveList[c][4]))
+       ctx.num_sides *= nturns
+    nseg = tunedSegments(cname, ctx)
+    if nseg is not None:
+       curve = curve[:4] + (nseg,)
+       ctx.num_sides = nseg
+    return curve
+
+## Return the cache key of the commands the c-th curve generates (see curvecache).
+#  It covers the curve, the scale, the number of segments, the tolerance, the staircase method, the contents of the point list,
+#  the optimizer tolerance, the symmetry detection, the period finder, the closed loop, the tuned number of segments, the length format, the driver (its class, and whether its commands are written, as the gps backend discards them),
+#  its state and the source code generating the commands.
+#
+#  @param c curve number.
+#  @param toRead point list file name.
+#  @param NS number of segments per turn.
+#  @param ctx curve context.
+#  @return a key.
+#
+def curveKey(c, toRead, NS, ctx=None):
+    import curvecache, optimize
+    ctx = curveContext(ctx)
+    state = ctx.joe.mark()
+    plist = curvecache.fileDigest(toRead) if ctx.curveList[c][3] == "Point List Based" else None
+    return curvecache.cacheKey(c, ctx.radius, NS, ctx.tolerance, ctx.staircase, plist, ctx.optimizeTurns, ctx.symmetry, ctx.period,
+                               ctx.closedLoop, tunedSegments(ctx.curveList[c][3], ctx), ctx.qformat,
+                               type(ctx.joe).__name__, getattr(ctx.joe, "flailFile", None) != os.devnull, state["wptOrder"], state["altitude"],
+                               curvecache.sourceDigest(sys.modules[__name__], bam, optimize, sys.modules[type(ctx.joe).__module__]))
+
+## Generate the c-th curve from the cache, if it is there.
+#
+#  @param key cache key of the curve (see curveKey).
+#  @param ctx curve context.
+#  @return whether it was found.
+#
+def restoreCurve(key, ctx=None):
+    import curvecache
+    ctx = curveContext(ctx)
+    entry = curvecache.lookup(key)
+    if entry is None:
+       return False
+    files, meta = entry
+    print("%s: cached (%s)" % (meta["title"], key))
+    ctx.fmt = parseFormat(meta["format"])
+    if "turtle.txt" in files:
+       with open(ctx.tname, "w") as f:
+          f.write(files["turtle.txt"])
+    ctx.joe.restore(files, meta["state"])
+    ctx.joe.fmt = ctx.fmt
+    return True
+
+## Store in the cache the commands written since a mark.
+#
+#  @param key cache key of the curve (see curveKey).
+#  @param mark as returned by joe.mark, before the curve was generated.
+#  @param title curve name.
+#  @param tname name of the file with the curve points, if it was written.
+#  @param ctx curve context.
+#
+def storeCurve(key, mark, title, tname=None, ctx=None):
+    import curvecache
+    ctx = curveContext(ctx)
+    files, state = ctx.joe.snapshot(mark)
+    if tname is not None:
+       with open(tname) as f:
+          files["turtle.txt"] = f.read()
+    curvecache.store(key, files, {"title": title, "format": formatName(ctx.fmt), "state": state})
+
+## Draw the c-th curve.
+#  Using the flail driver, the commands are taken from the cache, if it is enabled (see curvecache.cacheDir)
+#  and the curve has already been generated with the same parameters.
+#  The cache is disabled until curvecache is imported, by the -c option or a batch job with a cache directory.
+#
+#  @param c curve number.
+#  @param toRead point list file name.
+#  @param NS number of segments per turn.
+#  @param ctx curve context. By default, a new context is created from the module variables.
+#  @return whether the curve was drawn: False if its point list could not be read, or is empty.
+#
+def drawCurve(c,toRead,NS,ctx=None):
+    ctx = curveContext(ctx)
+    joe = ctx.joe
+
+    key = None
+    if ctx.usingFlail:
+       joe.reset()
+       cache = sys.modules.get("curvecache")
+       if cache is not None and cache.cacheDir is not None and hasattr(joe, "mark"):
+          key = curveKey(c, toRead, NS, ctx)
+          if restoreCurve(key, ctx):
+             return True
+          mark = joe.mark()
+    curve = prepareCurve(c, toRead, NS, ctx)
+    if curve is None:
+       return False
+    cname = curve[3]
+    setworld = getattr(joe, "setworldcoordinates", None) or graphics.setworldcoordinates
+    setworld(ctx.Xc-ctx.LW/2.0,ctx.Yc-ctx.LH/2.0,ctx.Xc+ctx.LW/2.0,ctx.Yc+ctx.LH/2.0)
+    if not ctx.usingFlail:
+       graphics.title("%d: %s" % (c, help(c)))
+    print ("Number of segments = %d " % (ctx.num_sides if len(curve) < 5 else curve[4]))
+    pts = sampleCurve(*curveSampling(curve, ctx), ctx=ctx)
+    if ctx.tolerance is not None and len(ctx.pointList) == 0:
+       print ("Adaptive sampling = %d points, tolerance = %g " % (len(pts), ctx.tolerance))
+    fmt = selectFormat(pts, ctx)
+    if ctx.usingFlail:
+       joe.setformat(formatName(fmt))
     # write the curve on a file
-    if len(pointList) == 0:
-       tfile = open("turtle.txt", 'w')
-    polarRose(*curveList[c])
-    if tfile:
-       tfile.close()
-    if not usingFlail: # flailDriver is not being used
+    if len(ctx.pointList) == 0:
+       ctx.tfile = open(ctx.tname, 'w')
+    polarRose(*curve, ctx=ctx)
+    tname = None
+    if ctx.tfile:
+       tname = ctx.tfile.name
+       ctx.tfile.close()
+       ctx.tfile = None
+    if key is not None:
+       storeCurve(key, mark, cname, tname, ctx)
+    if not ctx.usingFlail: # flailDriver is not being used
        cname = 'images/' + cname
        cname += '.ps'
        with open(cname, 'wb') as ps:
-          ps.write(turtle.Screen().getcanvas().postscript().encode('utf-8'))
+          ps.write(graphics.Screen().getcanvas().postscript().encode('utf-8'))
        cname = cname.replace (' ','\ ')
        cname = cname.replace ("\'","\\'")
        cnameo = cname.replace (".ps",".png")
        # convert to pdf
-       if find_executable("ps2pdf") is not None:
+       if which("ps2pdf") is not None:
           os.system("ps2pdf %s" % cname)
           cnamePDF = cname[7:].replace(".ps", ".pdf")
           os.rename(cnamePDF, "images/"+cnamePDF)
        # convert to png
-       if find_executable("gs") is not None:
+       if which("gs") is not None:
           os.system("gs -dNOPAUSE -dBATCH -sDEVICE=png16m -sOutputFile=%s %s" % (cnameo,cname))
+    return True
+
+## Return the list of integers given by a string, such as "0-5,9,12-14".
+def parseRange(spec):
+    l = []
+    for r in spec.split(","):
+        a, sep, b = r.partition("-")
+        l += range(int(a), int(b if sep else a)+1)
+    return l
+
+## Return the flailDriver module: the one shadowing turtle (see flail.sh), or the one in docRose.
+def flailDriverModule():
+    m = sys.modules.get("turtle")
+    if m is not None and hasattr(m, "FlailDriver"):
+       return m
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docRose")
+    if path not in sys.path:
+       sys.path.append(path)
+    import flailDriver
+    return flailDriver
+
+## Return the FlailDriver class, even when the turtle module is the real one.
+flailDriverClass = lambda: flailDriverModule().FlailDriver
+
+## Return the backend given by the environment:
+#  flail, if the turtle module is shadowed by flailDriver (PYTHONPATH=docRose, as in flail.sh), or turtle otherwise.
+#  The module is only looked up, not imported, so Tk is not loaded just to find that out.
+def autoBackend():
+    m = sys.modules.get("turtle")
+    if m is None:
+       try:
+          from importlib.util import find_spec
+       except ImportError:
+          import turtle as m
+       else:
+          spec = find_spec("turtle")
+          origin = spec.origin if spec is not None else None
+          return "flail" if origin and os.path.basename(os.path.realpath(origin)) == "flailDriver.py" else "turtle"
+    return "flail" if hasattr(m, "FlailDriver") else "turtle"
+
+## A turtle that ignores every command.
+#  The curves are generated as with the flail driver, but nothing is written, e.g. for timing.
+class NullDriver:
+    def __init__(self, shape=None, visible=False):
+        pass
+
+    def reset(self):
+        pass
+
+    def setformat(self, name):
+        pass
+
+    def setworldcoordinates(self,x0,y0,x1,y1):
+        pass
+
+## Load the backend the commands are sent to.
+#  Only the modules of the chosen backend are imported:
+#  - turtle: draw on screen, with python turtle (Tk).
+#  - flail: write FLAIL commands, positions and QGC waypoints, with the flail driver.
+#  - gps: write only positions and QGC waypoints, with the flail driver (the commands are discarded, and the symmetry is not looked for).
+#  - null: generate the commands and discard them (see NullDriver).
+#  - auto: flail or turtle (see autoBackend).
+#
+#  @param name backend name. The default is backend.
+#
+def loadBackend(name=None):
+    global backend, graphics, Turtle, usingFlail, symmetry
+
+    name = name or backend
+    if name == "auto":
+       name = autoBackend()
+    if name == "turtle":
+       import turtle as graphics
+       Turtle = graphics.Turtle
+    elif name == "flail":
+       graphics = flailDriverModule()
+       Turtle = graphics.FlailDriver
+    elif name == "gps":
+       graphics = flailDriverModule()
+       Turtle = lambda **kw: graphics.FlailDriver(flailFile=os.devnull, **kw)
+       # the commands are discarded, so there is nothing to gain from Repeat blocks.
+       symmetry = False
+    elif name == "null":
+       graphics = None
+       Turtle = NullDriver
+    else:
+       raise ValueError("Invalid backend: %s" % name)
+    backend = name
+    usingFlail = name != "turtle"
+    bam.usingFlail = usingFlail
+    print( "backend = %s, usingFlail = %r" % (backend, usingFlail) )
+
+## Return the jobs of a batch: one for each curve and scale, and one for each point list file.
+#
+#  @param curves curve numbers.
+#  @param scales scale factors.
+#  @param files point list files, for curve 25.
+#  @param out output directory: each job writes to a subdirectory of its own.
+#  @param options dictionary with the settings of every job: NS, qformat, tolerance, staircase, optimizeTurns, symmetry, period, closedLoop, tuned, cacheDir and bytecode.
+#  @return a list of jobs (c, scale, point list file, job directory, options).
+#
+def batchJobs(curves, scales, files, out, options):
+    jobs = []
+    for c in curves:
+        if curveList[c][3] == "Point List Based":
+           for f in files:
+               name = "%02d_%s" % (c, os.path.splitext(os.path.basename(f))[0])
+               jobs.append((c, scales[0], f, os.path.join(out, name), options))
+        else:
+           for r in scales:
+               jobs.append((c, r, None, os.path.join(out, "%02d_s%g" % (c, r)), options))
+    return jobs
+
+## Generate a curve of a batch, in a context of its own, writing everything to the job directory:
+#  - output.flail: FLAIL commands.
+#  - gps.txt: QGC waypoints.
+#  - gps.flail: positions visited.
+#  - turtle.txt: curve points.
+#  - log.txt: messages.
+#  - output.bin and byteArray.txt: FLAIL bytecode, if the bytecode option is set.
+#
+#  The commands are validated (see validator.validate): the diagnostics go to the log,
+#  and a job whose commands have errors fails. So does a job whose point list cannot be read, or is empty.
+#
+#  The driver writes to memory, and each file is written at once at the end,
+#  so no file is left open, or half written, by a job that fails.
+#
+#  @param job a tuple returned by batchJobs.
+#  @return a tuple (job directory, number of FLAIL lines, elapsed time), or (job directory, error message, elapsed time).
+#
+def batchJob(job):
+    c, r, plist, out, options = job
+    start = time.time()
+    if not os.path.isdir(out):
+       os.makedirs(out)
+    import validator
+    if options["cacheDir"] is not None or "curvecache" in sys.modules:
+       import curvecache
+       curvecache.cacheDir = options["cacheDir"]
+    stdout = sys.stdout
+    try:
+       with open(os.path.join(out, "log.txt"), "w") as log, flailDriverClass().inMemory(bytecode=options["bytecode"]) as joe:
+          sys.stdout = log
+          ctx = CurveContext(joe=joe, radius=r, num_sides=options["NS"], usingFlail=True, staircase=options["staircase"],
+                             qformat=options["qformat"], tolerance=options["tolerance"], debug=False,
+                             tname=os.path.join(out, TNAME), optimizeTurns=options["optimizeTurns"],
+                             symmetry=options["symmetry"], period=options["period"],
+                             closedLoop=options["closedLoop"], tuned=options["tuned"])
+          if not drawCurve(c, plist, options["NS"], ctx):
+             return out, "nothing drawn, see log.txt", time.time() - start
+          files = joe.contents()
+          diagnostics = validator.validate(files["output.flail"])
+          for d in diagnostics:
+              print(validator.formatDiagnostic(d, "output.flail"))
+    except Exception as e:
+       return out, "%s: %s" % (type(e).__name__, e), time.time() - start
+    finally:
+       sys.stdout = stdout
+    for name, text in files.items():
+        with open(os.path.join(out, name), "w") as f:
+           f.write(text)
+    if joe.code is not None:
+       joe.code.save(os.path.join(out, "output.bin"), os.path.join(out, "byteArray.txt"))
+    if validator.errors(diagnostics):
+       return out, "%d FLAIL errors, see log.txt" % len(validator.errors(diagnostics)), time.time() - start
+    return out, files["output.flail"].count("\n"), time.time() - start
+
+## Run a batch of jobs, in a pool of processes.
+#
+#  @param jobs list of jobs (see batchJobs).
+#  @param nproc number of processes. With a single process, the jobs run in this one.
+#  @return the number of jobs that failed.
+#
+def runBatch(jobs, nproc=1):
+    start = time.time()
+    pool = None
+    if nproc > 1:
+       import multiprocessing
+       # load numpy once, for all the processes
+       numpy.ndarray
+       pool = multiprocessing.Pool(nproc)
+       results = pool.imap_unordered(batchJob, jobs)
+    else:
+       results = map(batchJob, jobs)
+    failed = 0
+    for out, n, t in results:
+        if isinstance(n, int):
+           print("%s: %d lines, %.2f s" % (out, n, t))
+        else:
+           print("%s: FAILED (%s)" % (out, n))
+           failed += 1
+    if pool is not None:
+       pool.close()
+       pool.join()
+    print("%d jobs, %d failed, %.2f s" % (len(jobs), failed, time.time() - start))
+    return failed
 
 ## Initialize some polar global variables. 
 def setup(startx=0, starty=0):
     global num_sides, radius, joe
 
+    if Turtle is None:
+       loadBackend()
+    if bytecode and hasattr(graphics, "FlailDriver"):
+       graphics.FlailDriver.byteFile = "../files/output.bin"
+       graphics.FlailDriver.byteArrayFile = "../files/byteArray.txt"
+
     # Since the overflow is expected, the warning can be shut with:
-    numpy.warnings.simplefilter("ignore", RuntimeWarning)
+    warnings.simplefilter("ignore", RuntimeWarning)
 
-    turtle.title("Polar Rose")
+    if graphics is not None:
+       graphics.title("Polar Rose")
 
-    # Screen object.
-    #screen = turtle.Screen()
-    #print(screen.screensize())
-    # set canvas dimensions.
-    #screen.screensize(canvwidth=WIDTH, canvheight=HEIGHT, bg=None)
-    #print(screen.screensize())
+       # Screen object.
+       #screen = turtle.Screen()
+       #print(screen.screensize())
+       # set canvas dimensions.
+       #screen.screensize(canvwidth=WIDTH, canvheight=HEIGHT, bg=None)
+       #print(screen.screensize())
 
-    # Set the size and position of the main window.
-    turtle.setup (WIDTH, HEIGHT, startx, starty)
+       # Set the size and position of the main window.
+       graphics.setup (WIDTH, HEIGHT, startx, starty)
 
-    print ("Window width = %d " % turtle.window_width())
-    print ("Window height = %d " % turtle.window_height())
+       print ("Window width = %d " % graphics.window_width())
+       print ("Window height = %d " % graphics.window_height())
 
-    # set background color.
-    turtle.bgcolor(1.0, 250/255.0, 205/255.0)
+       # set background color.
+       graphics.bgcolor(1.0, 250/255.0, 205/255.0)
 
-    # Speed: 1 - 10
-    turtle.speed("fast")
+       # Speed: 1 - 10
+       graphics.speed("fast")
 
     ## Turtle graphics object.
     joe = Turtle(shape="turtle", visible=False)
@@ -867,9 +2055,32 @@ def setup(startx=0, starty=0):
 #
 #  @param argv list of arguments.
 #  - polar.py -s 80 -n 120 -f plistfiles/TriangleMeasured1Cleaned.txt
+#  - python -m polar, with the same arguments, starts faster, as its compiled code is kept.
 #  - n number of segments to draw a curve.
 #  - s scale factor to be applied on all curves.
-#  - f point list file. <br> <br>
+#  - f point list file.
+#  - p profile the quantization errors of each curve, instead of drawing it.
+#  - q fixed-point format for lengths: bam (default), auto or the number of bits after the binary point.
+#  - c directory for caching the generated commands (see curvecache).
+#  - cachesize maximum size of the cache, in MB.
+#  - t tolerance: sample the curves adaptively, so no segment deviates from the curve more than this (see adaptiveAngles).
+#  - b batch: generate, without any interaction, the given curves (e.g. 0-25 or 1,5,9-11), for every scale and point list file.
+#  - scales comma separated list of scale factors for the batch (the default is the scale).
+#  - j number of processes running the batch in parallel.
+#  - o batch output directory: each curve, scale or point list file goes to a subdirectory of its own.
+#  - backend where the commands go: auto (default), turtle, flail, gps or null (see loadBackend).
+#    Only the modules of the chosen backend are loaded, so flail, gps and null never load Tk.
+#  - optimize merge the commands of each curve, folding turns up to this number of BAM, and compress them with Repeat (see optimize).
+#  - tune find, for each curve of the batch (or every curve), the smallest number of segments whose path stays within this maximum deviation,
+#    and store it in the tuned file (see tuneCurve). Unless n is given, the curves are then drawn with their tuned number of segments.
+#  - tuned file of tuned numbers of segments (the default is tuned.json).
+#  - closedloop quantize the turns and lengths in closed loop, so the errors do not build up along the path (see closedLoopSegments).
+#  - nosymmetry emit every segment of the curves with a rotational symmetry, instead of a period inside a Repeat block.
+#  - period what to do with an angle range covering the period of a curve more than once:
+#    clip it to a single period (default), only report it, or off (see curvePeriod).
+#  - bytecode the flail driver also writes the FLAIL bytecode: output.bin, with 16-bit operands, and byteArray.txt, with the 8-bit operands of flail.c for the Unity simulation (see flail). <br>
+#  - polar.py --batch 0-25 --scales 40,80,160 -j 8 --out missions -f plistfiles/TriangleMeasured1Cleaned.txt <br>
+#  - polar.py --backend flail -s 80 -n 120 <br> <br>
 #
 #  <br>
 #  \htmlonly <style>div.image img[src="Majestic.png"]{width:300px;}</style> \endhtmlonly 
@@ -900,16 +2111,31 @@ def setup(startx=0, starty=0):
 #  \endhtmlonly
 #
 def main(argv = None):
-    global num_sides, radius, __toDebug__
+    global num_sides, radius, __toDebug__, qformat, tolerance, bytecode, optimizeTurns, symmetry, period, closedLoop, tuned
 
     if argv is None:
        argv = sys.argv
 
     toRead = "turtle.txt"
-
+    profiling = False
+    batch = None
+    files = []
+    scales = None
+    nproc = 1
+    out = "batch"
+    tune = None
+    tunedFile = TUNED
+    usage = ("Usage: -h or --help -s or --scale float_value, -n or --npoints int_value, -f or --file str_value, -d or --debug, -p or --profile, "
+             "-q or --qformat bam|auto|int_value, -c or --cache str_value, --cachesize int_value (MB), -t or --tolerance float_value, "
+             "-b or --batch curve_ranges, --scales float_list, -j or --jobs int_value, -o or --out str_value, "
+             "--backend auto|turtle|flail|gps|null, --bytecode, --optimize int_value (BAM), --closedloop, --nosymmetry, --period clip|report|off, --tune float_value, --tuned str_value.")
+
+    import getopt
     try:
         try:
-            opts, args = getopt.getopt(argv[1:], "hs:n:f:d", ["help", "scale", "npoints", "file", "debug"])
+            opts, args = getopt.getopt(argv[1:], "hs:n:f:dpq:c:t:b:j:o:", ["help", "scale", "npoints", "file", "debug", "profile", "qformat=", "cache=", "cachesize=", "tolerance=",
+                                                                            "batch=", "scales=", "jobs=", "out=", "backend=", "bytecode", "optimize=", "closedloop", "nosymmetry", "period=",
+                                                                            "tune=", "tuned="])
         except getopt.GetoptError as msg:
            print ("Invalid Arguments")
            raise msg
@@ -919,7 +2145,7 @@ def main(argv = None):
         # [('-h', ''), ('--help', ''), ('-s', 90)] ['1', '2']
         for o,a in opts:  # something such as [('-h', '')] or [('--help', '')]
             if o in ( "-h", "--help" ):
-               print ("Usage: -h or --help -s or --scale float_value, -n or --npoints int_value, -f or --file str_value, -d or --debug.")
+               print (usage)
                help()
                return 1
             elif o in ( "-n", "--npoints" ):
@@ -928,20 +2154,83 @@ def main(argv = None):
                radius = float(a)
             elif o in ( "-f", "--file" ):
                toRead = a
+               files.append(a)
                print ("PointList file: %s" % a)
             elif o in ( "-d", "--debug" ):
                __toDebug__ = True
                bam.__toDebug__ = True
                print("Debugging is ON.")
+            elif o in ( "-p", "--profile" ):
+               profiling = True
+               print("Profiling quantization errors.")
+            elif o in ( "-q", "--qformat" ):
+               qformat = a if a in ("auto", "bam") else int(a)
+            elif o in ( "-c", "--cache" ):
+               import curvecache
+               curvecache.cacheDir = a
+               print ("Cache directory: %s" % a)
+            elif o == "--cachesize":
+               import curvecache
+               curvecache.cacheLimit = int(a) << 20
+            elif o in ( "-t", "--tolerance" ):
+               tolerance = float(a)
+            elif o in ( "-b", "--batch" ):
+               batch = [clampCurve(c) for c in parseRange(a)]
+            elif o == "--scales":
+               scales = [float(r) for r in a.split(",")]
+            elif o in ( "-j", "--jobs" ):
+               nproc = int(a)
+            elif o in ( "-o", "--out" ):
+               out = a
+            elif o == "--backend":
+               loadBackend(a)
+            elif o == "--bytecode":
+               bytecode = True
+            elif o == "--optimize":
+               optimizeTurns = int(a)
+            elif o == "--tune":
+               tune = float(a)
+            elif o == "--tuned":
+               tunedFile = a
+            elif o == "--closedloop":
+               closedLoop = True
+            elif o == "--nosymmetry":
+               symmetry = False
+            elif o == "--period":
+               if a not in ("clip", "report", "off"):
+                  raise ValueError("invalid period option: %s" % a)
+               period = a
             else:
                assert False, "unhandled option"
         if len(args) < 2:                                                   
-            print ("Usage: -h or --help -s or --scale float_value, -n or --npoints int_value, -f or --file str_value, -d or --debug.")
+            print (usage)
     # will be caught by the outer "try"                  
     except Exception as err:
         print (str(err) + "\nFor help, type: %s --help" % argv[0])
         return 2
 
+    if tune is not None:
+       if radius is None:
+          radius = LW / 8.5
+       if num_sides is None:
+          num_sides = 120
+       # the counts depend on the backend: codes and heights for the flail driver, floats in 2D for a turtle.
+       if Turtle is None:
+          loadBackend()
+       return 1 if tuneCurves(batch or range(ncurves()), tune, tunedFile) else 0
+
+    if num_sides is None:
+       tuned = loadTuned(tunedFile)
+       if tuned is not None:
+          print ("Tuned numbers of segments: %s" % tunedFile)
+
+    if batch is not None:
+       options = {"NS": num_sides or 120, "qformat": qformat, "tolerance": tolerance,
+                  "staircase": staircase, "optimizeTurns": optimizeTurns, "symmetry": symmetry, "period": period,
+                  "closedLoop": closedLoop, "tuned": tuned, "cacheDir": getattr(sys.modules.get("curvecache"), "cacheDir", None), "bytecode": bytecode}
+       jobs = batchJobs(batch, scales or [radius or LW / 8.5], files or [toRead], out, options)
+       return 1 if runBatch(jobs, nproc) else 0
+
     setup()
 
     NS = num_sides
@@ -951,7 +2240,10 @@ def main(argv = None):
         try:
             c = int(input("Curve Number: "))
             print(help(c))
-        except (ValueError,SyntaxError,KeyboardInterrupt):
+        except (ValueError,SyntaxError,KeyboardInterrupt,EOFError):
+            # the flail driver saves its files on close
+            if hasattr(joe, "close"):
+               joe.close()
             sys.exit()
 
         if c < 0:
@@ -959,10 +2251,16 @@ def main(argv = None):
            if c == -2:
               __toDebug__ = not __toDebug__
               bam.__toDebug__ = __toDebug__
+        elif profiling:
+           printProfile(profileCurve(clampCurve(c),toRead,NS))
         else:
-           drawCurve(clampCurve(c),toRead,NS)
+           try:
+              drawCurve(clampCurve(c),toRead,NS)
+           except ValueError as e:
+              print(e)
 
-    turtle.done()
+    if graphics is not None:
+       graphics.done()
 
 
 if __name__=="__main__":
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# coding: UTF-8
+#
+## @package replay
+#
+#  Replay of FLAIL missions: the trajectory a drone flies, from the FLAIL text.
+#
+#  The text is parsed with a single regular expression, the Repeat blocks are expanded,
+#  and then the whole trajectory is computed at once, on numpy arrays:
+#  - the heading after each command is the cumulative sum of the turns (RollLeft and RollRight), wrapped to 16 bits;
+#  - the position after each command is the cumulative sum of the displacements of the moves.
+#
+#  The lengths are decoded with the fixed-point format of the mission header (see bam.parseFormat),
+#  and the displacements are computed as FlailDriver does, with integer arithmetic (see bam.bamStepArray),
+#  so the replayed positions are exactly the ones the driver tracked.
+#  - RollLeft and RollRight turn, by a BAM angle.
+#  - Forward and Backward move along the heading; Left and Right move sideways; Ascend and Descend move up and down.
+#  - Wait, WaitMili and SetMode do not move. The trajectory is only meaningful in distance mode.
+#
+import sys, re
+import bam
+numpy = bam.lazyImport("numpy")
+from flail import OPCODES
+
+## Statements of a FLAIL text: the format header, a comment, the start or the end of a Repeat block,
+#  or an instruction with its parameter.
+STATEMENT = re.compile(r"#\s*QFormat\(([^)\s]*)\)[^\n]*|#[^\n]*|Repeat\s+(-?\d+)\s*\{|(\})|(\w+)\s*\(\s*([^()\s;]*)\s*\)")
+
+## Turns: the sign of the heading change of each opcode.
+TURNS = {OPCODES["RollLeft"]: 1, OPCODES["RollRight"]: -1}
+
+## Planar moves: the direction of each opcode, relative to the heading (UBAM), and the sign of its length.
+PLANAR = {OPCODES["Forward"]: (0, 1), OPCODES["Backward"]: (0, -1), OPCODES["Left"]: (0x4000, 1), OPCODES["Right"]: (0xC000, 1)}
+
+## Vertical moves: the sign of the height change of each opcode.
+VERTICAL = {OPCODES["Ascend"]: 1, OPCODES["Descend"]: -1}
+
+## Parse a FLAIL text.
+#
+#  @param text FLAIL text.
+#  @return a tuple (op, code, fmt, formats): numpy arrays with the opcode, the integer parameter
+#  and the format index of each command, with the Repeat blocks expanded, and the list of formats (nbits, useBAM).
+#  Format 0 is the current bam format, used before the first header.
+#  @throw ValueError if a Repeat block is not closed, or has a negative count.
+#
+def parse(text):
+    formats = [bam.getFormat()]
+    op, code, fmt = [], [], []
+    blocks = []
+    cur = 0
+    for qformat, n, close, name, param in STATEMENT.findall(text):
+        if name:
+           o = OPCODES.get(name)
+           if o is not None:
+              op.append(o)
+              code.append(int(float(param)) if name != "SetMode" else 2 * (param == "distance") + (param == "intensity"))
+              fmt.append(cur)
+        elif qformat:
+           formats.append(bam.parseFormat(qformat))
+           cur = len(formats) - 1
+        elif n:
+           if int(n) < 0:
+              raise ValueError("negative number of repetitions: %s" % n)
+           blocks.append((len(op), int(n)))
+        elif close:
+           if not blocks:
+              raise ValueError("'}' without Repeat")
+           start, k = blocks.pop()
+           for l in (op, code, fmt):
+               l[start:] = l[start:] * k
+    if blocks:
+       raise ValueError("unclosed Repeat block")
+    return (numpy.array(op, dtype=numpy.int8), numpy.array(code, dtype=numpy.int64),
+            numpy.array(fmt, dtype=numpy.int32), formats)
+
+## Compute the trajectory of parsed commands, all at once.
+#
+#  @param op opcodes, as returned by parse.
+#  @param code parameters.
+#  @param fmt format index of each command.
+#  @param formats list of formats.
+#  @return a dictionary with numpy arrays (n is the number of commands):
+#  - op, code: the commands.
+#  - heading: UBAM heading before the first command and after each one (n+1).
+#  - position: integer position in Q(bam.POS_QBITS) format, before the first command and after each one (n+1, 3).
+#  - points: the positions as floats (n+1, 3).
+#  - moves: whether each command changes the position (n).
+#
+def trajectory(op, code, fmt, formats):
+    dh = numpy.zeros(len(op), dtype=numpy.int64)
+    for o, sign in TURNS.items():
+        dh[op == o] = sign * code[op == o]
+    heading = numpy.concatenate(([0], numpy.cumsum(dh))) & 0xFFFF
+
+    length = numpy.zeros(len(op), dtype=numpy.int64)
+    for i, f in enumerate(formats):
+        sel = fmt == i
+        if sel.any():
+           length[sel] = bam.toPositionArray(code[sel], f)
+
+    disp = numpy.zeros((len(op), 3), dtype=numpy.int64)
+    for o, (rel, sign) in PLANAR.items():
+        sel = op == o
+        if sel.any():
+           dx, dy = bam.bamStepArray(sign * length[sel], heading[:-1][sel] + rel)
+           disp[sel, 0] = dx
+           disp[sel, 1] = dy
+    for o, sign in VERTICAL.items():
+        sel = op == o
+        disp[sel, 2] = sign * length[sel]
+
+    position = numpy.zeros((len(op)+1, 3), dtype=numpy.int64)
+    numpy.cumsum(disp, axis=0, out=position[1:])
+    moves = disp.any(axis=1)
+    return {"op": op, "code": code, "heading": heading, "position": position,
+            "points": numpy.ldexp(position.astype(numpy.float64), -bam.POS_QBITS), "moves": moves}
+
+## Replay a FLAIL text.
+#  @see parse, trajectory
+replay = lambda text: trajectory(*parse(text))
+
+## Replay a FLAIL file.
+def replayFile(fname):
+    with open(fname) as f:
+       return replay(f.read())
+
+## Return the waypoints of a trajectory: the start, and the position after each Forward or Backward,
+#  as FlailDriver writes them to gps.flail (but with their height).
+def waypoints(traj):
+    op = traj["op"]
+    sel = numpy.concatenate(([True], (op == OPCODES["Forward"]) | (op == OPCODES["Backward"])))
+    return traj["points"][sel]
+
+## Return the distance from each point of a point list to the trajectory.
+#
+#  The point list is first moved so its last point is on the last position of the trajectory
+#  (the mission of a curve ends where the curve ends, but it starts from wherever the drone is),
+#  then the distance from each point to the nearest position of the trajectory is computed.
+#  The comparison is done in chunks, so it takes memory proportional to the number of positions.
+#
+#  @param traj trajectory of a mission with a single curve (see replay).
+#  @param pts point list, one 2D or 3D point per row (see polar.initPointList).
+#  @param scale factor applied to the points (the curve scale), before the comparison.
+#  @return a numpy array with a distance for each point.
+#
+def pointErrors(traj, pts, scale=1.0):
+    pts = numpy.asarray(pts, dtype=numpy.float64) * scale
+    if pts.shape[1] == 2:
+       pts = numpy.column_stack((pts, numpy.zeros(len(pts))))
+    q = traj["points"]
+    pts = pts - pts[-1] + q[-1]
+    err = numpy.empty(len(pts))
+    step = max(1, (1 << 22) // len(q))
+    for i in range(0, len(pts), step):
+        d = pts[i:i+step, None, :] - q[None, :, :]
+        err[i:i+step] = numpy.sqrt((d*d).sum(axis=2).min(axis=1))
+    return err
+
+def main():
+    if len(sys.argv) < 2:
+       print("Usage: replay.py file.flail [point_list_file [scale]]")
+       return 1
+    traj = replayFile(sys.argv[1])
+    p = traj["points"]
+    print("%d commands, %d moves" % (len(traj["op"]), numpy.count_nonzero(traj["moves"])))
+    print("Final position: %s, heading: %f" % (p[-1], bam.BAM2float(traj["heading"][-1])))
+    print("Bounding box: %s - %s" % (p.min(axis=0), p.max(axis=0)))
+    if len(sys.argv) > 2:
+       import polar
+       ctx = polar.CurveContext()
+       polar.initPointList(sys.argv[2], ctx)
+       err = pointErrors(traj, ctx.pointList, float(sys.argv[3]) if len(sys.argv) > 3 else 1.0)
+       print("Point list error: max = %f, mean = %f" % (err.max(), err.mean()))
+    return 0
+
+if __name__=="__main__":
+   sys.exit(main())
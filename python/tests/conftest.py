@@ -0,0 +1,27 @@
+# coding: UTF-8
+#
+## Make the modules of python and python/docRose importable by the tests, wherever pytest is run from.
+#  docRose goes last, so its turtle.py does not hide the turtle module of the standard library.
+#
+import os, sys
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.append(os.path.join(os.path.dirname(here), "docRose"))
+
+## Draw a curve with a driver, in a context of its own, as a batch job does.
+#  draw(joe, c, toRead, **settings) returns what drawCurve printed; toRead is the point list file name,
+#  and the settings are the ones of polar.CurveContext.
+@pytest.fixture
+def draw(tmp_path, capsys):
+    import polar
+    def draw(joe, c=7, toRead=None, **kw):
+        kw.setdefault("radius", 80.0)
+        kw.setdefault("num_sides", 120)
+        kw.setdefault("debug", False)
+        ctx = polar.CurveContext(joe=joe, usingFlail=True, tname=str(tmp_path / "turtle.txt"), **kw)
+        capsys.readouterr()
+        assert polar.drawCurve(c, toRead, ctx.num_sides, ctx)
+        return capsys.readouterr().out
+    return draw
@@ -0,0 +1,47 @@
+# coding: UTF-8
+#
+## Tests of the closed-loop quantization: the drone never strays from the curve
+#  more than the error of a single segment, however long the path.
+#
+import re
+import numpy
+import pytest
+import polar, replay
+from flailDriver import FlailDriver
+
+## Return the closure error and the maximum deviation drawCurve printed.
+deviation = lambda out: tuple(map(float, re.search(r"Closure error: (\S+), maximum deviation: (\S+)", out).groups()))
+
+@pytest.mark.parametrize("c", range(25))
+def test_deviation_bounded(draw, c):
+    closure, dev = deviation(draw(FlailDriver.inMemory(), c, closedLoop=True, symmetry=False))
+    assert closure <= dev <= 0.05
+    # quantized in open loop, the errors build up
+    if c in (0, 7, 19, 23):
+       assert deviation(draw(FlailDriver.inMemory(), c, symmetry=False))[0] > 50 * closure
+
+# curves starting at the origin: the move to the start of a curve is not quantized (see moveCommands)
+@pytest.mark.parametrize("c", [1, 2, 3, 4, 7])
+def test_replayed_end(draw, c):
+    joe = FlailDriver.inMemory()
+    draw(joe, c, closedLoop=True)
+    traj = replay.replay(joe.contents()["output.flail"])
+    ctx = polar.CurveContext(radius=80.0, num_sides=120)
+    func, turns, initialAng = polar.curveList[c][:3]
+    pts = polar.evalCurve(func, turns, initialAng, 120 * max(1, int(turns / (2*numpy.pi))), ctx)[0]
+    assert numpy.abs(pts[0]).max() < 1e-9
+    end = pts[numpy.isfinite(pts).all(axis=1)][-1]
+    assert numpy.hypot(*(traj["points"][-1][:2] - end)) <= 0.05
+
+@pytest.mark.parametrize("staircase", [False, True])
+def test_driver_positions(draw, tmp_path, staircase):
+    # a 3D point list: the closed loop tracks the position of the driver, in its own integer arithmetic
+    t = numpy.linspace(0, 3 * numpy.pi, 41)
+    fname = str(tmp_path / "spiral.txt")
+    numpy.savetxt(fname, numpy.column_stack((t * 9 * numpy.cos(t), t * 9 * numpy.sin(t), 40 * numpy.sin(t))), delimiter=",")
+    joe = FlailDriver.inMemory()
+    closure, dev = deviation(draw(joe, 25, fname, closedLoop=True, staircase=staircase))
+    assert dev <= 0.05
+    end = numpy.loadtxt(fname, delimiter=",")[-1]
+    s = joe.state
+    numpy.testing.assert_allclose(numpy.ldexp([s.x, s.y, s.z], -polar.POS_QBITS), end, rtol=0, atol=0.05)
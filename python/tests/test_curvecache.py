@@ -0,0 +1,62 @@
+# coding: UTF-8
+#
+## Tests of curvecache, and of the curves polar takes from it.
+#
+import io, os
+import pytest
+import curvecache
+from flailDriver import FlailDriver
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(curvecache, "cacheDir", str(tmp_path / "cache"))
+    return curvecache
+
+def test_discarded_commands_not_reused(draw, cache):
+    # the gps backend discards the commands: its entry must not be taken for a flail one
+    with FlailDriver(flailFile=os.devnull, pointFile=io.StringIO(), gpsFile=io.StringIO()) as gps:
+       draw(gps, symmetry=False)
+    joe = FlailDriver.inMemory()
+    assert "cached" not in draw(joe, symmetry=False)
+    text = joe.contents()["output.flail"]
+    assert "Forward" in text
+    joe = FlailDriver.inMemory()
+    assert "cached" in draw(joe, symmetry=False)
+    assert joe.contents()["output.flail"] == text
+
+def test_store_lookup(cache):
+    key = cache.cacheKey("curve", 7, 80.0)
+    assert cache.lookup(key) is None
+    cache.store(key, {"output.flail": "Forward(3);\n", "gps.txt": ""}, {"state": [1, 2.5]})
+    files, meta = cache.lookup(key)
+    assert files == {"output.flail": "Forward(3);\n", "gps.txt": ""}
+    assert meta["state"] == [1, 2.5]
+    assert cache.lookup(cache.cacheKey("curve", 7, 80.5)) is None
+
+def test_evict_least_recently_used(cache, monkeypatch):
+    keys = [cache.cacheKey(i) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.store(key, {"a.txt": "x" * 1000})
+        os.utime(cache.entryPath(key), (1000 + i, 1000 + i))
+    # the oldest entry is used again: the next one is now the least recently used
+    assert cache.lookup(keys[0]) is not None
+    size = cache.dirSize(cache.entryPath(keys[0]))
+    assert cache.evict(2 * size) == 1
+    assert cache.lookup(keys[1]) is None
+    assert cache.lookup(keys[0]) is not None and cache.lookup(keys[2]) is not None
+    # storing beyond the size limit evicts as well
+    monkeypatch.setattr(cache, "cacheLimit", size)
+    cache.store(cache.cacheKey(3), {"a.txt": "x" * 1000})
+    assert sorted(os.listdir(cache.cacheDir)) == [cache.cacheKey(3)]
+
+def test_hit_replays_the_files(draw, cache):
+    joe = FlailDriver.inMemory()
+    assert "cached" not in draw(joe, 3)
+    files, state = joe.contents(), (joe.state.x, joe.state.y, joe.state.heading, joe.wptOrder)
+    joe = FlailDriver.inMemory()
+    assert "cached" in draw(joe, 3)
+    assert joe.contents() == files
+    assert (joe.state.x, joe.state.y, joe.state.heading, joe.wptOrder) == state
+    # any other setting is another entry
+    assert "cached" not in draw(FlailDriver.inMemory(), 3, radius=81.0)
+    assert "cached" not in draw(FlailDriver.inMemory(), 3, num_sides=100)
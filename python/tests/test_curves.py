@@ -0,0 +1,42 @@
+# coding: UTF-8
+#
+## Tests of the curves evaluated on whole arrays of angles: the points and colors of polar.evalCurve,
+#  and the debugging output of the commands generated from them.
+#
+import numpy
+import pytest
+import polar
+from flailDriver import FlailDriver
+
+## Return the angles evalCurve samples for the c-th curve.
+def angles(c, nseg=120):
+    func, turns, initialAng = polar.curveList[c][:3]
+    return numpy.cumsum(numpy.concatenate(([initialAng], numpy.full(nseg, turns / nseg))))
+
+@pytest.mark.parametrize("c", range(25))
+def test_arrays_match_scalars(c):
+    func = polar.curveList[c][0]
+    t = angles(c)
+    r, a = func(80.0, t)
+    for i in range(len(t)):
+        ri, ai = func(80.0, float(t[i]))
+        numpy.testing.assert_allclose([ri, ai], [r[i], a[i]], rtol=1e-12, atol=1e-12)
+
+def test_lemniscate_colors():
+    # the Lemniscate only sets a color where it is defined, starting blue
+    t = angles(6)
+    sign = polar.colorSign(polar.f6, t)
+    valid = polar.lemniscateArms(t)
+    assert sign[0] == 1 and not valid[0]
+    for i in range(1, len(t)):
+        assert sign[i] == ((-1 if t[i] < 0 else 1) if valid[i] else sign[i-1])
+
+@pytest.mark.parametrize("c", [7, 13])
+@pytest.mark.parametrize("closedLoop", [False, True])
+def test_debug_output(draw, c, closedLoop):
+    # how the heading, each turn and each length are coded, point by point
+    joe = FlailDriver.inMemory()
+    out = draw(joe, c, debug=True, symmetry=False, closedLoop=closedLoop)
+    # one per segment: the heading and the turns of the 119 others
+    assert out.count("angle = UBAM = ") == out.count("length = ") == out.count("Forw disp: ") == 120
+    assert "angle = UBAM" not in draw(FlailDriver.inMemory(), c, symmetry=False, closedLoop=closedLoop)
@@ -0,0 +1,131 @@
+# coding: UTF-8
+#
+## Tests of flail: the bytecode of BytecodeWriter and assemble,
+#  and the incremental compilation of edited scripts, which must give the bytecode of the whole script.
+#
+import os, re, random
+import pytest
+from flail import IncrementalCompiler, BytecodeWriter, assemble, byteCode, byteArrayText, REPEAT_NEXT
+from bam import unpackWords
+
+## Return a random line of a script: an instruction, a mode change, a comment, or the start or end of a Repeat block.
+def randomLine(rng):
+    k = rng.random()
+    if k < 0.1:
+       return "Repeat %d {" % rng.randint(1, 4)
+    if k < 0.2:
+       return "}"
+    if k < 0.27:
+       return "SetMode(%s);" % rng.choice(("distance", "intensity"))
+    if k < 0.3:
+       return "# comment"
+    name = rng.choice(("Forward", "Backward", "RollLeft", "RollRight", "Ascend", "Wait"))
+    return "%s(%s);" % (name, rng.choice(("0", "1", "3", "0.5", "250", "70000")))
+
+## Return the bytecode of a script compiled at once, or None if it does not compile.
+def wholeWords(lines):
+    try:
+       return assemble("\n".join(lines)).words().tolist()
+    except ValueError:
+       return None
+
+@pytest.mark.parametrize("seed", range(20))
+def test_edits(seed):
+    rng = random.Random(seed)
+    compiler = IncrementalCompiler()
+    lines = ["SetMode(distance);"] + ["Forward(%d);" % i for i in range(1, 30)]
+    assert compiler.compile("\n".join(lines)).tolist() == wholeWords(lines)
+    compiled = 0
+    for i in range(150):
+        first = rng.randint(0, len(lines))
+        last = min(len(lines), first + rng.randint(0, 4))
+        new = [randomLine(rng) for k in range(rng.randint(0, 4))]
+        edited = lines[:first] + new + lines[last:]
+        expected = wholeWords(edited)
+        if expected is None:
+           with pytest.raises(ValueError):
+              compiler.edit(first, last, new)
+           assert compiler.lines == lines
+        else:
+           assert compiler.edit(first, last, new).tolist() == expected
+           assert compiler.lines == edited
+           lines = edited
+           compiled += 1
+    assert compiled > 20
+
+@pytest.mark.parametrize("seed", range(5))
+def test_compile_diff(seed):
+    rng = random.Random(seed)
+    compiler = IncrementalCompiler()
+    # statements of the script, some of several lines
+    units = ["SetMode(distance);"] + ["RollLeft(%d);" % i for i in range(1, 40)]
+    compiler.compile("\n".join(units))
+    for i in range(50):
+        k = rng.randrange(1, len(units))
+        units[k] = rng.choice(("Forward(%d);", "Repeat 2 {\nAscend(%d);\n}", "SetMode(intensity);\nWait(%d);\nSetMode(distance);")) % rng.randint(1, 9)
+        text = "\n".join(units)
+        assert compiler.compile(text).tolist() == assemble(text).words().tolist()
+
+def test_repeat_unrolled():
+    w = assemble("SetMode(distance);\nRepeat 3 {\nForward(7);\n}\nRepeat 2 {\nForward(150000);\n}\n")
+    assert w.code == [(0xB, 2)] + [(0x2, 7)] * 3 + [(REPEAT_NEXT, 2), (0x2, 0xFFFF), (0x2, 18930)] * 2
+
+def test_invalid_parameters():
+    with pytest.raises(ValueError):
+       assemble("Forward(1.5);")
+    with pytest.raises(ValueError):
+       assemble("Repeat 2 {\nForward(0.5);\n")
+    with pytest.raises(ValueError):
+       BytecodeWriter().repeatFrom(0, 0)
+
+def test_negative_parameters():
+    # moves and turns go the other way, in distance mode
+    w = assemble("SetMode(distance);\nForward(-3);\nRollLeft(-70000);\nAscend(-2);\n")
+    assert w.code == [(0xB, 2), (0x3, 3), (0x7, 0xFFFF), (0x7, 4465), (0x8, 2)]
+    with pytest.raises(ValueError):
+       assemble("SetMode(distance);\nWait(-1);")
+    with pytest.raises(ValueError):
+       assemble("Forward(-0.5);")
+
+## Return the total parameter of each opcode of a byte code (see byteCode), executing repeatNextInstFor.
+def totals(code):
+    sums = {}
+    i = 0
+    while i < len(code):
+        k = 1
+        if code[i] == REPEAT_NEXT:
+           k = code[i+1]
+           i += 2
+        sums[code[i]] = sums.get(code[i], 0) + k * code[i+1]
+        i += 2
+    return sums
+
+def test_byte_code():
+    # the layout of flail.c: operands above 255 are split with repeatNextInstFor
+    w = assemble("SetMode(distance);\nRollLeft(27306);\nForward(10);\nRepeat 2 {\nAscend(600);\n}\nSetMode(intensity);\nForward(0.5);\n")
+    assert list(byteCode(w.code)) == [0xB, 2, REPEAT_NEXT, 107, 0x6, 255, 0x6, 21, 0x2, 10] + \
+                                     [REPEAT_NEXT, 2, 0x1, 255, 0x1, 90] * 2 + [0xB, 1, 0x2, 50]
+
+@pytest.mark.parametrize("seed", range(5))
+def test_byte_code_totals(seed):
+    rng = random.Random(seed)
+    w = BytecodeWriter("distance")
+    for i in range(100):
+        w.emit(rng.choice(("Forward", "Ascend", "RollLeft", "Wait")), rng.choice((rng.randint(1, 300), rng.randint(1, 10**6))))
+    code = byteCode(w.code)
+    assert all(code[i+1] > 0 for i in range(0, len(code), 2))
+    assert totals(code) == totals([x for inst in w.code for x in inst])
+
+def test_saved_files(tmp_path):
+    w = assemble("SetMode(distance);\nRollLeft(27306);\nForward(150000);\n")
+    w.save(str(tmp_path / "output.bin"), str(tmp_path / "byteArray.txt"))
+    with open(str(tmp_path / "output.bin"), "rb") as f:
+       assert list(unpackWords(f.read())) == [x for inst in w.code for x in inst]
+    with open(str(tmp_path / "byteArray.txt")) as f:
+       text = f.read()
+    assert [int(b, 16) for b in text.split(", ")] == list(byteCode(w.code))
+    # the syntax of the byte array of the Unity simulation
+    syntax = re.compile(r"0x[0-9a-f]+(, 0x[0-9a-f]+)*\s*$")
+    with open(os.path.join(os.path.dirname(__file__), "..", "..", "flailSimulation", "byteArray.txt")) as f:
+       assert syntax.match(f.read())
+    assert syntax.match(text)
@@ -0,0 +1,65 @@
+# coding: UTF-8
+#
+## Tests of the length formats: the choice of bam.chooseFormat, and the format polar.selectFormat gives each mission.
+#
+import random
+import numpy
+import pytest
+import bam, polar
+from flailDriver import FlailDriver
+
+## Every 16-bit format chooseFormat considers.
+FORMATS = [(8, True)] + [(n, False) for n in range(17)]
+
+## Return the codes and the maximum error of a set of lengths in a format, or None if they do not fit in 16-bit words.
+def coding(x, fmt):
+    codes = bam.float2FixedArray(x, fmt=fmt)
+    if codes.max() > 0xFFFF or (fmt[1] and numpy.any((x >= 180) & (codes < 0x8000))):
+       return None
+    return numpy.abs(x - bam.toFloatArray(codes, fmt)).max()
+
+@pytest.mark.parametrize("seed", range(8))
+def test_best_format(seed):
+    rng = random.Random(seed)
+    top = rng.choice((0.5, 3, 100, 170, 500, 4000))
+    x = numpy.array([rng.uniform(0, top) for i in range(200)])
+    fmt = bam.chooseFormat(x)
+    best = coding(x, fmt)
+    assert best is not None
+    assert all(coding(x, f) is None or coding(x, f) >= best for f in FORMATS)
+
+def test_small_lengths():
+    assert bam.chooseFormat([0.5, 0.25, 0.3]) == (16, False)
+
+def test_too_long():
+    with pytest.raises(ValueError):
+       bam.chooseFormat([70000.0])
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_format_names(fmt):
+    assert bam.parseFormat(bam.formatName(fmt)) == fmt
+
+def test_default_format_is_bam():
+    assert polar.qformat == "bam"
+    ctx = polar.CurveContext(usingFlail=True, staircase=False)
+    pts = numpy.array([[0.0, 0.0], [1.0, 0.5], [3.0, 0.0]])
+    assert polar.selectFormat(pts, ctx) == (8, True)
+
+def test_auto_rejected_for_flail():
+    ctx = polar.CurveContext(usingFlail=True, staircase=False, qformat="auto")
+    with pytest.raises(ValueError):
+       polar.selectFormat(numpy.array([[0.0, 0.0], [70000.0, 0.0]]), ctx)
+
+def test_auto_small_curve(draw):
+    # a small circle closes better out of BAM
+    joe = FlailDriver.inMemory()
+    draw(joe, 7, radius=2.0, qformat="auto")
+    assert "# QFormat(BAM+Q8)" not in joe.contents()["output.flail"]
+
+def test_long_lengths_are_emitted(draw):
+    # the Hyperbola has lengths over 16 bits in BAM+Q8: they are written whole, as flail.c splits them
+    joe = FlailDriver.inMemory()
+    out = draw(joe, 20)
+    text = joe.contents()["output.flail"]
+    assert "Warning" in out and "(over 16 bits)" in out
+    assert "# QFormat(BAM+Q8)" in text and "Forward(155863);" in text
@@ -0,0 +1,80 @@
+# coding: UTF-8
+#
+## Tests of optimize: the optimized missions, once replayed, fly the path of the original ones.
+#
+import io, math, random
+import numpy
+import pytest
+import replay
+from optimize import peephole, compress, optimize
+from mission import drive, FlailWriter, Forward, Backward, Left, Right, Ascend, Descend, Repeat, SetFormat
+
+## Return a random mission in Q8, with small turns, turns that cancel, and repeated sequences.
+def randomMission(seed, n=300):
+    rng = random.Random(seed)
+    cmds = [SetFormat("Q8")]
+    while len(cmds) < n:
+        k = rng.random()
+        if k < 0.1:
+           cmds.extend([Left(rng.randint(1, 3000)), Forward(rng.randint(256, 4096))] * rng.randint(2, 6))
+        elif k < 0.2:
+           a = rng.randint(1, 0xFFFF)
+           cmds.extend([Left(a), Right(a)])
+        elif k < 0.4:
+           cmds.append(rng.choice((Left, Right))(rng.randint(1, 40)))
+        elif k < 0.5:
+           cmds.append(rng.choice((Left, Right))(rng.randint(1, 0xFFFF)))
+        elif k < 0.6:
+           cmds.append(rng.choice((Ascend, Descend))(rng.randint(1, 512)))
+        else:
+           cmds.append(rng.choice((Forward, Forward, Backward))(rng.randint(256, 4096)))
+    return cmds
+
+## Return the trajectory of a mission, replayed from its FLAIL text (see replay.trajectory).
+def fly(cmds):
+    f = io.StringIO()
+    drive(cmds, FlailWriter(f))
+    return replay.replay(f.getvalue())
+
+## Return the total length of the moves of a trajectory.
+pathLength = lambda traj: numpy.sqrt((numpy.diff(traj["points"], axis=0)**2).sum(axis=1)).sum()
+
+@pytest.mark.parametrize("seed", range(6))
+def test_compress_is_exact(seed):
+    cmds = randomMission(seed)
+    packed = list(compress(cmds))
+    assert any(type(c) is Repeat for c in packed)
+    a, b = fly(cmds), fly(packed)
+    assert b["op"].tolist() == a["op"].tolist() and b["code"].tolist() == a["code"].tolist()
+    assert (b["position"] == a["position"]).all()
+
+@pytest.mark.parametrize("seed", range(6))
+def test_peephole_keeps_waypoints(seed):
+    cmds = randomMission(seed)
+    merged = list(peephole(cmds, fmt=(8, False)))
+    assert len(merged) < len(cmds)
+    a, b = fly(cmds), fly(merged)
+    assert b["heading"][-1] == a["heading"][-1]
+    # merged moves are rounded once instead of twice: a few position units of difference
+    numpy.testing.assert_allclose(b["points"][-1], a["points"][-1], rtol=0, atol=1e-2)
+    # every waypoint of the merged mission is one of the original, in the same order
+    wa, j = replay.waypoints(a), 0
+    for p in replay.waypoints(b):
+        while j < len(wa) and numpy.abs(wa[j] - p).max() > 1e-2:
+            j += 1
+        assert j < len(wa)
+
+@pytest.mark.parametrize("tolerance", [8, 64])
+@pytest.mark.parametrize("seed", range(6))
+def test_folded_turns(seed, tolerance):
+    cmds = randomMission(seed)
+    a, b = fly(cmds), fly(optimize(cmds, tolerance, fmt=(8, False)))
+    assert b["heading"][-1] == a["heading"][-1]
+    # each segment is off by less than the tolerance
+    bound = pathLength(a) * tolerance * math.pi / 0x8000 + 1e-2
+    assert numpy.abs(b["points"][-1] - a["points"][-1]).max() <= bound
+    assert len(b["op"]) <= len(a["op"])
+
+def test_merged_lengths_fit_a_word():
+    cmds = list(peephole([Forward(40000), Forward(40000), Forward(3)], fmt=(8, False)))
+    assert cmds == [Forward(40000), Forward(40003)]
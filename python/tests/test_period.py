@@ -0,0 +1,46 @@
+# coding: UTF-8
+#
+## Tests of the period finder: a range covering the period of a curve more than once
+#  is clipped to one period, and flies the mission of the correct range.
+#
+import numpy
+import pytest
+import polar, replay
+from math import pi
+from flailDriver import FlailDriver
+
+## Widen the range of the c-th curve k times, in the curves the next contexts are given.
+def widen(monkeypatch, c, k):
+    func, turns, initialAng, name = polar.curveList[c][:4]
+    curves = list(polar.curveList)
+    curves[c] = (func, k * turns, initialAng, name)
+    monkeypatch.setattr(polar, "curveList", curves)
+
+@pytest.mark.parametrize("c", range(25))
+def test_ranges_not_retraced(c):
+    func, turns, initialAng = polar.curveList[c][:3]
+    assert polar.curvePeriod(func, turns, initialAng, polar.CurveContext(radius=80.0)) == 1
+
+@pytest.mark.parametrize("c, k", [(7, 2), (7, 4), (2, 2), (3, 3)])
+def test_widened_range(c, k, draw, monkeypatch):
+    func, turns, initialAng, name = polar.curveList[c][:4]
+    assert polar.curvePeriod(func, k * turns, initialAng, polar.CurveContext(radius=80.0)) == k
+    joe = FlailDriver.inMemory()
+    draw(joe, c, num_sides=60)
+    widen(monkeypatch, c, k)
+    # the number of segments follows the clipped range
+    wide = FlailDriver.inMemory()
+    out = draw(wide, c, num_sides=60)
+    assert "retraces itself %d times" % k in out and "range clipped" in out
+    assert wide.contents() == joe.contents()
+
+def test_report(draw, monkeypatch):
+    widen(monkeypatch, 7, 2)
+    joe = FlailDriver.inMemory()
+    out = draw(joe, 7, period="report", symmetry=False)
+    assert "retraces itself 2 times" in out and "clipped" not in out
+    # the Circle, of radius 80, is flown twice
+    traj = replay.replay(joe.contents()["output.flail"])
+    assert abs(numpy.sqrt((numpy.diff(traj["points"], axis=0)**2).sum(axis=1)).sum() - 4 * pi * 80) < 2
+    out = draw(FlailDriver.inMemory(), 7, period="off")
+    assert "retraces" not in out
@@ -0,0 +1,82 @@
+# coding: UTF-8
+#
+## Tests of replay: the trajectory replayed from the FLAIL text of a mission
+#  is the one FlailDriver tracked while writing it.
+#
+import io, random
+import numpy
+import pytest
+import replay
+from flailDriver import FlailDriver
+from mission import drive, Forward, Backward, Left, Right, Ascend, Descend, Repeat, SetFormat
+
+## Return a random command: a move by a 16-bit length code, or a turn by a UBAM angle.
+def randomCommand(rng):
+    kind = rng.choice((Forward, Backward, Ascend, Descend, Left, Right))
+    return kind(rng.randint(1, 0xFFFF))
+
+## Return a random mission in a given format, with Repeat blocks of a few commands.
+#  waypoints is the one of the blocks (see mission.Repeat).
+def randomMission(seed, fmt, n=120, waypoints=None):
+    rng = random.Random(seed)
+    cmds = [SetFormat(fmt)]
+    for i in range(n):
+        if rng.random() < 0.15:
+           cmds.append(Repeat(rng.randint(1, 40), [randomCommand(rng) for k in range(rng.randint(1, 4))], waypoints))
+        else:
+           cmds.append(randomCommand(rng))
+    return cmds
+
+## Drive a mission with an in-memory FlailDriver.
+#  @return the driver and its outputs (see FlailDriver.contents).
+def driveMission(cmds, repeatWaypoints=False):
+    joe = FlailDriver.inMemory()
+    joe.repeatWaypoints = repeatWaypoints
+    drive(cmds, joe)
+    return joe, joe.contents()
+
+## Return the points of a gps.flail text.
+def gpsPoints(text):
+    return numpy.loadtxt(io.StringIO(text), delimiter=",", ndmin=2)
+
+@pytest.mark.parametrize("fmt", ["BAM+Q8", "Q10", "Q4"])
+@pytest.mark.parametrize("seed", range(4))
+def test_waypoints(seed, fmt):
+    # the blocks ask for the waypoints of every iteration
+    joe, files = driveMission(randomMission(seed, fmt, waypoints=True))
+    traj = replay.replay(files["output.flail"])
+    wpts = replay.waypoints(traj)
+    gps = gpsPoints(files["gps.flail"])
+    assert wpts.shape[0] == gps.shape[0] == joe.wptOrder + 1
+    # gps.flail has 6 decimals, and no height
+    numpy.testing.assert_allclose(wpts[:, :2], gps[:, :2], rtol=0, atol=1e-6)
+
+@pytest.mark.parametrize("repeatWaypoints", [True, False])
+@pytest.mark.parametrize("seed", range(4))
+def test_final_state(seed, repeatWaypoints):
+    joe, files = driveMission(randomMission(seed, "BAM+Q8"), repeatWaypoints)
+    traj = replay.replay(files["output.flail"])
+    s = joe.state
+    assert traj["position"][-1].tolist() == [s.x, s.y, s.z]
+    assert traj["heading"][-1] == s.heading
+
+def test_repeat_expanded():
+    joe, files = driveMission([SetFormat("Q8"), Repeat(3, [Forward(256), Left(0x4000)]), Ascend(512)])
+    traj = replay.replay(files["output.flail"])
+    assert len(traj["op"]) == 1 + 6 + 1
+    assert traj["points"][-1].tolist() == [0.0, 1.0, 2.0]
+    assert traj["heading"][-1] == 0xC000
+
+def test_unclosed_repeat():
+    with pytest.raises(ValueError):
+       replay.replay("SetMode(distance);\nRepeat 2 {\nForward(10);\n")
+
+def test_repeat_default_waypoints():
+    # by default, a block with no net turn is applied at once, with a single waypoint at its end
+    body = [Forward(768), Left(0x4000), Ascend(256), Right(0x4000)]
+    once, files = driveMission([SetFormat("Q8"), Repeat(1, body)])
+    joe, files = driveMission([SetFormat("Q8"), Repeat(10**12, body)])
+    s = once.state
+    assert [joe.state.x, joe.state.y, joe.state.z, joe.state.heading] == [10**12 * s.x, 10**12 * s.y, 10**12 * s.z, s.heading]
+    assert joe.wptOrder == once.wptOrder + 1
+    assert gpsPoints(files["gps.flail"]).shape[0] == joe.wptOrder + 1
@@ -0,0 +1,43 @@
+# coding: UTF-8
+#
+## Tests of the startup of polar: neither numpy nor tkinter are loaded when nothing is computed.
+#
+import os, sys, subprocess
+import curvecache
+from flailDriver import FlailDriver
+
+python = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+docRose = os.path.join(python, "docRose")
+
+## Run python code in a new process, with the modules of python and docRose, as flail.sh does.
+#  @return what it printed, and its import times (see python -X importtime).
+def run(code, *args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join((docRose, python)))
+    p = subprocess.run([sys.executable, "-X", "importtime", "-W", "ignore", "-c", code] + list(args),
+                       cwd=docRose, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert p.returncode == 0, p.stderr
+    return p.stdout, p.stderr
+
+## Code printing whether numpy was loaded: it is imported lazily, when it is first used (see bam.lazyImport).
+numpyLoaded = 'print("numpy loaded: %s" % (type(sys.modules["numpy"]).__name__ != "_LazyModule"))'
+
+## Return whether a module was imported, given the import times.
+imported = lambda times, name: any(line.split("|")[-1].strip() == name for line in times.splitlines())
+
+def test_help():
+    out, times = run("import sys, polar; polar.main(['polar.py', '-h'])\n" + numpyLoaded)
+    assert "Usage" in out and "numpy loaded: False" in out
+    assert not imported(times, "tkinter")
+
+def test_cached_curve(draw, tmp_path, monkeypatch):
+    monkeypatch.setattr(curvecache, "cacheDir", str(tmp_path / "cache"))
+    draw(FlailDriver.inMemory(), 3)
+    # the same curve, in the settings of the draw fixture
+    out, times = run("""import sys, polar, curvecache
+from flailDriver import FlailDriver
+curvecache.cacheDir = sys.argv[1]
+ctx = polar.CurveContext(joe=FlailDriver.inMemory(), usingFlail=True, tname=sys.argv[2], radius=80.0, num_sides=120, debug=False)
+polar.drawCurve(3, None, 120, ctx)
+""" + numpyLoaded, curvecache.cacheDir, str(tmp_path / "turtle.txt"))
+    assert "cached" in out and "numpy loaded: False" in out
+    assert not imported(times, "tkinter")
@@ -0,0 +1,55 @@
+# coding: UTF-8
+#
+## Tests of the symmetric curves emitted once per period, inside a Repeat block:
+#  the drone flies the mission of the curve emitted segment by segment.
+#
+import re
+import numpy
+import pytest
+import polar, replay
+from flailDriver import FlailDriver
+
+## Draw a curve with and without its symmetry.
+#  @return the outputs of both drivers (see FlailDriver.contents), and what was printed with the symmetry.
+def drawBoth(draw, c, **kw):
+    flat, rep = FlailDriver.inMemory(), FlailDriver.inMemory()
+    draw(flat, c, symmetry=False, **kw)
+    out = draw(rep, c, **kw)
+    return flat, rep, out
+
+@pytest.mark.parametrize("c", [1, 2, 3, 4, 7, 23])
+def test_same_mission(draw, c):
+    flat, rep, out = drawBoth(draw, c)
+    assert "Symmetry" in out
+    a, b = flat.contents(), rep.contents()
+    assert b["gps.flail"] == a["gps.flail"] and b["gps.txt"] == a["gps.txt"]
+    s, t = flat.state, rep.state
+    assert (t.heading, t.x, t.y, t.z, rep.wptOrder) == (s.heading, s.x, s.y, s.z, flat.wptOrder)
+    # the same flight, in a fraction of the commands
+    fa, fb = replay.replay(a["output.flail"]), replay.replay(b["output.flail"])
+    assert (fb["position"] == fa["position"]).all()
+    # each of the other periods had at least a line per segment
+    n, p = map(int, re.search(r"Symmetry: (\d+) periods of (\d+) segments", out).groups())
+    assert "Repeat %d {" % n in b["output.flail"]
+    assert b["output.flail"].count("\n") <= a["output.flail"].count("\n") - (n - 1) * p + 2
+
+@pytest.mark.parametrize("staircase", [False, True])
+def test_helix(draw, tmp_path, staircase):
+    # a symmetric point list in 3D, climbing the same height at each segment
+    t = numpy.arange(61) * 2 * numpy.pi / 20
+    fname = str(tmp_path / "helix.txt")
+    numpy.savetxt(fname, numpy.column_stack((50 * numpy.cos(t), 50 * numpy.sin(t), 2 * numpy.arange(61))), delimiter=",")
+    flat, rep, out = drawBoth(draw, 25, toRead=fname, staircase=staircase)
+    # the steps of a staircase are Repeat blocks already, and FLAIL has no nested Repeat
+    assert ("Symmetry" in out) != staircase
+    assert rep.contents()["gps.txt"] == flat.contents()["gps.txt"]
+    assert (rep.state.x, rep.state.y, rep.state.z) == (flat.state.x, flat.state.y, flat.state.z)
+
+def test_circle_period():
+    ctx = polar.CurveContext(usingFlail=True, num_sides=120, radius=80.0)
+    pts, sign = polar.evalCurve(polar.curveList[7][0], polar.curveList[7][1], 0, 120, ctx)
+    geo = polar.quantizeSegments(polar.curveGeometry(pts), ctx)
+    assert polar.segmentPeriod(geo, sign, ctx) == (1, 119)
+    # a segment off the period: no symmetry
+    geo["forward"][60] += 1
+    assert polar.segmentPeriod(geo, sign, ctx) is None
@@ -0,0 +1,52 @@
+# coding: UTF-8
+#
+## Tests of the segment-count tuner: the smallest number of segments within a maximum deviation,
+#  stored per curve and settings, and used by drawCurve.
+#
+from copy import copy
+import pytest
+import polar
+from flailDriver import FlailDriver
+
+## Return a context with the settings of the draw fixture.
+context = lambda **kw: polar.CurveContext(**dict(dict(usingFlail=True, radius=80.0, num_sides=120, debug=False), **kw))
+
+## Return the deviation of the c-th curve, sampled with nseg segments.
+def deviation(c, nseg, ctx):
+    ctx = copy(ctx)
+    curve = polar.prepareCurve(c, None, ctx.num_sides, ctx)
+    return polar.pathDeviation(curve[0], curve[1], curve[2], nseg, ctx)
+
+@pytest.mark.parametrize("c", [7, 12, 21])
+@pytest.mark.parametrize("closedLoop", [False, True])
+def test_smallest(c, closedLoop, capsys):
+    ctx = context(closedLoop=closedLoop)
+    n, dev = polar.tuneCurve(c, 0.5, ctx)
+    assert dev == deviation(c, n, ctx) <= 0.5
+    assert deviation(c, n - 1, ctx) > 0.5
+    assert ctx.num_sides == 120 and ctx.fmt == polar.getFormat()
+
+def test_not_enough(tmp_path, capsys):
+    # in open loop, the errors of the three-petal rose build up with the number of segments
+    fname = str(tmp_path / "tuned.json")
+    assert polar.tuneCurves([3], 0.5, fname, context()) == 1
+    assert "(see --closedloop)" in capsys.readouterr().out
+    assert polar.loadTuned(fname) is None
+    assert polar.tuneCurve(3, 0.5, context(closedLoop=True)) is not None
+
+def test_point_list():
+    assert polar.tuneCurve(25, 0.5, context()) is None
+
+def test_stored_and_used(draw, tmp_path, capsys):
+    fname = str(tmp_path / "tuned.json")
+    assert polar.tuneCurves([7, 25], 0.5, fname, context()) == 0
+    n, dev = polar.tuneCurve(7, 0.5, context())
+    table = polar.loadTuned(fname)
+    assert [e["nseg"] for e in table["Circle"]] == [n]
+    assert "Number of segments = %d " % n in draw(FlailDriver.inMemory(), 7, tuned=table)
+    # other settings are tuned apart
+    assert "Number of segments = 120 " in draw(FlailDriver.inMemory(), 7, tuned=table, radius=40.0)
+    assert polar.tuneCurves([7], 0.5, fname, context(radius=40.0)) == 0
+    assert polar.tuneCurves([7], 0.1, fname, context()) == 0
+    entries = polar.loadTuned(fname)["Circle"]
+    assert sorted((e["scale"], e["maxDeviation"]) for e in entries) == [(40.0, 0.5), (80.0, 0.1)]
@@ -0,0 +1,67 @@
+# coding: UTF-8
+#
+## Tests of validator: each class of diagnostic, with the line it is reported on.
+#
+import random
+import pytest
+import validator
+from flailDriver import FlailDriver
+from mission import drive, Forward, Backward, Left, Right, Ascend, Descend, Repeat
+
+## FLAIL texts, and the (line, class) of the diagnostics they must give.
+CASES = [
+    ("SetMode(distance);\nForward(10);\nRepeat 2 {\nRollLeft(100);\n}\n", []),
+    ("Forward(1) 2;\n", [(1, "tokenization")]),
+    ("Forward(0.5);\n();\n", [(2, "tokenization")]),
+    ("Forward();\n", [(1, "parameter")]),
+    ("SetMode(distance);\nForward(ten);\n", [(2, "parameter")]),
+    ("Repeat\n", [(1, "parameter")]),
+    ("Repeat 2 [\n}\n", [(1, "parameter")]),
+    ("Forward(1.5);\n", [(1, "percentage")]),
+    ("Forward(0.5);\nBackward(0.5);\n", [(2, "conflict")]),
+    ("SetMode(distance);\nForward(5);\nBackward(5);\n", []),
+    ("Forward(0.5);\nForward(0);\nBackward(0.5);\n", []),
+    ("Fly(1);\n", [(1, "command")]),
+    ("}\n", [(1, "command")]),
+    ("SetMode(fast);\n", [(1, "mode")]),
+    ("Repeat 2 {\nRepeat 3 {\n}\n", [(2, "nested")]),
+    ("Repeat 0 {\n}\n", [(1, "repetitions")]),
+    ("Repeat -2 {\n}\n", [(1, "repetitions")]),
+    ("Forward(0.1);\nRepeat 2 {\nForward(0.1);\n", [(2, "unclosed")]),
+    ("# QFormat(Q8)\nForward(0.1); # a comment (with a parenthesis\n", []),
+    ("SetMode(distance);\r\nForward(10);\r\n", []),
+    ("Fly(1);\nSetMode(fast);\nRepeat 0 {\n", [(1, "command"), (2, "mode"), (3, "repetitions"), (3, "unclosed")]),
+]
+
+@pytest.mark.parametrize("text, expected", CASES)
+def test_diagnostics(text, expected):
+    assert [d[:2] for d in validator.validate(text)] == expected
+
+def test_every_class_covered():
+    kinds = set(k for text, expected in CASES for line, k in expected)
+    assert kinds == {"tokenization", "parameter", "percentage", "conflict", "command", "mode", "nested", "repetitions", "unclosed"}
+
+def test_warnings_are_not_errors():
+    diagnostics = validator.validate("Repeat 2 {\nForward(0.1);\n")
+    assert diagnostics and validator.errors(diagnostics) == []
+    assert validator.errors(validator.validate("Fly(1);\n"))
+
+def test_format():
+    d = validator.validate("SetMode(fast);\n")[0]
+    assert validator.formatDiagnostic(d, "a.flail") == "a.flail:1: mode: " + d[2]
+
+def test_validator_state():
+    v = validator.Validator("distance")
+    assert validator.validate("Forward(5);\nBackward(5);\n", v) == []
+    assert v.mode == "distance"
+
+def test_driver_missions_are_valid():
+    rng = random.Random(1)
+    cmds = []
+    for i in range(200):
+        kind = rng.choice((Forward, Backward, Ascend, Descend, Left, Right))
+        cmd = kind(rng.randint(1, 0xFFFF))
+        cmds.append(Repeat(rng.randint(1, 9), [cmd]) if rng.random() < 0.1 else cmd)
+    joe = FlailDriver.inMemory()
+    drive(cmds, joe)
+    assert joe.validate() == []
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# coding: UTF-8
+#
+## @package validator
+#
+#  Validation of FLAIL texts, with the checks of the C interpreter (flail.c interpretTokens),
+#  so missions can be checked in-process, without compiling and running flail.c.
+#
+#  The text is read in a single pass: a regular expression yields each statement (the text up to a ';' or a newline),
+#  which is split into tokens at the delimiters of flail.c (space, comma, parentheses and tab).
+#  A token starting with '#' comments out the rest of its statement.
+#
+#  flail.c stops at the first error. Here, every error is reported, with its line number and its class:
+#  - tokenization: a statement with more than two tokens, or with nothing but delimiters.
+#  - parameter: a missing or invalid parameter, or a malformed Repeat.
+#  - percentage: an intensity above 1.0.
+#  - conflict: in intensity mode, an instruction while the opposite one is still active (Forward and Backward, ...).
+#  - command: an unknown instruction, or a '}' outside a Repeat block.
+#  - mode: an unknown mode in SetMode.
+#  - nested: a Repeat inside a Repeat block.
+#  - repetitions: a Repeat with a count below or equal to 0.
+#  - unclosed: a Repeat block never closed. flail.c only warns about it, so it is in WARNINGS.
+#
+#  Unlike flail.c, a carriage return is a delimiter, so files with DOS line endings are accepted.
+#
+import sys, re
+
+## Statements: the text up to a ';', a newline or the end of the text.
+STATEMENT = re.compile(r"([^;\n]*)(;|\n|$)")
+
+## Tokens of a statement.
+TOKEN = re.compile(r"[^ ,()\t\r]+")
+
+## Numbers, as accepted by atoi and atof.
+NUMBER = re.compile(r"[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$")
+
+## Instructions whose parameter is a length or an angle, with the opposite instruction (see UsedInstructions in flail.h).
+OPPOSITE = {"Ascend": "Descend", "Descend": "Ascend", "Forward": "Backward", "Backward": "Forward",
+            "Left": "Right", "Right": "Left", "RollLeft": "RollRight", "RollRight": "RollLeft"}
+
+## Instructions whose parameter is always an integer.
+TIMERS = ("Wait", "WaitMili")
+
+## Classes of diagnostics that do not stop flail.c.
+WARNINGS = ("unclosed",)
+
+## Checker of FLAIL statements, keeping the state of the C interpreter.
+class Validator:
+
+    ## Constructor.
+    #  @param mode initial mode (the flail.c default is intensity).
+    def __init__(self, mode="intensity"):
+        ## diagnostics found, as (line, class, message) tuples.
+        self.diagnostics = []
+        ## current mode.
+        self.mode = mode
+        ## line of the open Repeat block, or None.
+        self.block = None
+        ## whether each instruction of OPPOSITE is active: its last parameter was positive.
+        self.used = dict.fromkeys(OPPOSITE, False)
+
+    ## Record a diagnostic.
+    def report(self, line, kind, message):
+        self.diagnostics.append((line, kind, message))
+
+    ## Check a statement.
+    #
+    #  @param tokens tokens of the statement, without the comment.
+    #  @param line line number.
+    #
+    def statement(self, tokens, line):
+        cmd = tokens[0]
+        if cmd == "Repeat":
+           if len(tokens) < 2:
+              self.report(line, "parameter", "Repeat must be followed by the number of repetitions")
+              return
+           if len(tokens) >= 3 and tokens[2] != "{":
+              self.report(line, "parameter", "Repeat must follow the structure: Repeat [times] { [commands] }")
+           if self.block is not None:
+              self.report(line, "nested", "nested Repeat, in the block of line %d" % self.block)
+              return
+           self.block = line
+           if not NUMBER.match(tokens[1]) or int(float(tokens[1])) <= 0:
+              self.report(line, "repetitions", "number of repetitions is below or equal to 0: %s" % tokens[1])
+           return
+        if cmd == "}" and self.block is not None:
+           self.block = None
+           return
+        if len(tokens) > 2:
+           self.report(line, "tokenization", "instructions must be separated by a ';': %s" % " ".join(tokens))
+           return
+        if cmd not in OPPOSITE and cmd not in TIMERS and cmd != "SetMode":
+           self.report(line, "command", "invalid command: %s" % cmd)
+           return
+        if len(tokens) < 2:
+           self.report(line, "parameter", "missing parameter: %s" % cmd)
+           return
+        param = tokens[1]
+        if cmd == "SetMode":
+           if param in ("intensity", "distance"):
+              self.mode = param
+           else:
+              self.report(line, "mode", "unknown mode: %s (accepted modes are intensity and distance)" % param)
+           return
+        if not NUMBER.match(param):
+           self.report(line, "parameter", "invalid parameter: %s(%s)" % (cmd, param))
+           return
+        if cmd in TIMERS or self.mode == "distance":
+           value = int(float(param))
+        else:
+           value = int(float(param) * 100)
+           if value > 100:
+              self.report(line, "percentage", "percentage out of [0.0,1.0]: %s(%s)" % (cmd, param))
+        if cmd in OPPOSITE:
+           if self.used[OPPOSITE[cmd]] and self.mode == "intensity":
+              self.report(line, "conflict", "conflicting instructions found before %s %s" % (cmd, param))
+           self.used[cmd] = value > 0
+
+    ## Check the end of the text.
+    #  @param line number of the last line.
+    def end(self, line):
+        if self.block is not None:
+           self.report(self.block, "unclosed", "Repeat block never closed with a '}'")
+
+## Validate a FLAIL text.
+#
+#  @param text FLAIL text.
+#  @param validator Validator to use, to keep its state. By default, a new one, in intensity mode.
+#  @return a list of diagnostics: (line, class, message) tuples, in the order they were found.
+#
+def validate(text, validator=None):
+    v = validator or Validator()
+    line = 1
+    blank = True
+    for stmt, sep in STATEMENT.findall(text):
+        if sep == "\n" and stmt.endswith("\r"):
+           stmt = stmt[:-1]
+        if stmt:
+           tokens = TOKEN.findall(stmt)
+           for i, t in enumerate(tokens):
+               if t[0] == "#":
+                  del tokens[i:]
+                  break
+           if tokens:
+              v.statement(tokens, line)
+           elif not TOKEN.search(stmt) and not (blank and sep != ";" and stmt.strip(" ") == ""):
+              v.report(line, "tokenization", "statement without instruction")
+        if sep == "\n":
+           line += 1
+           blank = True
+        else:
+           blank = False
+    v.end(line)
+    return v.diagnostics
+
+## Return the errors of a list of diagnostics, leaving the warnings out.
+errors = lambda diagnostics: [d for d in diagnostics if d[1] not in WARNINGS]
+
+## Return a diagnostic as text: "file:line: class: message".
+formatDiagnostic = lambda d, fname="": "%s:%d: %s: %s" % (fname, d[0], d[1], d[2])
+
+def main():
+    status = 0
+    for fname in sys.argv[1:]:
+        with open(fname) as f:
+           diagnostics = validate(f.read())
+        for d in diagnostics:
+            print(formatDiagnostic(d, fname))
+        if errors(diagnostics):
+           status = 1
+    return status
+
+if __name__=="__main__":
+   sys.exit(main())